@@ -1 +1,3 @@
+# Профиль SQLite должен быть зарегистрирован до первого соединения в любом процессе
+from mementonos.utils import db
 from mementonos.pages import index, feed, media_page
\ No newline at end of file
@@ -0,0 +1,179 @@
+import math
+import os
+import time
+import reflex as rx
+from dataclasses import dataclass
+from typing import Optional
+from sqlmodel import select
+from dotenv import load_dotenv
+from fastapi import Request, HTTPException
+
+from mementonos.models import FileEncrypted
+from mementonos.state.feed import get_partner_id
+from mementonos.utils.security import decode_jwt
+from mementonos.utils.cache import get_master_key_async
+from mementonos.utils.executors import run_io
+from mementonos.utils.ttl_cache import TTLCache
+from mementonos.utils.rate_limit import RateLimited, check_rate_limit_async
+from mementonos.utils.logger import get_logger
+
+load_dotenv()
+logger = get_logger(__name__)
+
+TOKEN_COOKIE = "mementonos_token"
+AUTH_TOKEN_TTL = float(os.getenv("AUTH_TOKEN_TTL", 300))
+AUTH_ACL_TTL = float(os.getenv("AUTH_ACL_TTL", 60))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", 4096))
+
+# token -> user_id. Запись живёт не дольше exp самого токена
+_verified_tokens: TTLCache[int] = TTLCache(AUTH_CACHE_SIZE, AUTH_TOKEN_TTL)
+# item_id -> FileEncrypted (отсоединённая от сессии, только для чтения)
+_records: TTLCache[FileEncrypted] = TTLCache(AUTH_CACHE_SIZE, AUTH_ACL_TTL)
+# user_id -> (partner_id,). Кортеж, чтобы отличать «нет пары» от промаха
+_partners: TTLCache[tuple[Optional[int]]] = TTLCache(AUTH_CACHE_SIZE, AUTH_ACL_TTL)
+
+
+@dataclass
+class MediaAccess:
+    """Результат проверки доступа к файлу."""
+    user_id: int
+    record: FileEncrypted
+    master_key: bytes
+
+
+def verify_token(token: Optional[str]) -> int:
+    """Возвращает user_id из токена или бросает 401. Проверенные токены кэшируются."""
+    if not token:
+        raise HTTPException(status_code=401, detail="Не авторизован")
+
+    user_id = _verified_tokens.get(token)
+    if user_id is not None:
+        return user_id
+
+    payload = decode_jwt(token)
+    try:
+        user_id = int(payload.get("sub"))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=401, detail="Недействительный токен")
+
+    _verified_tokens.set(token, user_id, ttl=payload.get("exp", 0) - time.time())
+    return user_id
+
+
+def _load_record(item_id: int) -> Optional[FileEncrypted]:
+    with rx.session() as session:
+        return session.get(FileEncrypted, item_id)
+
+
+def _load_partner(user_id: int) -> Optional[int]:
+    with rx.session() as session:
+        return get_partner_id(user_id, session)
+
+
+async def load_record(item_id: int, fresh: bool = False) -> FileEncrypted:
+    """
+    Запись файла из кэша или БД; 404, если её нет.
+    fresh=True — перечитать из БД: воркер в другом процессе мог дописать производные.
+    """
+    record = None if fresh else _records.get(item_id)
+    if record is None:
+        record = await run_io(_load_record, item_id)
+        if not record:
+            raise HTTPException(status_code=404, detail="Файл не найден")
+        _records.set(item_id, record)
+    return record
+
+
+async def load_partner(user_id: int) -> Optional[int]:
+    cached = _partners.get(user_id)
+    if cached is None:
+        cached = (await run_io(_load_partner, user_id),)
+        _partners.set(user_id, cached)
+    return cached[0]
+
+
+async def media_access(item_id: int, request: Request) -> MediaAccess:
+    """
+    FastAPI-зависимость для /api/media/{item_id}/...: токен, права и мастер-ключ.
+    Доступ есть у владельца, а к общим файлам — и у партнёра по паре.
+    """
+    user_id = verify_token(request.cookies.get(TOKEN_COOKIE))
+    record = await load_record(item_id)
+
+    if record.uploaded_by_id != user_id:
+        if not record.is_common or record.uploaded_by_id != await load_partner(user_id):
+            raise HTTPException(status_code=403, detail="Нет доступа к файлу")
+
+    master_key = await get_master_key_async(user_id)
+    if not master_key:
+        raise HTTPException(status_code=401, detail="Требуется мастер ключ")
+
+    return MediaAccess(user_id=user_id, record=record, master_key=master_key)
+
+
+@dataclass
+class BatchMediaAccess:
+    """Результат одной проверки доступа сразу к нескольким файлам."""
+    user_id: int
+    records: dict[int, FileEncrypted]
+    master_key: bytes
+
+
+def _load_records(item_ids: list[int]) -> list[FileEncrypted]:
+    with rx.session() as session:
+        return session.exec(select(FileEncrypted).where(FileEncrypted.id.in_(item_ids))).all()
+
+
+async def batch_media_access(item_ids: list[int], request: Request) -> BatchMediaAccess:
+    """
+    Как media_access, но для порции ленты: один токен, один запрос к БД, один мастер-ключ.
+    Записи всегда читаются из БД (так свежее thumbnail_path) и обновляют кэш.
+    Несуществующих id в ответе нет; чужой файл — 403 на весь запрос.
+    """
+    user_id = verify_token(request.cookies.get(TOKEN_COOKIE))
+    records = {record.id: record for record in await run_io(_load_records, item_ids)}
+
+    for record in records.values():
+        _records.set(record.id, record)
+        if record.uploaded_by_id != user_id:
+            if not record.is_common or record.uploaded_by_id != await load_partner(user_id):
+                raise HTTPException(status_code=403, detail="Нет доступа к файлу")
+
+    master_key = await get_master_key_async(user_id)
+    if not master_key:
+        raise HTTPException(status_code=401, detail="Требуется мастер ключ")
+
+    return BatchMediaAccess(user_id=user_id, records=records, master_key=master_key)
+
+
+def rate_limited(policy: str):
+    """
+    FastAPI-зависимость маршрута: лимит policy на пользователя, сверх него — 429 с Retry-After.
+    Проверяется до чтения записи и мастер-ключа.
+    """
+    async def dependency(request: Request):
+        user_id = verify_token(request.cookies.get(TOKEN_COOKIE))
+        try:
+            await check_rate_limit_async(policy, f"user:{user_id}")
+        except RateLimited as e:
+            raise HTTPException(status_code=429, detail=str(e),
+                                headers={"Retry-After": str(math.ceil(e.retry_after))})
+    return dependency
+
+
+def invalidate_item(item_id: int):
+    """Сбрасывает кэш записи, например после загрузки файла с этим id."""
+    _records.pop(item_id)
+
+
+def invalidate_user(user_id: int):
+    """Сбрасывает кэш пары пользователя."""
+    _partners.pop(user_id)
+
+
+def auth_cache_stats() -> dict:
+    return {
+        "tokens": _verified_tokens.stats(),
+        "records": _records.stats(),
+        "partners": _partners.stats(),
+    }
@@ -1,155 +1,314 @@
-import reflex as rx
+import asyncio
+import os
 import secrets
-from pathlib import Path
 from dotenv import load_dotenv
-import os
+from pathlib import Path
+from typing import Optional
 from urllib.parse import quote
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import Response, FileResponse
+from fastapi import FastAPI, Request, HTTPException, Depends
+from fastapi.responses import Response, StreamingResponse
 from mementonos.models import FileEncrypted
 from mementonos.state.feed import get_mime_type
-from mementonos.utils.security import decrypt_data, decode_jwt
-from mementonos.utils.thumbnails import create_image_thumbnail, create_video_thumbnail, create_placeholder_thumbnail
-from mementonos.utils.cache import get_master_key
+from mementonos.utils.security import decrypt_data
+from mementonos.utils.thumbnails import create_placeholder_thumbnail, rendition_path_for, build_sprite, RENDITION_SIZES
+from mementonos.utils.jobs import queue_stats, PRIORITY_INTERACTIVE
+from mementonos.utils.hls import PLAYLIST_NAME, SEGMENT_RE
+from mementonos.utils.media_jobs import enqueue_ingest_jobs
+from mementonos.utils.encrypted_file import open_encrypted, read_decrypted
+from mementonos.utils.plaintext_cache import get_plaintext_cache
+from mementonos.utils.singleflight import SingleFlight
+from mementonos.utils.executors import io_pool, crypto_pool, run_io, run_crypto, executor_stats
+from mementonos.utils.cache import master_key_cache_stats
+from mementonos.utils.kdf import kdf_stats
+from mementonos.utils.rate_limit import rate_limit_stats
+from mementonos.api.auth import MediaAccess, media_access, batch_media_access, load_record, auth_cache_stats, rate_limited
+from mementonos.api.uploads import router as uploads_router
 import logging
 
 logger = logging.getLogger(__name__)
 load_dotenv()
 
+# Больше id в одном спрайте не принимаем: лента просит по items_per_page
+SPRITE_MAX_ITEMS = int(os.getenv("SPRITE_MAX_ITEMS", 60))
+# Внутренние счётчики (/api/stats) — только с заголовком Authorization: Bearer <STATS_TOKEN>.
+# Без STATS_TOKEN маршрут выключен
+STATS_TOKEN = os.getenv("STATS_TOKEN", "")
+
+# Одновременные запросы одной производной (миниатюра, превью, сегмент) ждут одно чтение.
+# Ключи: (item_id, вид, размер/имя)
+media_flight = SingleFlight()
+
+def parse_range(range_header: Optional[str], size: int) -> tuple[int, int]:
+    """
+    Разбирает заголовок Range (один диапазон bytes=...).
+    Возвращает полуинтервал [start, end). Без заголовка — весь файл.
+    """
+    if not range_header:
+        return 0, size
+
+    unit, _, spec = range_header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        raise HTTPException(status_code=416, detail="Неподдерживаемый диапазон",
+                            headers={"Content-Range": f"bytes */{size}"})
+
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = int(last) + 1 if last else size
+        else:
+            # bytes=-N — последние N байт
+            start = max(0, size - int(last))
+            end = size
+    except ValueError:
+        raise HTTPException(status_code=416, detail="Неверный диапазон",
+                            headers={"Content-Range": f"bytes */{size}"})
+
+    end = min(end, size)
+    if start >= end:
+        raise HTTPException(status_code=416, detail="Диапазон вне файла",
+                            headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+async def enqueue_missing(file_record: FileEncrypted):
+    """Ставит построение недостающих производных с интерактивным приоритетом."""
+    await media_flight.do_async(
+        (file_record.id, "enqueue"),
+        lambda: enqueue_ingest_jobs(file_record.id, file_record.extension, priority=PRIORITY_INTERACTIVE,
+                                    original_size=file_record.original_size),
+        executor=io_pool,
+    )
+
+def parse_ids(ids: str) -> list[int]:
+    """'1,2,3' → [1, 2, 3]; порядок сохраняется — от него зависят позиции в спрайте."""
+    try:
+        item_ids = [int(part) for part in ids.split(",") if part]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Неверный список id")
+    if not 0 < len(item_ids) <= SPRITE_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Нужно от 1 до {SPRITE_MAX_ITEMS} id")
+    return item_ids
+
+async def read_thumbnail(file_record: Optional[FileEncrypted], master_key: bytes) -> Optional[bytes]:
+    """Миниатюра файла или None, если её ещё нет (тогда ставится в очередь)."""
+    if file_record is None:
+        return None
+    try:
+        if not file_record.thumbnail_path:
+            raise FileNotFoundError(file_record.id)
+        return await media_flight.do_async(
+            (file_record.id, "thumbnail"),
+            lambda: read_decrypted(file_record.thumbnail_path, master_key, get_plaintext_cache()),
+            executor=crypto_pool,
+        )
+    except FileNotFoundError:
+        await enqueue_missing(file_record)
+    except Exception as e:
+        logger.error(f"Ошибка при чтении миниатюры для {file_record.id}: {e}")
+    return None
+
 def get_fastapi_app():
 
     fastapi_app = FastAPI(title="Mementonos API")
+    # Возобновляемая загрузка (tus): /api/uploads
+    fastapi_app.include_router(uploads_router)
 
-    @fastapi_app.get("/api/media/{item_id}/file")
-    async def get_media_file(item_id: int, request: Request):
+    @fastapi_app.get("/api/media/{item_id}/file", dependencies=[Depends(rate_limited("media_file"))])
+    async def get_media_file(item_id: int, request: Request, access: MediaAccess = Depends(media_access)):
         """Отдаёт расшифрованный файл по ID."""
-        token = request.cookies.get("mementonos_token")
-        
-        if not token:
-            raise HTTPException(status_code=401, detail="Не авторизован")
-        
+        file_record, master_key = access.record, access.master_key
+
         try:
-            payload = decode_jwt(token)
-            user_id = int(payload.get("sub"))
-        except Exception:
-            raise HTTPException(status_code=401, detail="Недействительный токен")
-        
-        with rx.session() as session:
-            file_record = session.get(FileEncrypted, item_id)
-            if not file_record:
-                raise HTTPException(status_code=404, detail="Файл не найден")
-            
-            if file_record.uploaded_by_id != user_id:
-                raise HTTPException(status_code=403, detail="Нет доступа к файлу")
-        
-        master_key = get_master_key(user_id)
-        if not master_key:
-            raise HTTPException(status_code=401, detail="Требуется мастер ключ")
-        
-        ext = file_record.extension or ".bin"
-        safe_filename = f"dec_{item_id}{ext}"
-        Path(f"{os.getenv('DATA_DIR')}/tmp").mkdir(parents=True, exist_ok=True)
-        decrypted_path = Path(f"{os.getenv('DATA_DIR')}/tmp") / safe_filename
-
-        should_decrypt = True
-        if decrypted_path.exists():
-            should_decrypt = False
-
-        if should_decrypt:
-            try:
-                with open(file_record.file_path, 'rb') as f:
-                    encrypted_data = f.read()
-                
-                decrypted_data = decrypt_data(encrypted_data, master_key)
-
-                tmp_name = f"{safe_filename}.writing.{secrets.token_hex(8)}"
-                tmp_path = Path(f"{os.getenv('DATA_DIR')}/tmp") / tmp_name
-
-                with open(tmp_path, "wb") as f:
-                    f.write(decrypted_data)
-                    f.flush()
-                    os.fsync(f.fileno())
-
-                # Переименование → атомарно
-                tmp_path.replace(decrypted_path)
-            
-            except Exception as e:
-                logger.error(f"Ошибка при расшифровке файла {item_id}: {e}")
-                if 'tmp_path' in locals() and tmp_path.exists():
-                    try:
-                        tmp_path.unlink()
-                    except:
-                        pass
-                raise HTTPException(status_code=500, detail="Ошибка при чтении файла")
-        
-        filename = decrypt_data(file_record.encrypted_name.encode('utf-8'), master_key).decode('utf-8')
+            # Имя — до открытия файла: если оно не расшифруется, закрывать нечего
+            filename = decrypt_data(file_record.encrypted_name.encode('utf-8'), master_key).decode('utf-8')
+            # Для старого формата здесь расшифровывается весь файл — не в event loop
+            reader = await run_crypto(open_encrypted, file_record.file_path, master_key, get_plaintext_cache())
+        except Exception as e:
+            logger.error(f"Ошибка при расшифровке файла {item_id}: {e}")
+            raise HTTPException(status_code=500, detail="Ошибка при чтении файла")
+
+        try:
+            start, end = parse_range(request.headers.get("range"), reader.size)
+        except HTTPException:
+            reader.close()
+            raise
+
         encoded_filename = quote(filename)
         mime_type = get_mime_type(file_record.extension)
 
         headers = {
             "Accept-Ranges": "bytes",
             "Content-Disposition": f"inline; filename*=UTF-8''{encoded_filename}",
+            "Content-Length": str(end - start),
+            "Cache-Control": "private, max-age=3600",
         }
+        status_code = 200
+        if request.headers.get("range"):
+            status_code = 206
+            headers["Content-Range"] = f"bytes {start}-{end - 1}/{reader.size}"
+
+        async def stream():
+            # Расшифровываются только чанки, покрывающие [start, end), каждый — в crypto-пуле
+            pieces = reader.iter_range(start, end)
+            try:
+                while (piece := await run_crypto(next, pieces, None)) is not None:
+                    yield piece
+            finally:
+                reader.close()
 
-        return FileResponse(
-            path=decrypted_path,
+        return StreamingResponse(
+            stream(),
+            status_code=status_code,
             media_type=mime_type,
-            filename=filename,
             headers=headers,
         )
-            
 
-    @fastapi_app.get("/api/media/{item_id}/thumbnail")
-    async def get_thumbnail(item_id: int, request: Request):
-        token = request.cookies.get("mementonos_token")
+    @fastapi_app.get("/api/media/{item_id}/thumbnail", dependencies=[Depends(rate_limited("media"))])
+    async def get_thumbnail(item_id: int, access: MediaAccess = Depends(media_access)):
+        file_record, master_key = access.record, access.master_key
+        if not file_record.thumbnail_path:
+            # Запись в кэше могла устареть: миниатюру строит воркер в другом процессе
+            file_record = await load_record(item_id, fresh=True)
 
-        if not token:
-            raise HTTPException(status_code=401, detail="Не авторизован")
-        
+        thumb_path = file_record.thumbnail_path
         try:
-            payload = decode_jwt(token)
-            user_id = int(payload.get("sub"))
-        except Exception:
-            raise HTTPException(status_code=401, detail="Недействительный токен")
-        
-        with rx.session() as session:
-            file_record = session.get(FileEncrypted, item_id)
-            if not file_record:
-                raise HTTPException(status_code=404, detail="Файл не найден")
-            
-            if file_record.uploaded_by_id != user_id:
-                raise HTTPException(status_code=403, detail="Нет доступа к файлу")
-        
-        master_key = get_master_key(user_id)
-        if not master_key:
-            raise HTTPException(status_code=401, detail="Требуется мастер ключ")
-        
-        try:
-            with open(file_record.file_path, 'rb') as f:
-                encrypted_data = f.read()
-            
-            decrypted_data = decrypt_data(encrypted_data, master_key)
-            
-            if file_record.extension.lower() in ('.jpg', '.jpeg', '.png', '.gif', '.webp'):
-                thumbnail_data = create_image_thumbnail(decrypted_data)
-            elif file_record.extension.lower() in ('.mp4', '.mov', '.avi', '.mkv'):
-                thumbnail_data = create_video_thumbnail(decrypted_data, file_record.extension)
-            else:
-                thumbnail_data = create_placeholder_thumbnail()
-            
+            if not thumb_path:
+                raise FileNotFoundError(item_id)
+            thumbnail_data = await media_flight.do_async(
+                (item_id, "thumbnail"),
+                lambda: read_decrypted(thumb_path, master_key, get_plaintext_cache()),
+                executor=crypto_pool,
+            )
+        except FileNotFoundError:
+            # Старые записи без миниатюры: строит воркер, пока отдаём заглушку
+            await enqueue_missing(file_record)
             return Response(
-                content=thumbnail_data,
+                content=create_placeholder_thumbnail(),
                 media_type="image/jpeg",
-                headers={"Cache-Control": "public, max-age=3600"}
+                headers={"Cache-Control": "no-store"}
+            )
+        except Exception as e:
+            logger.error(f"Ошибка при чтении миниатюры для {item_id}: {e}")
+            raise HTTPException(status_code=500, detail="Ошибка при чтении миниатюры")
+
+        return Response(
+            content=thumbnail_data,
+            media_type="image/jpeg",
+            headers={"Cache-Control": "private, max-age=86400"}
+        )
+
+    @fastapi_app.get("/api/media/sprite", dependencies=[Depends(rate_limited("sprite"))])
+    async def get_sprite(ids: str, request: Request):
+        """
+        Миниатюры порции ленты одним JPEG-спрайтом: одна проверка доступа и один
+        запрос к БД вместо отдельного /thumbnail на каждую плитку.
+        """
+        item_ids = parse_ids(ids)
+        access = await batch_media_access(item_ids, request)
+
+        thumbnails = await asyncio.gather(
+            *(read_thumbnail(access.records.get(item_id), access.master_key) for item_id in item_ids)
+        )
+        sprite = await run_crypto(build_sprite, thumbnails)
+
+        # С заглушками спрайт не кэшируется: миниатюры скоро появятся
+        complete = all(thumbnails)
+        return Response(
+            content=sprite,
+            media_type="image/jpeg",
+            headers={"Cache-Control": "private, max-age=86400" if complete else "no-store"}
+        )
+
+    @fastapi_app.get("/api/media/{item_id}/preview/{size}", dependencies=[Depends(rate_limited("media"))])
+    async def get_preview(item_id: int, size: int, access: MediaAccess = Depends(media_access)):
+        """Отдаёт превью изображения из пирамиды RENDITION_SIZES."""
+        file_record, master_key = access.record, access.master_key
+
+        if size not in RENDITION_SIZES:
+            raise HTTPException(status_code=404, detail="Нет такого размера превью")
+        if not file_record.renditions:
+            file_record = await load_record(item_id, fresh=True)
+
+        preview_path = rendition_path_for(file_record.file_path, size)
+        try:
+            if not file_record.renditions:
+                raise FileNotFoundError(preview_path)
+            preview_data = await media_flight.do_async(
+                (item_id, "preview", size),
+                lambda: read_decrypted(preview_path, master_key, get_plaintext_cache()),
+                executor=crypto_pool,
             )
+        except FileNotFoundError:
+            await enqueue_missing(file_record)
+            raise HTTPException(status_code=404, detail="Превью ещё не готово")
         except Exception as e:
-            logger.error(f"Ошибка при создании миниатюры для {item_id}: {e}")
-            raise HTTPException(status_code=500, detail="Ошибка при создании миниатюры")
+            logger.error(f"Ошибка при чтении превью {size} для {item_id}: {e}")
+            raise HTTPException(status_code=500, detail="Ошибка при чтении превью")
+
+        return Response(
+            content=preview_data,
+            media_type="image/jpeg",
+            headers={"Cache-Control": "private, max-age=86400"}
+        )
+
+    @fastapi_app.get("/api/media/{item_id}/hls/{name}", dependencies=[Depends(rate_limited("media"))])
+    async def get_hls(item_id: int, name: str, access: MediaAccess = Depends(media_access)):
+        """Плейлист и сегменты HLS; каждый файл расшифровывается отдельно."""
+        file_record, master_key = access.record, access.master_key
+        if not file_record.hls_path:
+            file_record = await load_record(item_id, fresh=True)
+
+        if not file_record.hls_path:
+            raise HTTPException(status_code=404, detail="HLS для файла не создан")
+
+        if name == PLAYLIST_NAME:
+            media_type = "application/vnd.apple.mpegurl"
+        elif SEGMENT_RE.match(name):
+            media_type = "video/mp2t"
+        else:
+            raise HTTPException(status_code=404, detail="Нет такого сегмента")
+
+        part_path = Path(file_record.hls_path) / f"{name}.enc"
+        try:
+            data = await media_flight.do_async(
+                (item_id, "hls", name),
+                lambda: read_decrypted(part_path, master_key, get_plaintext_cache()),
+                executor=crypto_pool,
+            )
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Нет такого сегмента")
+        except Exception as e:
+            logger.error(f"Ошибка при чтении HLS {name} для {item_id}: {e}")
+            raise HTTPException(status_code=500, detail="Ошибка при чтении HLS")
+
+        return Response(
+            content=data,
+            media_type=media_type,
+            headers={"Cache-Control": "private, max-age=86400"}
+        )
 
     @fastapi_app.get("/api/health")
     async def health_check():
         return {"status": "ok"}
 
+    @fastapi_app.get("/api/stats")
+    async def internal_stats(request: Request):
+        """Очередь, кэши и пулы — для мониторинга, не для клиентов."""
+        scheme, _, token = request.headers.get("authorization", "").partition(" ")
+        if not STATS_TOKEN or scheme.lower() != "bearer" or not secrets.compare_digest(token, STATS_TOKEN):
+            # Не выдаём, что маршрут существует
+            raise HTTPException(status_code=404)
+        return {
+            "jobs": await run_io(queue_stats),
+            "cache": get_plaintext_cache().stats(),
+            "singleflight": media_flight.stats(),
+            "executors": executor_stats(),
+            "auth": auth_cache_stats(),
+            "master_keys": master_key_cache_stats(),
+            "kdf": kdf_stats(),
+            "rate_limit": rate_limit_stats(),
+        }
+
     logger.debug('registered FastAPI endpoints')
 
     return fastapi_app
\ No newline at end of file
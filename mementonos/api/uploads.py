@@ -0,0 +1,266 @@
+import asyncio
+import base64
+import os
+import secrets
+import reflex as rx
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+from weakref import WeakValueDictionary
+from dotenv import load_dotenv
+from fastapi import APIRouter, Request, HTTPException
+from fastapi.responses import Response
+from starlette.requests import ClientDisconnect
+
+from mementonos.models import FileEncrypted, UploadSession, User
+from mementonos.state.upload import new_upload_path, add_uploaded
+from mementonos.utils.security import encrypt_data
+from mementonos.utils.encrypted_file import ChunkedWriter, DEFAULT_CHUNK_SIZE
+from mementonos.utils.cache import get_master_key_async
+from mementonos.utils.executors import run_io, run_crypto
+from mementonos.utils.upload_sessions import part_path_for
+from mementonos.api.auth import TOKEN_COOKIE, verify_token, invalidate_item
+import logging
+
+logger = logging.getLogger(__name__)
+load_dotenv()
+
+# Возобновляемая загрузка по протоколу tus 1.0 (core + creation + termination):
+#   POST   /api/uploads         Upload-Length, Upload-Metadata → Location
+#   HEAD   /api/uploads/{id}    → Upload-Offset
+#   PATCH  /api/uploads/{id}    Upload-Offset + тело → новый Upload-Offset
+#   DELETE /api/uploads/{id}
+# Upload-Offset после PATCH — всё присланное: целые чанки контейнера и зашифрованный хвост.
+# Mementonos-Chunk-Size — подсказка клиенту: куски, кратные ему, не оставляют хвостов.
+TUS_VERSION = "1.0.0"
+UPLOAD_MAX_SIZE = int(os.getenv("UPLOAD_MAX_SIZE", 10 * 1024 ** 3))
+
+router = APIRouter(prefix="/api/uploads")
+
+# Один PATCH на загрузку одновременно (в пределах процесса)
+_locks: WeakValueDictionary[str, asyncio.Lock] = WeakValueDictionary()
+
+
+def _lock_for(upload_id: str) -> asyncio.Lock:
+    lock = _locks.get(upload_id)
+    if lock is None:
+        lock = _locks[upload_id] = asyncio.Lock()
+    return lock
+
+
+# Браузерный клиент ходит на бэкенд с другого origin — без этого он не увидит ответ
+EXPOSE_HEADERS = "Location, Upload-Offset, Upload-Length, Tus-Resumable, Tus-Version, Mementonos-Chunk-Size, Mementonos-File-Id"
+
+
+def _tus_headers(**headers) -> dict:
+    return {
+        "Tus-Resumable": TUS_VERSION,
+        "Cache-Control": "no-store",
+        "Access-Control-Expose-Headers": EXPOSE_HEADERS,
+        **headers,
+    }
+
+
+def parse_metadata(header: Optional[str]) -> dict[str, str]:
+    """Upload-Metadata: 'filename ZmlsZS5qcGc=,is_common MQ==' → {'filename': 'file.jpg', ...}"""
+    metadata = {}
+    for pair in (header or "").split(","):
+        key, _, value = pair.strip().partition(" ")
+        if not key:
+            continue
+        try:
+            metadata[key] = base64.b64decode(value).decode("utf-8") if value else ""
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Неверное значение {key} в Upload-Metadata")
+    return metadata
+
+
+async def _authorize(request: Request) -> tuple[int, bytes]:
+    user_id = verify_token(request.cookies.get(TOKEN_COOKIE))
+    master_key = await get_master_key_async(user_id)
+    if not master_key:
+        raise HTTPException(status_code=401, detail="Требуется мастер ключ")
+    return user_id, master_key
+
+
+def _load_upload(upload_id: str, user_id: int) -> UploadSession:
+    with rx.session() as session:
+        upload = session.get(UploadSession, upload_id)
+    # Чужая загрузка неотличима от несуществующей
+    if not upload or upload.user_id != user_id:
+        raise HTTPException(status_code=404, detail="Загрузка не найдена", headers=_tus_headers())
+    return upload
+
+
+def _create_part(path: Path, master_key: bytes, length: int):
+    # Пока только заголовок контейнера; чанки допишет PATCH. Пустой файл сразу закрывается
+    with open(path, "wb") as f:
+        writer = ChunkedWriter(f, master_key)
+        if length == 0:
+            writer.close()
+
+
+def _save_offset(upload_id: str, offset: int):
+    with rx.session() as session:
+        upload = session.get(UploadSession, upload_id)
+        if upload:
+            upload.offset = offset
+            upload.updated_at = datetime.utcnow()
+            session.add(upload)
+            session.commit()
+
+
+def _finalize(upload: UploadSession) -> int:
+    """Перекладывает готовый контейнер к остальным файлам и заменяет загрузку записью FileEncrypted."""
+    uploaded_at = datetime.utcnow()
+    with rx.session() as session:
+        user = session.get(User, upload.user_id)
+        file_path = new_upload_path(user.pair_id, user.id, upload.is_common, uploaded_at)
+        Path(upload.part_path).replace(file_path)
+        try:
+            [item_id] = add_uploaded(session, [FileEncrypted(
+                file_path=str(file_path),
+                original_size=upload.length,
+                encrypted_name=upload.encrypted_name,
+                extension=upload.extension,
+                uploaded_by_id=user.id,
+                is_common=upload.is_common,
+                pair_id=user.pair_id,
+                uploaded_at=uploaded_at,
+                captured_at=uploaded_at,
+            )])
+            session.delete(session.get(UploadSession, upload.id))
+            session.commit()
+        except Exception:
+            file_path.replace(upload.part_path)
+            raise
+    invalidate_item(item_id)
+    logger.info(f"Загрузка {upload.id} завершена: файл {item_id}")
+    return item_id
+
+
+@router.options("")
+async def upload_options():
+    return Response(status_code=204, headers=_tus_headers(**{
+        "Tus-Version": TUS_VERSION,
+        "Tus-Extension": "creation,termination",
+        "Tus-Max-Size": str(UPLOAD_MAX_SIZE),
+    }))
+
+
+@router.post("")
+async def create_upload(request: Request):
+    user_id, master_key = await _authorize(request)
+    try:
+        length = int(request.headers["upload-length"])
+    except (KeyError, ValueError):
+        raise HTTPException(status_code=400, detail="Нужен Upload-Length", headers=_tus_headers())
+    if not 0 <= length <= UPLOAD_MAX_SIZE:
+        raise HTTPException(status_code=413, detail="Файл слишком большой", headers=_tus_headers())
+
+    metadata = parse_metadata(request.headers.get("upload-metadata"))
+    name = metadata.get("filename") or "Без имени"
+    upload = UploadSession(
+        id=secrets.token_urlsafe(16),
+        user_id=user_id,
+        part_path="",
+        encrypted_name=encrypt_data(name.encode("utf-8"), master_key).decode("utf-8"),
+        extension=Path(name).suffix.lower(),
+        is_common=metadata.get("is_common", "").lower() in ("1", "true"),
+        length=length,
+    )
+    upload.part_path = str(part_path_for(upload.id))
+    await run_crypto(_create_part, Path(upload.part_path), master_key, length)
+
+    def insert():
+        with rx.session() as session:
+            session.add(upload)
+            session.commit()
+            session.refresh(upload)
+    await run_io(insert)
+
+    headers = _tus_headers(**{
+        "Location": f"/api/uploads/{upload.id}",
+        "Upload-Offset": "0",
+        "Mementonos-Chunk-Size": str(DEFAULT_CHUNK_SIZE),
+    })
+    if length == 0:
+        headers["Mementonos-File-Id"] = str(await run_io(_finalize, upload))
+    return Response(status_code=201, headers=headers)
+
+
+@router.head("/{upload_id}")
+async def upload_offset(upload_id: str, request: Request):
+    user_id = verify_token(request.cookies.get(TOKEN_COOKIE))
+    upload = await run_io(_load_upload, upload_id, user_id)
+    return Response(status_code=200, headers=_tus_headers(**{
+        "Upload-Offset": str(upload.offset),
+        "Upload-Length": str(upload.length),
+    }))
+
+
+@router.patch("/{upload_id}")
+async def append_upload(upload_id: str, request: Request):
+    """
+    Дописывает тело запроса в контейнер. Открытый текст шифруется по чанку в crypto-пуле
+    и сразу уходит в .part; если соединение оборвётся, сохранится всё полученное.
+    """
+    if request.headers.get("content-type") != "application/offset+octet-stream":
+        raise HTTPException(status_code=415, detail="Нужен application/offset+octet-stream", headers=_tus_headers())
+    user_id, master_key = await _authorize(request)
+
+    async with _lock_for(upload_id):
+        upload = await run_io(_load_upload, upload_id, user_id)
+        if request.headers.get("upload-offset") != str(upload.offset):
+            raise HTTPException(status_code=409, detail="Upload-Offset не совпадает",
+                                headers=_tus_headers(**{"Upload-Offset": str(upload.offset)}))
+
+        f = await run_io(open, upload.part_path, "r+b")
+        try:
+            writer = await run_crypto(ChunkedWriter.resume, f, master_key, upload.offset)
+            received = upload.offset
+            pending = bytearray()
+            try:
+                async for piece in request.stream():
+                    received += len(piece)
+                    if received > upload.length:
+                        raise HTTPException(status_code=413, detail="Больше, чем Upload-Length", headers=_tus_headers())
+                    pending += piece
+                    if len(pending) >= writer.chunk_size:
+                        await run_crypto(writer.write, bytes(pending))
+                        pending.clear()
+            except ClientDisconnect:
+                logger.info(f"Загрузка {upload_id} прервана на {received} из {upload.length}")
+            await run_crypto(writer.write, bytes(pending))
+
+            if writer.plaintext_size == upload.length:
+                await run_crypto(writer.close)
+            else:
+                offset = await run_crypto(writer.suspend)
+        finally:
+            await run_io(f.close)
+
+        if writer.plaintext_size == upload.length:
+            item_id = await run_io(_finalize, upload)
+            return Response(status_code=204, headers=_tus_headers(**{
+                "Upload-Offset": str(upload.length),
+                "Mementonos-File-Id": str(item_id),
+            }))
+
+        await run_io(_save_offset, upload_id, offset)
+        return Response(status_code=204, headers=_tus_headers(**{"Upload-Offset": str(offset)}))
+
+
+@router.delete("/{upload_id}")
+async def delete_upload(upload_id: str, request: Request):
+    user_id = verify_token(request.cookies.get(TOKEN_COOKIE))
+    async with _lock_for(upload_id):
+        upload = await run_io(_load_upload, upload_id, user_id)
+
+        def delete():
+            with rx.session() as session:
+                session.delete(session.get(UploadSession, upload_id))
+                session.commit()
+            Path(upload.part_path).unlink(missing_ok=True)
+        await run_io(delete)
+    return Response(status_code=204, headers=_tus_headers())
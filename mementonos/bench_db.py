@@ -0,0 +1,165 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from sqlalchemy import tuple_
+from sqlmodel import SQLModel, Session, create_engine, select
+
+from mementonos.utils import db
+from mementonos.models import FileEncrypted, User
+from mementonos.utils.counters import FEED_EXTENSIONS
+
+
+def _percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def _engine(path: Path):
+    # Те же параметры пула, что у rx.session(): переменные SQLALCHEMY_* и умолчания Reflex
+    return create_engine(
+        f"sqlite:///{path}",
+        pool_size=int(os.getenv("SQLALCHEMY_POOL_SIZE", 5)),
+        max_overflow=int(os.getenv("SQLALCHEMY_MAX_OVERFLOW", 10)),
+        pool_pre_ping=os.getenv("SQLALCHEMY_POOL_PRE_PING", "true").lower() in ("1", "true", "yes"),
+        connect_args={"check_same_thread": False},
+    )
+
+
+def _seed(engine, rows: int):
+    SQLModel.metadata.create_all(engine)
+    base = datetime(2026, 1, 1)
+    with Session(engine) as session:
+        for user_id in (1, 2):
+            session.add(User(id=user_id, nick=f"bench{user_id}", hashed_pw="x"))
+        session.add_all(
+            FileEncrypted(
+                file_path=f"/bench/{i}.enc", original_size=1024, encrypted_name="x", extension=".jpg",
+                uploaded_by_id=1 + i % 2, is_common=i % 3 == 0, uploaded_at=base + timedelta(seconds=i),
+            )
+            for i in range(rows)
+        )
+        session.commit()
+
+
+def run_profile(readers: int, writers: int, duration: float, rows: int) -> dict:
+    """Смешанная нагрузка: читатели листают ленту, писатели добавляют файлы, как при загрузке."""
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = _engine(Path(tmp) / "bench.db")
+        _seed(engine, rows)
+
+        deadline = time.monotonic() + duration
+        lock = threading.Lock()
+        read_latencies: list[float] = []
+        write_latencies: list[float] = []
+        errors: list[str] = []
+
+        def reader():
+            cursor = None
+            while time.monotonic() < deadline:
+                started = time.monotonic()
+                try:
+                    with Session(engine) as session:
+                        query = select(FileEncrypted).where(
+                            FileEncrypted.uploaded_by_id == 1,
+                            FileEncrypted.is_common == False,
+                            FileEncrypted.extension.in_(FEED_EXTENSIONS),
+                        )
+                        if cursor:
+                            query = query.where(tuple_(FileEncrypted.uploaded_at, FileEncrypted.id) < cursor)
+                        items = session.exec(query.order_by(
+                            FileEncrypted.uploaded_at.desc(), FileEncrypted.id.desc()
+                        ).limit(31)).all()
+                    cursor = (items[-1].uploaded_at, items[-1].id) if len(items) == 31 else None
+                except Exception as e:
+                    with lock:
+                        errors.append(type(e).__name__)
+                    continue
+                with lock:
+                    read_latencies.append(time.monotonic() - started)
+
+        def writer(index: int):
+            counter = 0
+            while time.monotonic() < deadline:
+                started = time.monotonic()
+                try:
+                    with Session(engine) as session:
+                        session.add(FileEncrypted(
+                            file_path=f"/bench/w{index}_{counter}.enc", original_size=1024, encrypted_name="x",
+                            extension=".jpg", uploaded_by_id=1 + index % 2,
+                        ))
+                        session.commit()
+                    counter += 1
+                except Exception as e:
+                    with lock:
+                        errors.append(type(e).__name__)
+                    continue
+                with lock:
+                    write_latencies.append(time.monotonic() - started)
+
+        threads = [threading.Thread(target=reader) for _ in range(readers)]
+        threads += [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        engine.dispose()
+
+    return {
+        "profile": db.DB_PROFILE,
+        "reads_per_s": round(len(read_latencies) / duration),
+        "writes_per_s": round(len(write_latencies) / duration),
+        "read_p50_ms": round(_percentile(read_latencies, 0.5) * 1000, 2),
+        "read_p99_ms": round(_percentile(read_latencies, 0.99) * 1000, 2),
+        "write_p50_ms": round(_percentile(write_latencies, 0.5) * 1000, 2),
+        "write_p99_ms": round(_percentile(write_latencies, 0.99) * 1000, 2),
+        "errors": len(errors),
+    }
+
+
+def main():
+    """
+    Сравнение профилей SQLite на одной нагрузке.
+    Запуск: python -m mementonos.bench_db [--readers 8 --writers 2 --duration 10]
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--profile", help="запустить один профиль в этом процессе (для дочерних запусков)")
+    args = parser.parse_args()
+
+    if args.profile:
+        print(json.dumps(run_profile(args.readers, args.writers, args.duration, args.rows)))
+        return
+
+    # Профиль читается при импорте utils/db, поэтому каждый — в отдельном процессе
+    results = []
+    for profile in ("default", "tuned"):
+        output = subprocess.run(
+            [sys.executable, "-m", "mementonos.bench_db", "--profile", profile,
+             "--readers", str(args.readers), "--writers", str(args.writers),
+             "--duration", str(args.duration), "--rows", str(args.rows)],
+            env={**os.environ, "DB_PROFILE": profile},
+            capture_output=True, text=True, check=True,
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    columns = list(results[0])
+    print(" | ".join(f"{c:>12}" for c in columns))
+    for result in results:
+        print(" | ".join(f"{str(result[c]):>12}" for c in columns))
+
+
+if __name__ == "__main__":
+    main()
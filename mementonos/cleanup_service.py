@@ -1,25 +0,0 @@
-from pathlib import Path
-import os
-from dotenv import load_dotenv
-import time
-
-load_dotenv()
-TMP_DIR = Path(os.getenv("DATA_DIR")) / 'tmp'
-CHECK_INTERVAL = 5
-DELETE_LIFETIME = 60 * 20
-
-def cleanup_loop():
-    while True:
-        now = time.time()
-        for p in list(TMP_DIR.iterdir()):
-            if p.is_file() and p.name.startswith("dec_"):
-                if now - p.stat().st_mtime > DELETE_LIFETIME:
-                    try:
-                        p.unlink()
-                        print(f"Удалён: {p}")
-                    except Exception as e:
-                        print(f"Ошибка удаления {p}: {e}")
-        time.sleep(CHECK_INTERVAL)
-
-if __name__ == "__main__":
-    cleanup_loop()
\ No newline at end of file
@@ -1,6 +1,24 @@
 import reflex as rx
 from mementonos.state.auth import AuthState
 
+PAIR_COUNTDOWN_ID = "pair-countdown"
+# Обратный отсчёт до AuthState.code_expires считает браузер: сервер присылает только время
+# истечения. Новый код меняет data-expires, таймер подхватывает его сам
+PAIR_COUNTDOWN = f"""
+(() => {{
+    const el = document.getElementById("{PAIR_COUNTDOWN_ID}");
+    if (!el || el.dataset.ticking) return;
+    el.dataset.ticking = "1";
+    const render = () => {{
+        if (!el.isConnected) return clearInterval(timer);
+        const left = Math.max(0, Number(el.dataset.expires) - Math.floor(Date.now() / 1000));
+        el.textContent = String(Math.floor(left / 60)).padStart(2, "0") + ":" + String(left % 60).padStart(2, "0");
+    }};
+    const timer = setInterval(render, 1000);
+    render();
+}})()
+"""
+
 def auth_page():
     """Главная страница с выбором: войти или создать пару"""
     return rx.center(
@@ -140,8 +158,10 @@ def auth_modal():
                             rx.text(
                                 "Осталось: ",
                                 rx.text(
-                                    AuthState.time_left_str,
                                     as_="span",
+                                    id=PAIR_COUNTDOWN_ID,
+                                    custom_attrs={"data-expires": AuthState.code_expires},
+                                    on_mount=rx.call_script(PAIR_COUNTDOWN),
                                     color="var(--ctp-text)",
                                 ),
                                 color="var(--ctp-subtext0)",
@@ -194,5 +214,5 @@ def auth_modal():
             border_radius="lg",
         ),
         open=AuthState.show_modal,
-        on_open_change=AuthState.set_show_modal,
+        on_open_change=AuthState.set_modal_open,
     )
\ No newline at end of file
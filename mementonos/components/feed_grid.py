@@ -1,10 +1,24 @@
 import reflex as rx
 from reflex.components.core.breakpoints import Breakpoints
 from mementonos.state.feed import MediaItem, FeedState
+from mementonos.utils.thumbnails import SPRITE_CELL
 from mementonos.utils.logger import get_logger
 
 logger = get_logger(__name__)
 
+LOAD_MORE_ID = "feed-load-more"
+# Нажимает «Показать ещё», когда кнопка подъезжает к видимой области
+LOAD_MORE_OBSERVER = f"""
+(() => {{
+    const button = document.getElementById("{LOAD_MORE_ID}");
+    if (!button || button.dataset.observed) return;
+    button.dataset.observed = "1";
+    new IntersectionObserver((entries) => {{
+        if (entries.some((entry) => entry.isIntersecting) && !button.disabled) button.click();
+    }}, {{ rootMargin: "600px" }}).observe(button);
+}})()
+"""
+
 def feed_grid() -> rx.Component:
     """Сетка с медиафайлами."""
     return rx.vstack(
@@ -20,11 +34,19 @@ def feed_grid() -> rx.Component:
                             rx.vstack(
                                 # Изображение/видео
                                 rx.box(
-                                    rx.image(
-                                        src=item.thumbnail_url,
-                                        object_fit="contain",
-                                        border_radius="lg",
-                                        loading="lazy"
+                                    # Ячейка спрайта порции поверх LQIP: LQIP приходит с состоянием
+                                    # ленты и виден сразу, спрайт — один запрос на всю порцию
+                                    rx.box(
+                                        width=f"{SPRITE_CELL}px",
+                                        height=f"{SPRITE_CELL}px",
+                                        background_image=rx.cond(
+                                            item.lqip != "",
+                                            f"url({item.sprite_url}), url({item.lqip})",
+                                            f"url({item.sprite_url})",
+                                        ),
+                                        background_position=f"{item.sprite_position}, center",
+                                        background_size="auto, contain",
+                                        background_repeat="no-repeat",
                                     ),
                                     display="flex",
                                     align_items="center",
@@ -66,35 +88,53 @@ def feed_grid() -> rx.Component:
                     width="99%",
                     margin_top="6px",
                 ),
-                # Пагинация
+                # Бесконечная прокрутка или постраничная навигация
                 rx.cond(
-                    FeedState.total_pages > 1,
-                    rx.hstack(
-                        rx.button(
-                            "←",
-                            on_click=FeedState.go_to_page(FeedState.current_page - 1),
-                            is_disabled=FeedState.current_page <= 1,
-                            color="white",
-                            height="40px",
-                            width="40px",
-                            border_radius="full",
+                    FeedState.infinite_scroll,
+                    rx.cond(
+                        FeedState.next_cursor != "",
+                        rx.center(
+                            rx.button(
+                                "Показать ещё",
+                                id=LOAD_MORE_ID,
+                                on_click=FeedState.load_more,
+                                on_mount=rx.call_script(LOAD_MORE_OBSERVER),
+                                color_scheme="purple",
+                                variant="soft",
+                            ),
+                            width="100%",
+                            padding_y="8",
                         ),
-                        rx.button(FeedState.current_page,
-                                    height="40px",
-                                    width="40px",),
-                        rx.button(
-                            "→",
-                            on_click=FeedState.go_to_page(FeedState.current_page + 1),
-                            is_disabled=FeedState.current_page >= FeedState.total_pages,
-                            color="white",
-                            height="40px",
-                            width="40px",
-                            border_radius="full",
+                    ),
+                    rx.cond(
+                        FeedState.total_pages > 1,
+                        rx.hstack(
+                            rx.button(
+                                "←",
+                                on_click=FeedState.go_to_page(FeedState.current_page - 1),
+                                is_disabled=FeedState.current_page <= 1,
+                                color="white",
+                                height="40px",
+                                width="40px",
+                                border_radius="full",
+                            ),
+                            rx.button(FeedState.current_page,
+                                        height="40px",
+                                        width="40px",),
+                            rx.button(
+                                "→",
+                                on_click=FeedState.go_to_page(FeedState.current_page + 1),
+                                is_disabled=FeedState.current_page >= FeedState.total_pages,
+                                color="white",
+                                height="40px",
+                                width="40px",
+                                border_radius="full",
+                            ),
+                            spacing="4",
+                            justify="center",
+                            width="100%",
+                            padding_y="8",
                         ),
-                        spacing="4",
-                        justify="center",
-                        width="100%",
-                        padding_y="8",
                     ),
                 ),
                 width="100%",
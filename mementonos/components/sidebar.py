@@ -230,6 +230,28 @@ def sidebar() -> rx.Component:
                 margin_left="12px",
                 width="90%",
             ),
+            rx.hstack(
+                rx.switch(
+                    checked=FeedState.infinite_scroll,
+                    on_change=FeedState.set_infinite_scroll,
+                    color_scheme="purple",
+                ),
+                rx.text("Бесконечная прокрутка", font_size="sm", color="#2D3748"),
+                spacing="2",
+                margin_left="12px",
+                align="center",
+            ),
+            rx.hstack(
+                rx.switch(
+                    checked=FeedState.sort_by_capture,
+                    on_change=FeedState.set_sort_by_capture,
+                    color_scheme="purple",
+                ),
+                rx.text("По дате съёмки", font_size="sm", color="#2D3748"),
+                spacing="2",
+                margin_left="12px",
+                align="center",
+            ),
             
             rx.spacer(),
             
@@ -1,5 +1,21 @@
 import reflex as rx
-from mementonos.state.upload import UploadState
+from reflex.components.core.upload import upload_files_context_var_data
+from reflex.vars import VarData
+from mementonos.state.upload import UploadState, UPLOAD_ID, UPLOAD_FILES_REF
+
+# Выбранные файлы живут только в React-контексте rx.upload. Хук кладёт их в refs,
+# откуда их берёт tus-клиент, запущенный UploadState.start_upload через call_script
+SELECTED_COUNT = rx.Var(
+    _js_expr=f"(filesById['{UPLOAD_ID}'] || []).length",
+    _var_type=int,
+    _var_data=VarData.merge(
+        upload_files_context_var_data,
+        VarData(
+            imports={"$/utils/state": ["refs"]},
+            hooks={f"refs['{UPLOAD_FILES_REF}'] = filesById['{UPLOAD_ID}'] || [];": None},
+        ),
+    ),
+)
 
 def upload_modal() -> rx.Component:
     return rx.dialog.root(
@@ -31,7 +47,7 @@ def upload_modal() -> rx.Component:
                             width="100%",
                             background="gray.50",
                         ),
-                        on_drop=UploadState.handle_upload,
+                        id=UPLOAD_ID,
                         multiple=True,
                         max_files=20,
                         max_size=1024 * 1024 * 1024,  # 1 ГБ
@@ -39,29 +55,23 @@ def upload_modal() -> rx.Component:
                     ),
 
                     rx.cond(
-                        UploadState.files.length() > 0,
+                        rx.selected_files(UPLOAD_ID).length() > 0,
                         rx.box(
                             rx.text(
-                                f"Выбрано файлов: {UploadState.files.length()}",
+                                f"Выбрано файлов: {rx.selected_files(UPLOAD_ID).length()}",
                                 font_weight="medium",
                                 margin_bottom="2px",
                             ),
                             rx.foreach(
-                                UploadState.file_info,
-                                lambda item: rx.hstack(
+                                rx.selected_files(UPLOAD_ID),
+                                lambda name: rx.hstack(
                                     rx.text(
-                                        item["name"],
+                                        name,
                                         no_wrap=True,
                                         overflow="hidden",
                                         text_overflow="ellipsis",
                                         flex="1",
                                     ),
-                                    rx.spacer(),
-                                    rx.text(
-                                        f"{item["size"] / (1024*1024):.2f} МБ",
-                                        color="gray.600",
-                                        font_size="sm",
-                                    ),
                                     width="100%",
                                     padding_y="5px",
                                     align_items="center",
@@ -114,6 +124,7 @@ def upload_modal() -> rx.Component:
             rx.cond(
                 UploadState.is_uploading,
                 rx.vstack(
+                    rx.text(UploadState.upload_stage, font_size="sm", color="gray.600"),
                     rx.progress(
                         value=UploadState.upload_progress,
                         is_indeterminate=UploadState.upload_progress <= 0,
@@ -150,7 +161,7 @@ def upload_modal() -> rx.Component:
                     on_click=UploadState.start_upload,
                     is_loading=UploadState.is_uploading,
                     loading_text="Загрузка...",
-                    is_disabled=UploadState.files.length() == 0 | UploadState.is_uploading,
+                    is_disabled=(SELECTED_COUNT == 0) | UploadState.is_uploading,
                 ),
                 spacing="3",
                 margin_top="6px",
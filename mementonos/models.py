@@ -1,5 +1,5 @@
 from sqlmodel import SQLModel, Field, Relationship
-from sqlalchemy import LargeBinary
+from sqlalchemy import LargeBinary, Index
 from typing import Optional
 from datetime import datetime
 
@@ -24,6 +24,11 @@ class User(SQLModel, table=True):
         sa_column=LargeBinary(16),
     )
 
+    kdf_iterations: int = Field(
+        default=10_000,
+        description="Итерации PBKDF2, которыми зашифрован encrypted_master_key"
+    )
+
 class Pair(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     created_at: datetime = Field(default_factory=datetime.utcnow)
@@ -39,6 +44,16 @@ class Pair(SQLModel, table=True):
     )
 
 class FileEncrypted(SQLModel, table=True):
+    # Индексы под запросы ленты: равенства, затем порядок (uploaded_at, id) и
+    # extension, чтобы фильтр по типу проверялся по индексу без чтения строки
+    __table_args__ = (
+        Index("ix_fileencrypted_owner_feed", "uploaded_by_id", "is_common", "uploaded_at", "id", "extension"),
+        Index("ix_fileencrypted_pair_feed", "pair_id", "is_common", "uploaded_at", "id", "extension"),
+        # То же для сортировки по дате съёмки
+        Index("ix_fileencrypted_owner_captured", "uploaded_by_id", "is_common", "captured_at", "id", "extension"),
+        Index("ix_fileencrypted_pair_captured", "pair_id", "is_common", "captured_at", "id", "extension"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     
     file_path: str = Field(
@@ -75,4 +90,135 @@ class FileEncrypted(SQLModel, table=True):
     is_common: bool = Field(
         default=False,
         description="True если файл в общем хранилище пары"
-    )
\ No newline at end of file
+    )
+
+    pair_id: Optional[int] = Field(
+        default=None,
+        foreign_key="pair.id",
+        nullable=True,
+        description="Пара загрузившего (копия User.pair_id) — общая лента без поиска партнёра"
+    )
+
+    thumbnail_path: Optional[str] = Field(
+        default=None,
+        nullable=True,
+        description="Путь к зашифрованной миниатюре (None — ещё не создана)"
+    )
+
+    thumbnail_version: int = Field(
+        default=0,
+        description="Версия алгоритма, которым построена миниатюра, см. THUMBNAIL_VERSION"
+    )
+
+    renditions: Optional[str] = Field(
+        default=None,
+        nullable=True,
+        description="JSON {уровень: ширина} готовых превью, см. RENDITION_SIZES"
+    )
+
+    hls_path: Optional[str] = Field(
+        default=None,
+        nullable=True,
+        description="Каталог с зашифрованными HLS-сегментами (только для крупных видео)"
+    )
+
+    captured_at: datetime = Field(
+        default_factory=datetime.utcnow,
+        description="Время съёмки из EXIF/контейнера; до извлечения метаданных — время загрузки"
+    )
+
+    width: Optional[int] = Field(default=None, nullable=True, description="Ширина с учётом поворота")
+    height: Optional[int] = Field(default=None, nullable=True, description="Высота с учётом поворота")
+    duration: Optional[float] = Field(default=None, nullable=True, description="Длительность видео в секундах")
+    codec: Optional[str] = Field(default=None, nullable=True, description="Формат изображения или видеокодек")
+
+    encrypted_meta: Optional[str] = Field(
+        default=None,
+        nullable=True,
+        description="Зашифрованный JSON с камерой и координатами (None — метаданные ещё не извлечены)"
+    )
+
+    encrypted_lqip: Optional[str] = Field(
+        default=None,
+        nullable=True,
+        description="Зашифрованное размытое микро-превью (WebP), строится вместе с миниатюрой"
+    )
+
+class MediaJob(SQLModel, table=True):
+    """Задача фоновой обработки медиа (миниатюры и т.п.), выполняется worker_service."""
+    __table_args__ = (
+        Index("ix_mediajob_claim", "status", "priority", "run_after"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+
+    kind: str = Field(
+        description="Тип задачи, например 'thumbnail'"
+    )
+
+    payload: str = Field(
+        default="{}",
+        description="Параметры задачи в JSON"
+    )
+
+    status: str = Field(
+        default="queued",
+        description="queued | running | failed"
+    )
+
+    priority: int = Field(
+        default=0,
+        description="Чем больше, тем раньше задача будет взята"
+    )
+
+    attempts: int = Field(default=0)
+    max_attempts: int = Field(default=3)
+
+    dedupe_key: Optional[str] = Field(
+        default=None,
+        index=True,
+        description="Ключ, по которому не ставятся дубли активных задач"
+    )
+
+    last_error: Optional[str] = Field(default=None)
+
+    run_after: datetime = Field(
+        default_factory=datetime.utcnow,
+        description="Не брать задачу раньше этого времени (backoff при ретраях)"
+    )
+
+    locked_until: Optional[datetime] = Field(
+        default=None,
+        description="Аренда задачи воркером; после истечения задача возвращается в очередь"
+    )
+
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class MediaCounter(SQLModel, table=True):
+    """Число файлов ленты по пользователю и видимости. Ведётся при загрузке, чтобы не делать COUNT(*)."""
+    user_id: int = Field(foreign_key="user.id", primary_key=True)
+    is_common: bool = Field(primary_key=True)
+    count: int = Field(default=0, ge=0)
+
+class UploadSession(SQLModel, table=True):
+    """
+    Незавершённая возобновляемая загрузка (протокол tus, /api/uploads).
+    Контейнер копится в part_path целыми чанками; на последнем PATCH становится FileEncrypted.
+    """
+    id: str = Field(primary_key=True, description="Случайный идентификатор из URL загрузки")
+    user_id: int = Field(foreign_key="user.id", index=True)
+
+    part_path: str = Field(description="Путь к недописанному .enc контейнеру")
+    encrypted_name: str = Field(description="Зашифрованное имя файла из Upload-Metadata")
+    extension: str = Field(default="")
+    is_common: bool = Field(default=False)
+
+    length: int = Field(ge=0, description="Заявленный размер файла (Upload-Length)")
+    offset: int = Field(default=0, ge=0, description="Сколько байт сохранено целыми чанками (Upload-Offset)")
+
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(
+        default_factory=datetime.utcnow,
+        index=True,
+        description="Последний PATCH; по нему удаляются брошенные загрузки"
+    )
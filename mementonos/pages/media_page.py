@@ -1,16 +1,20 @@
 import reflex as rx
-import os
 from typing import Optional
 from mementonos.state.feed import FeedState
 from mementonos.state.auth import AuthState
 from mementonos.models import FileEncrypted
-from mementonos.state.feed import get_mime_type, MediaItem
+from mementonos.state.feed import MediaItem, media_item_from_record
 from mementonos.utils.logger import get_logger
 from mementonos.utils.cache import get_master_key
-from mementonos.utils.security import decode_jwt, decrypt_data
+from mementonos.utils.security import decode_jwt
 
 logger = get_logger(__name__)
 
+# hls.js (react-player) грузит плейлист и сегменты через XHR, а XHR на другой origin без
+# withCredentials не отправляет cookie с токеном — так и есть при BACKEND_URL на другом порту.
+# Ответы с credentials разрешает CORS, который Reflex добавляет к API (cors_allowed_origins)
+HLS_PLAYER_CONFIG = {"hls": {"xhrSetup": rx.Var("((xhr) => { xhr.withCredentials = true; })")}}
+
 class MediaPageState(FeedState):
     selected_media: Optional[MediaItem] = None
 
@@ -40,21 +44,7 @@ class MediaPageState(FeedState):
                 self.selected_media = None
                 return
 
-            original_name = decrypt_data(file.encrypted_name.encode('utf-8'), self.master_key).decode('utf-8')
-
-            file_url = os.getenv("BACKEND_URL") + f"/api/media/{file.id}/file"
-            thumbnail_url = os.getenv("BACKEND_URL") +  f"/api/media/{file.id}/thumbnail"
-            mime_type = get_mime_type(file.extension)
-
-            self.selected_media = MediaItem(
-                id=file.id,
-                thumbnail_url=thumbnail_url,
-                file_url=file_url,
-                original_name=original_name,
-                upload_date=file.uploaded_at,
-                file_size=file.original_size,
-                mime_type=mime_type,
-            )
+            self.selected_media = media_item_from_record(file, self.master_key, details=True)
 
 
 def media_content() -> rx.Component:
@@ -67,7 +57,8 @@ def media_content() -> rx.Component:
                 MediaPageState.selected_media.mime_type.startswith("video/"),
                 rx.box(
                     rx.video(
-                        src=MediaPageState.selected_media.file_url,
+                        src=MediaPageState.selected_media.stream_url,
+                        config=HLS_PLAYER_CONFIG,
                         width="100%",
                         height="100%",
                         controls=True,
@@ -77,10 +68,16 @@ def media_content() -> rx.Component:
                     height="270px",
                     overflow="hidden",
                 ),
-                rx.image(
-                    src=MediaPageState.selected_media.file_url,
-                    width="600",
-                    height="100%",
+                rx.link(
+                    rx.image(
+                        src=MediaPageState.selected_media.preview_url,
+                        src_set=MediaPageState.selected_media.srcset,
+                        sizes="600px",
+                        width="600",
+                        height="100%",
+                    ),
+                    href=MediaPageState.selected_media.file_url,
+                    is_external=True,
                 ),
             ),
             # Информация о файле
@@ -90,12 +87,21 @@ def media_content() -> rx.Component:
                     size="5",
                 ),
                 rx.text(f"Дата загрузки: {MediaPageState.selected_media.upload_date}"),
+                rx.text(f"Дата съёмки: {MediaPageState.selected_media.captured_at}"),
                 rx.text(f"Размер: {MediaPageState.selected_media.file_size // 1024} KB"),
                 rx.text(f"Тип: {MediaPageState.selected_media.mime_type}"),
                 rx.cond(
                     MediaPageState.selected_media.width & MediaPageState.selected_media.height,
                     rx.text(f"Разрешение: {MediaPageState.selected_media.width}x{MediaPageState.selected_media.height}"),
                 ),
+                rx.cond(
+                    MediaPageState.selected_media.codec,
+                    rx.text(f"Кодек: {MediaPageState.selected_media.codec}"),
+                ),
+                rx.cond(
+                    MediaPageState.selected_media.camera,
+                    rx.text(f"Камера: {MediaPageState.selected_media.camera}"),
+                ),
                 rx.cond(
                     MediaPageState.selected_media.duration,
                     rx.text(f"Длительность: {MediaPageState.selected_media.duration} сек"),
@@ -1,24 +1,32 @@
 import reflex as rx
-import asyncio
 import os
 from pathlib import Path
 import secrets
-from collections import deque
+import time
 from datetime import datetime, timedelta
-from typing import Dict, Optional
-from mementonos.utils.security import hash_password, create_jwt, decode_jwt, encrypt_master_key
-from mementonos.mementonos import app
+from typing import Optional
+from mementonos.utils.security import hash_password, create_jwt, decode_jwt, seal_for_pair_code, open_for_pair_code
+from mementonos.utils.kdf import KdfBusy, wrap_master_key
 from sqlmodel import select
 from mementonos.models import User, Pair
+from mementonos.api.auth import invalidate_user
+from mementonos.utils.rate_limit import RateLimited, check_rate_limit_async
+from mementonos.utils.pair_codes import PAIR_CODE_TTL, get_pair_codes
 
 from mementonos.utils.logger import get_logger 
 
-pair_codes: Dict[str, dict] = {}
 logger = get_logger()
 
-RATE_LIMIT = 3
-RATE_WINDOW_MIN = 5
-ip_attempts = {}
+# Как часто ожидание кода пары проверяет, что клиент ещё подключён, секунды
+PAIR_WAIT_SLICE = float(os.getenv("PAIR_WAIT_SLICE", 10))
+
+
+def _client_connected(client_token: str) -> bool:
+    """Открыт ли сокет клиента: при отключении Reflex убирает его токен."""
+    from reflex.utils.prerequisites import get_app
+    namespace = get_app().app.event_namespace
+    return namespace is None or client_token in namespace.token_to_sid
+
 
 class AuthState(rx.State):
     # UI состояния
@@ -32,8 +40,7 @@ class AuthState(rx.State):
     generated_code: str = ""
     error_message: str = ""
 
-    time_left: int = 0           # оставшееся время в секундах
-    timer_gen: int = 0           # счётчик для идентификации активного таймера (чтобы старые задачи завершались)
+    code_expires: int = 0        # unix-время истечения кода; обратный отсчёт идёт в браузере
 
     polling_active: bool = False
 
@@ -78,33 +85,40 @@ class AuthState(rx.State):
         
         return None
 
-    def open_login(self):
+    async def open_login(self):
         self.modal_type = "login"
         self.show_modal = True
-        self.clear_form()
+        await self.clear_form()
 
-    def open_create_pair(self):
+    async def open_create_pair(self):
         self.modal_type = "create_pair"
         self.show_modal = True
-        self.clear_form()
+        await self.clear_form()
 
-    def open_find_pair(self):
+    async def open_find_pair(self):
         self.modal_type = "find_pair"
         self.show_modal = True
-        self.clear_form()
+        await self.clear_form()
 
-    def close_modal(self):
+    async def close_modal(self):
         self.show_modal = False
         self.polling_active = False
-        self.clear_form()
+        await self.clear_form()
 
-    def clear_form(self):
+    async def set_modal_open(self, open: bool):
+        """Закрытие окна отменяет выданный код: его ожидание завершается сразу."""
+        if open:
+            self.show_modal = True
+        else:
+            await self.close_modal()
+
+    async def clear_form(self):
         self.username = ""
         self.password = ""
         self.password_confirm = ""
         self.pair_code_input = ""
-        if self.generated_code in pair_codes:
-            del pair_codes[self.generated_code]
+        if self.generated_code:
+            await get_pair_codes().discard(self.generated_code)
         self.generated_code = ""
         self.error_message = ""
 
@@ -118,27 +132,18 @@ class AuthState(rx.State):
                     if ip:
                         return ip
 
-    def check_rate_limit(self) -> bool:
-        ip = self.get_client_ip()
-        now = datetime.utcnow()
-
-        attempts: deque[datetime] = ip_attempts.setdefault(ip, deque(maxlen=RATE_LIMIT))
-
-        while attempts and now - attempts[0] >= timedelta(minutes=RATE_WINDOW_MIN):
-            attempts.popleft()
-
-        if len(attempts) >= RATE_LIMIT:
-            oldest = attempts[0]
-            wait_sec = (oldest + timedelta(minutes=RATE_WINDOW_MIN) - now).total_seconds()
-            wait_min = max(1, round(wait_sec / 60))
+    async def check_rate_limit(self, policy: str = "pairing") -> bool:
+        """Лимит попыток с IP по политике из RATE_POLICIES; общий для всех процессов."""
+        try:
+            await check_rate_limit_async(policy, f"ip:{self.get_client_ip()}")
+        except RateLimited as e:
+            wait_min = max(1, round(e.retry_after / 60))
             self.error_message = f"Слишком много попыток. Подожди примерно {wait_min} минут."
             return False
-
-        attempts.append(now)
         return True
 
-    def generate_pair_code(self):
-        if not self.check_rate_limit():
+    async def generate_pair_code(self):
+        if not await self.check_rate_limit():
             return
 
         if not self.username or len(self.username) < 3:
@@ -148,61 +153,77 @@ class AuthState(rx.State):
             self.error_message = "Пароли не совпадают или слишком короткие"
             return
 
-        code = secrets.token_hex(3).upper()
-        expires_timestamp = int((datetime.utcnow() + timedelta(minutes=5)).timestamp())
-        kdf_salt_creator = os.urandom(16)
+        # Мастер-ключ пары создаётся и шифруется паролем создателя сразу:
+        # в хранилище кодов попадают только зашифрованные копии ключа, а не пароль
+        master_key = os.urandom(32)
+        try:
+            encrypted, salt, iterations = await wrap_master_key(f"nick:{self.username}", master_key, self.password)
+        except KdfBusy as e:
+            self.error_message = str(e)
+            return
 
-        pair_codes[code] = {
+        expires_timestamp = int((datetime.utcnow() + timedelta(seconds=PAIR_CODE_TTL)).timestamp())
+        data = {
             "creator_nick": self.username,
             "hashed_pw": hash_password(self.password),
-            "plain_pw": self.password,
-            "kdf_salt_creator": kdf_salt_creator,
+            "encrypted_master_key": encrypted,
+            "kdf_salt": salt,
+            "kdf_iterations": iterations,
             "expires": expires_timestamp,
             "ip": self.get_client_ip(),
         }
+        if self.generated_code:
+            # Прежний код больше не нужен; его ожидание завершится
+            await get_pair_codes().discard(self.generated_code)
+        while True:
+            code = secrets.token_hex(3).upper()
+            # Копия для присоединяющегося: открывается кодом и SECRET_KEY
+            data["sealed_master_key"] = seal_for_pair_code(master_key, code)
+            if await get_pair_codes().create(code, data):
+                break
 
         self.generated_code = code
 
-        self.time_left = 5 * 60 
-        self.timer_gen += 1 # инвалидируем предыдущий таймер (если был)
-        yield AuthState.tick # запускаем фоновую задачу
-        yield AuthState.poll_for_pair
+        self.code_expires = expires_timestamp
+        yield AuthState.wait_for_pair
 
     @rx.event(background=True)
-    async def poll_for_pair(self):
-        if not self.username or not self.generated_code:
-            return
-
+    async def wait_for_pair(self):
+        """Ждёт, пока по коду присоединится партнёр: join_pair сообщает об этом сам, в любом процессе."""
         async with self:
+            code = self.generated_code
+            if not self.username or not code:
+                return
             self.polling_active = True
 
-        while self.polling_active and self.generated_code:
-            if self.router.session.client_token not in app.event_namespace.token_to_sid:
-                logger.info('Exiting poll_for_pair')
-                break
-
-            await asyncio.sleep(2.5)
-
-            async with self:
-                with rx.session() as session:
-                    user = session.exec(
-                        select(User).where(User.nick == self.username)
-                    ).first()
-
-                    if user and user.pair_id is not None:
-                        self.token = create_jwt(
-                            user_id=user.id,
-                            pair_id=user.pair_id
-                        )
-                        yield AuthState.check_auth
-                        self.close_modal()
-                        yield rx.redirect("/feed")
+        # Ждём порциями: между ними проверяем, что код ещё наш и вкладка не закрыта,
+        # иначе задача висела бы до конца PAIR_CODE_TTL
+        deadline = time.monotonic() + PAIR_CODE_TTL
+        result = None
+        while result is None and time.monotonic() < deadline:
+            timeout = min(PAIR_WAIT_SLICE, deadline - time.monotonic())
+            result = await get_pair_codes().wait(code, timeout=timeout)
+            if result is None:
+                async with self:
+                    # Окно закрыли или создали другой код — прежний уже отменён
+                    if self.generated_code != code:
+                        break
+                    if not _client_connected(self.router.session.client_token):
+                        logger.info(f"Клиент с кодом {code} отключился, ожидание пары остановлено")
                         break
+
         async with self:
             self.polling_active = False
+            # Пока ждали, окно закрыли или создали другой код
+            if not result or self.generated_code != code:
+                return
+            self.token = create_jwt(user_id=result["user_id"], pair_id=result["pair_id"])
+            await self.close_modal()
+        yield AuthState.check_auth
+        yield rx.redirect("/feed")
 
-    def join_pair(self):
-        if not self.check_rate_limit():
+    async def join_pair(self):
+        if not await self.check_rate_limit():
             return
 
         if not self.username or len(self.username) < 3:
@@ -213,14 +234,19 @@ class AuthState(rx.State):
             return
 
         code = self.pair_code_input.strip().upper()
-        if code not in pair_codes:
+        data = await get_pair_codes().get(code)
+        master_key = open_for_pair_code(data["sealed_master_key"], code) if data else None
+        if master_key is None:
             self.error_message = "Код не найден или истёк"
             return
 
-        data = pair_codes[code]
-        if int(datetime.utcnow().timestamp()) >= data["expires"]:
-            del pair_codes[code]
-            self.error_message = "Код истёк"
+        # Ключ шифруется в kdf-пуле до открытия транзакции
+        try:
+            enc_joiner, joiner_salt, iterations = await wrap_master_key(
+                f"nick:{self.username}", master_key, self.password
+            )
+        except KdfBusy as e:
+            self.error_message = str(e)
             return
 
         with rx.session() as session:
@@ -234,10 +260,16 @@ class AuthState(rx.State):
                 self.error_message = "Никнейм партнёра уже занят"
                 return
 
+            # Код одноразовый: из двух одновременных попыток пару создаст одна
+            if await get_pair_codes().take(code) is None:
+                self.error_message = "Код не найден или истёк"
+                return
+
             joiner = User(
                 nick=self.username,
                 hashed_pw=hash_password(self.password),
-                kdf_salt=os.urandom(16),
+                kdf_salt=joiner_salt,
+                kdf_iterations=iterations,
             )
             session.add(joiner)
             session.flush()
@@ -245,24 +277,12 @@ class AuthState(rx.State):
             creator = User(
                 nick=data["creator_nick"],
                 hashed_pw=data["hashed_pw"],
-                kdf_salt=os.urandom(16),
+                kdf_salt=data["kdf_salt"],
+                kdf_iterations=data["kdf_iterations"],
             )
             session.add(creator)
             session.flush()
 
-            master_key = os.urandom(32)
-
-            enc_creator = encrypt_master_key(
-                master_key,
-                data["plain_pw"],
-                creator.kdf_salt
-                )
-            enc_joiner = encrypt_master_key(
-                master_key,
-                self.password,
-                joiner.kdf_salt
-            )
-
             pair = Pair(
                 user1_id=creator.id,
                 user2_id=joiner.id,
@@ -273,10 +293,12 @@ class AuthState(rx.State):
             creator.pair_id = pair.id
             joiner.pair_id = pair.id
 
-            creator.encrypted_master_key = enc_creator
+            creator.encrypted_master_key = data["encrypted_master_key"]
             joiner.encrypted_master_key = enc_joiner
 
             session.commit()
+            invalidate_user(creator.id)
+            invalidate_user(joiner.id)
 
             base_dir = os.getenv("DATA_DIR") / Path("user_data") / str(pair.id)
             try:
@@ -294,17 +316,19 @@ class AuthState(rx.State):
             self.token = create_jwt(joiner.id, pair.id)
             yield AuthState.check_auth
 
-        data["plain_pw"] = None
-        del pair_codes[code]
-        self.close_modal()
+        # Создатель ждёт в wait_for_pair, возможно в другом процессе
+        await get_pair_codes().finish(code, {"user_id": creator.id, "pair_id": pair.id})
+        await self.close_modal()
         
         yield rx.toast.success("Пара создана! Добро пожаловать.")
         yield rx.redirect("/feed")
 
-    def login(self):
+    async def login(self):
         if not self.username or not self.password:
             self.error_message = "Введите никнейм и пароль"
             return
+        if not await self.check_rate_limit("login"):
+            return
 
         with rx.session() as session:
             user = session.exec(
@@ -329,7 +353,7 @@ class AuthState(rx.State):
             )
             yield AuthState.check_auth
 
-            self.close_modal()
+            await self.close_modal()
             self.error_message = ""
 
             yield rx.toast.success(
@@ -338,32 +362,3 @@ class AuthState(rx.State):
                 duration=4000
             )
             yield rx.redirect("/feed")
-
-    @rx.var
-    def time_left_str(self) -> str:
-        """Форматирует оставшееся время в ММ:СС"""
-        minutes = self.time_left // 60
-        seconds = self.time_left % 60
-        return f"{minutes:02d}:{seconds:02d}"
-    
-    @rx.event(background=True)
-    async def tick(self):
-        """Фоновая задача: уменьшает time_left каждую секунду, пока таймер актуален."""
-        # Запоминаем идентификатор текущего запуска
-        async with self:
-            current_gen = self.timer_gen
-
-        while True:
-            if self.router.session.client_token not in app.event_namespace.token_to_sid:
-                logger.info('Exiting tick')
-                break
-
-            async with self:
-                # Если таймер устарел (запущен новый) или время вышло — завершаем
-                if self.timer_gen != current_gen or self.time_left <= 0:
-                    break
-            await asyncio.sleep(1)
-            async with self:
-                # Уменьшаем только если всё ещё актуально и есть что уменьшать
-                if self.timer_gen == current_gen and self.time_left > 0:
-                    self.time_left -= 1
\ No newline at end of file
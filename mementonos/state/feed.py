@@ -1,10 +1,17 @@
 import reflex as rx
-from sqlmodel import select, or_, and_, func, Session
+from sqlmodel import select, Session
+from sqlalchemy import tuple_
 import mimetypes
-from mementonos.utils.security import decode_jwt, decrypt_master_key, hash_password, decrypt_data
+import base64
+import json
+from mementonos.utils.security import decode_jwt, hash_password, decrypt_data
 from mementonos.utils.logger import get_logger
 from mementonos.utils.cache import save_master_key, get_master_key
+from mementonos.utils.kdf import KdfBusy, unlock_master_key, rewrap_if_outdated
 from mementonos.models import User, Pair, FileEncrypted
+from mementonos.utils.hls import PLAYLIST_NAME
+from mementonos.utils.thumbnails import sprite_position
+from mementonos.utils.counters import FEED_EXTENSIONS, feed_count
 from typing import List, Optional
 from datetime import datetime
 from dotenv import load_dotenv
@@ -38,11 +45,10 @@ def get_partner_id(user_id: int, session: Session) -> int | None:
     Находит ID партнёра по ID пользователя.
     Возвращает None, если пары нет.
     """
-    stmt = select(Pair).where(
-        (Pair.user1_id == user_id) | (Pair.user2_id == user_id)
-    )
-    pair = session.exec(stmt).first()
-    
+    # Через User.pair_id — два поиска по первичному ключу вместо OR по Pair
+    user = session.get(User, user_id)
+    pair = session.get(Pair, user.pair_id) if user and user.pair_id else None
+
     if not pair:
         return None
     
@@ -51,6 +57,14 @@ def get_partner_id(user_id: int, session: Session) -> int | None:
     else:
         return pair.user1_id
     
+def encode_cursor(sorted_at: datetime, item_id: int) -> str:
+    """Курсор ленты: последняя показанная запись, (uploaded_at или captured_at, id)."""
+    return f"{sorted_at.isoformat()}|{item_id}"
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    sorted_at, _, item_id = cursor.rpartition("|")
+    return datetime.fromisoformat(sorted_at), int(item_id)
+
 class MediaItem(rx.Base):
     """Модель расшифрованного медиафайла для отображения в ленте."""
     id: int
@@ -60,9 +74,85 @@ class MediaItem(rx.Base):
     upload_date: datetime
     file_size: int
     mime_type: str
+    # Превью из пирамиды RENDITION_SIZES: srcset для <img> и средний размер для src
+    srcset: str = ""
+    preview_url: str = ""
+    # Для видео: HLS-плейлист, если он уже построен, иначе сам файл
+    stream_url: str = ""
+    # Размытое микро-превью data:image/webp — фон плитки, пока грузится миниатюра
+    lqip: str = ""
+    # Миниатюра как ячейка спрайта порции ленты, см. with_sprite
+    sprite_url: str = ""
+    sprite_position: str = ""
     width: Optional[int] = None
     height: Optional[int] = None
     duration: Optional[float] = None
+    codec: str = ""
+    captured_at: Optional[datetime] = None
+    # Из зашифрованных метаданных, только на странице медиа (details=True)
+    camera: str = ""
+
+# Уровень превью, который подставляется в src, если браузер не поддерживает srcset
+PREVIEW_SIZE = 1080
+
+def media_item_from_record(item: FileEncrypted, master_key: bytes, details: bool = False) -> MediaItem:
+    """
+    Собирает MediaItem для ленты и страницы медиа из записи FileEncrypted.
+    details=True — ещё и расшифровать encrypted_meta; ленте это не нужно.
+    """
+    original_name = decrypt_data(item.encrypted_name.encode('utf-8'), master_key).decode('utf-8')
+
+    base_url = os.getenv("BACKEND_URL") + f"/api/media/{item.id}"
+    file_url = base_url + "/file"
+    thumbnail_url = base_url + "/thumbnail"
+
+    widths = json.loads(item.renditions) if item.renditions else {}
+    srcset = ", ".join(
+        f"{base_url}/preview/{size} {width}w" for size, width in sorted(widths.items(), key=lambda kv: int(kv[0]))
+    )
+    preview_sizes = [int(size) for size in widths if int(size) <= PREVIEW_SIZE]
+    preview_url = f"{base_url}/preview/{max(preview_sizes)}" if preview_sizes else file_url
+    stream_url = f"{base_url}/hls/{PLAYLIST_NAME}" if item.hls_path else file_url
+
+    lqip = ""
+    if item.encrypted_lqip:
+        lqip_data = decrypt_data(item.encrypted_lqip.encode('utf-8'), master_key)
+        lqip = "data:image/webp;base64," + base64.b64encode(lqip_data).decode('ascii')
+
+    sensitive = {}
+    if details and item.encrypted_meta:
+        sensitive = json.loads(decrypt_data(item.encrypted_meta.encode('utf-8'), master_key))
+
+    return MediaItem(
+        id=item.id,
+        thumbnail_url=thumbnail_url,
+        file_url=file_url,
+        original_name=original_name,
+        upload_date=item.uploaded_at,
+        file_size=item.original_size,
+        mime_type=get_mime_type(item.extension),
+        srcset=srcset,
+        preview_url=preview_url,
+        stream_url=stream_url,
+        lqip=lqip,
+        width=item.width,
+        height=item.height,
+        duration=item.duration,
+        codec=item.codec or "",
+        captured_at=item.captured_at,
+        camera=sensitive.get("camera", ""),
+    )
+
+def with_sprite(items: list[MediaItem]) -> list[MediaItem]:
+    """Миниатюры порции — одним спрайтом /api/media/sprite: один запрос вместо одного на плитку."""
+    if not items:
+        return items
+    sprite_url = os.getenv("BACKEND_URL") + "/api/media/sprite?ids=" + ",".join(str(item.id) for item in items)
+    for index, item in enumerate(items):
+        x, y = sprite_position(index)
+        item.sprite_url = sprite_url
+        item.sprite_position = f"-{x}px -{y}px"
+    return items
 
 class FeedState(rx.State):
     show_decryption_modal: bool = False
@@ -76,6 +166,13 @@ class FeedState(rx.State):
     current_page: int = 1
     total_pages: int = 1
     items_per_page: int = 30
+    # page_cursors[i] — курсор начала страницы i + 1 ("" — с самых новых)
+    page_cursors: List[str] = [""]
+    # Курсор следующей порции; "" — больше ничего нет
+    next_cursor: str = ""
+    infinite_scroll: bool = False
+    # Порядок ленты: по дате съёмки (captured_at) или по дате загрузки
+    sort_by_capture: bool = False
 
     @rx.event
     def switch_show_common(self):
@@ -107,7 +204,7 @@ class FeedState(rx.State):
             return
         self.open_decryption_modal()
 
-    def submit_decryption_password(self):
+    async def submit_decryption_password(self):
         """Сохранить пароль и закрыть окно."""
         if self.upload_password == "":
             yield rx.toast.error("Введите пароль.")
@@ -117,88 +214,137 @@ class FeedState(rx.State):
             user_id = int(payload.get("sub"))
             with rx.session() as session:
                 user = session.get(User, user_id)
-                if hash_password(self.upload_password) != user.hashed_pw:
-                    yield rx.toast.error("Неверный пароль")
-                    return
-                self.master_key = decrypt_master_key(user.encrypted_master_key, self.upload_password, user.kdf_salt)
-                save_master_key(user_id, self.master_key)
-                self.close_decryption_modal()
+            if hash_password(self.upload_password) != user.hashed_pw:
+                yield rx.toast.error("Неверный пароль")
+                return
+            # PBKDF2 — в kdf-пуле, event loop не ждёт
+            password = self.upload_password
+            self.master_key = await unlock_master_key(user, password)
+            save_master_key(user_id, self.master_key)
+            self.close_decryption_modal()
+            yield
+            await rewrap_if_outdated(user, self.master_key, password)
 
+        except KdfBusy as e:
+            yield rx.toast.warning(str(e))
+            return
         except Exception as e:
             logger.error(f"Ошибка доступа к ключу: {str(e)}")
             yield rx.toast.error(f"Ошибка доступа к ключу: {str(e)}")
             return
     
+    def _feed_query(self, session: Session, user_id: int, *columns):
+        """
+        Выборка ленты (личной или общей) от новых к старым, начиная после курсора — без LIMIT.
+        Возвращает запрос, колонку сортировки и владельцев для счётчика.
+        """
+        user = session.get(User, user_id)
+        pair = session.get(Pair, user.pair_id) if self.show_common and user.pair_id else None
+
+        # Обе ветки — диапазон по одному индексу: ix_fileencrypted_pair_* / ix_fileencrypted_owner_*
+        sort_column = FileEncrypted.captured_at if self.sort_by_capture else FileEncrypted.uploaded_at
+        query = select(*columns) if columns else select(FileEncrypted)
+        if pair:
+            owners = [pair.user1_id, pair.user2_id]
+            query = query.where(FileEncrypted.pair_id == pair.id)
+        else:
+            owners = [user_id]
+            query = query.where(FileEncrypted.uploaded_by_id == user_id)
+        query = query.where(
+            FileEncrypted.is_common == self.show_common,
+            FileEncrypted.extension.in_(FEED_EXTENSIONS),
+        )
+        return query, sort_column, owners
+
+    def _after(self, query, sort_column, cursor: str):
+        if cursor:
+            sorted_at, item_id = decode_cursor(cursor)
+            query = query.where(tuple_(sort_column, FileEncrypted.id) < (sorted_at, item_id))
+        return query.order_by(sort_column.desc(), FileEncrypted.id.desc())
+
+    def _fetch_page(self, user_id: int, cursor: str) -> tuple[list[FileEncrypted], str, int]:
+        """
+        Одна страница ленты после курсора (keyset по (uploaded_at или captured_at, id), от новых к старым).
+        Возвращает записи, курсор следующей страницы ("" — дальше пусто) и общее число файлов.
+        """
+        with rx.session() as session:
+            query, sort_column, owners = self._feed_query(session, user_id)
+            # Лишняя запись показывает, есть ли следующая страница
+            query = self._after(query, sort_column, cursor).limit(self.items_per_page + 1)
+            items = session.exec(query).all()
+
+            total_count = feed_count(session, owners, self.show_common)
+
+        next_cursor = ""
+        if len(items) > self.items_per_page:
+            items = items[:self.items_per_page]
+            last = items[-1]
+            next_cursor = encode_cursor(last.captured_at if self.sort_by_capture else last.uploaded_at, last.id)
+        return items, next_cursor, total_count
+
+    def _find_cursors(self, user_id: int, page: int):
+        """
+        Дописывает в page_cursors курсоры до страницы page, не загружая сами страницы:
+        на каждую — одна строка (ключ, id) по индексу. Останавливается, если записи кончились.
+        """
+        with rx.session() as session:
+            query, sort_column, _ = self._feed_query(session, user_id, FileEncrypted.id)
+            query = query.add_columns(sort_column)
+            while len(self.page_cursors) < page:
+                # Последняя запись страницы и ещё одна — есть ли что-то после неё
+                rows = session.execute(
+                    self._after(query, sort_column, self.page_cursors[-1])
+                    .offset(self.items_per_page - 1).limit(2)
+                ).all()
+                if len(rows) < 2:
+                    return
+                item_id, sorted_at = rows[0]
+                self.page_cursors.append(encode_cursor(sorted_at, item_id))
+
     @rx.event
     def load_media(self, page: int = 1):
-        """Загрузить файлы текущего пользователя с пагинацией."""
+        """Загрузить страницу файлов. Открыть можно первую или уже известную по курсору."""
         payload = decode_jwt(self.token)
         user_id = int(payload.get("sub"))
-        self.media_items = []
 
-        allowed_extensions = [
-            '.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp',
-            '.mp4', '.mov', '.avi', '.mkv', '.webm'
-        ]
-        
-        with rx.session() as session:
-            # Базовый запрос: файлы, загруженные текущим пользователем
-            if not self.show_common:
-                base_query = select(FileEncrypted).where(
-                    and_(
-                    FileEncrypted.uploaded_by_id == user_id,
-                    FileEncrypted.is_common == False,
-                    ),
-                    FileEncrypted.extension.in_(allowed_extensions)
-                ).order_by(FileEncrypted.uploaded_at.desc())
-            else:
-                partner_id = get_partner_id(user_id, session)
-                base_query = select(FileEncrypted).where(
-                    or_(
-                        and_(
-                            FileEncrypted.uploaded_by_id == user_id,
-                            FileEncrypted.is_common == True
-                        ),
-                        and_(
-                            FileEncrypted.uploaded_by_id == partner_id,
-                            FileEncrypted.is_common == True
-                        )
-                    ),
-                    FileEncrypted.extension.in_(allowed_extensions)
-                ).order_by(FileEncrypted.uploaded_at.desc())
-
-            # Общее количество записей
-            total_count = session.exec(
-                select(func.count()).select_from(base_query.subquery())
-            ).one()
-            self.total_pages = (total_count + self.items_per_page - 1) // self.items_per_page
-
-            # Пагинация
-            offset = (page - 1) * self.items_per_page
-            query = base_query.offset(offset).limit(self.items_per_page)
-            items = session.exec(query).all()
+        if page == 1:
+            self.page_cursors = [""]
+        if not 1 <= page <= len(self.page_cursors):
+            return
 
+        items, next_cursor, total_count = self._fetch_page(user_id, self.page_cursors[page - 1])
+        self.total_pages = max(1, (total_count + self.items_per_page - 1) // self.items_per_page)
         self.current_page = page
-        for item in items:
-            original_name = decrypt_data(item.encrypted_name.encode('utf-8'), self.master_key).decode('utf-8')
-
-            file_url = os.getenv("BACKEND_URL") + f"/api/media/{item.id}/file"
-            thumbnail_url = os.getenv("BACKEND_URL") +  f"/api/media/{item.id}/thumbnail"
-            mime_type = get_mime_type(item.extension)
-
-            media_item = MediaItem(
-                id=item.id,
-                thumbnail_url=thumbnail_url,
-                file_url=file_url,
-                original_name=original_name,
-                upload_date=item.uploaded_at,
-                file_size=item.original_size,
-                mime_type=mime_type,
-            )
-            logger.debug(f"Appended with {media_item}")
-            self.media_items.append(media_item)
+        self.next_cursor = next_cursor
+        if next_cursor and len(self.page_cursors) == page:
+            self.page_cursors.append(next_cursor)
+
+        self.media_items = with_sprite([media_item_from_record(item, self.master_key) for item in items])
         logger.info(f"loaded {len(items)} media files to media_items.")
-        
+
+    @rx.event
+    def load_more(self):
+        """Бесконечная прокрутка: дописать следующую порцию к уже показанным."""
+        if not self.next_cursor:
+            return
+        payload = decode_jwt(self.token)
+        user_id = int(payload.get("sub"))
+
+        items, self.next_cursor, _ = self._fetch_page(user_id, self.next_cursor)
+        self.media_items.extend(with_sprite([media_item_from_record(item, self.master_key) for item in items]))
+        logger.info(f"loaded {len(items)} more media files to media_items.")
+
+    @rx.event
+    def set_infinite_scroll(self, value: bool):
+        self.infinite_scroll = value
+        return FeedState.load_media(page=1)
+
+    @rx.event
+    def set_sort_by_capture(self, value: bool):
+        # Курсоры прежнего порядка не подходят — начинаем с первой страницы
+        self.sort_by_capture = value
+        return FeedState.load_media(page=1)
+
     @rx.event
     def on_load(self):
         payload = decode_jwt(self.token)
@@ -210,7 +356,13 @@ class FeedState(rx.State):
         else:
             return FeedState.load_media(page=1)
         
+    @rx.event
     def go_to_page(self, page: int):
-        """Перейти на указанную страницу."""
-        if 1 <= page <= self.total_pages:
+        """Перейти на указанную страницу; курсоры ещё не открытых страниц находятся по пути."""
+        if not 1 <= page <= self.total_pages:
+            return
+        if page > len(self.page_cursors):
+            payload = decode_jwt(self.token)
+            self._find_cursors(int(payload.get("sub")), page)
+        if page <= len(self.page_cursors):
             return FeedState.load_media(page=page)
\ No newline at end of file
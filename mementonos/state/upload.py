@@ -1,30 +1,180 @@
+import json
 import reflex as rx
-from reflex import Base
-from typing import List
 from pathlib import Path
 from datetime import datetime
+from reflex.utils import format
 import os
 
-from mementonos.utils.security import hash_password, encrypt_data, decrypt_master_key
+from mementonos.utils.security import hash_password
 from mementonos.models import User, FileEncrypted
 from mementonos.utils.security import decode_jwt
+from mementonos.utils.encrypted_file import DEFAULT_CHUNK_SIZE
+from mementonos.utils.cache import save_master_key
+from mementonos.utils.kdf import KdfBusy, unlock_master_key, rewrap_if_outdated
+from mementonos.utils.media_jobs import enqueue_ingest_jobs
+from mementonos.utils.counters import bump_media_counter
+from mementonos.utils.executors import run_io
 
 from mementonos.utils.logger import get_logger
 
 logger = get_logger(__name__)
 
-class FileItem(Base):
-    name: str
-    size: float
-    extension: str
-    uploaded_at: datetime
+UPLOAD_ID = "media_upload"
+# Под этими ключами в refs браузера лежат выбранные файлы (см. components/upload.py)
+# и AbortController идущей загрузки
+UPLOAD_FILES_REF = "__mementonos_upload_files"
+UPLOAD_ABORT_REF = "__mementonos_upload_abort"
+# Сколько файлов браузер передаёт одновременно и как часто сервер получает прогресс
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", 4))
+UPLOAD_PROGRESS_INTERVAL = float(os.getenv("UPLOAD_PROGRESS_INTERVAL", 0.25))
+# Тело одного PATCH: кратно чанку контейнера, чтобы сервер не хранил хвостов
+UPLOAD_PATCH_SIZE = int(os.getenv("UPLOAD_PATCH_SIZE", 32 * DEFAULT_CHUNK_SIZE))
+UPLOAD_RETRIES = int(os.getenv("UPLOAD_RETRIES", 5))
+
+
+def tus_upload_script(to_common: bool, on_progress: str) -> str:
+    """
+    Браузерный tus-клиент для /api/uploads: файлы идут потоком PATCH-запросами,
+    сервер шифрует их по мере поступления. После обрыва клиент спрашивает у сервера
+    Upload-Offset (HEAD) и продолжает с него; адрес загрузки хранится в localStorage,
+    поэтому тот же файл, выбранный после перезагрузки страницы, тоже докачивается.
+    Возвращает {"uploaded": число, "failed": [имена], "cancelled": bool}.
+    """
+    return f"""
+(async () => {{
+    const files = refs["{UPLOAD_FILES_REF}"] || [];
+    const endpoint = {json.dumps(os.getenv("BACKEND_URL") + "/api/uploads")};
+    const report = {on_progress};
+    const controller = new AbortController();
+    refs["{UPLOAD_ABORT_REF}"] = controller;
+
+    const total = files.reduce((sum, file) => sum + file.size, 0) || 1;
+    const sent = new Map();
+    let reportedAt = 0;
+    const progress = (force) => {{
+        const now = Date.now();
+        if (!force && now - reportedAt < {UPLOAD_PROGRESS_INTERVAL * 1000:.0f}) return;
+        reportedAt = now;
+        let done = 0;
+        sent.forEach((bytes) => done += bytes);
+        report({{progress: done / total}});
+    }};
+
+    const b64 = (text) => btoa(Array.from(new TextEncoder().encode(text), (b) => String.fromCharCode(b)).join(""));
+    const tus = (url, method, headers = {{}}, body) => fetch(url, {{
+        method, body, credentials: "include", signal: controller.signal,
+        headers: {{"Tus-Resumable": "1.0.0", ...headers}},
+    }});
+    const offsetOf = (response) => Number(response.headers.get("Upload-Offset"));
+    const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+    const fatal = async (response) => Object.assign(new Error(await response.text()), {{fatal: true}});
+
+    const uploadOne = async (file) => {{
+        const fingerprint = "mementonos-tus:" + [file.name, file.size, file.lastModified, {int(to_common)}].join("/");
+        let url = localStorage.getItem(fingerprint);
+        let offset = 0;
+        if (url) {{
+            const head = await tus(url, "HEAD");
+            if (head.ok) offset = offsetOf(head);
+            else url = null;
+        }}
+        if (!url) {{
+            const created = await tus(endpoint, "POST", {{
+                "Upload-Length": String(file.size),
+                "Upload-Metadata": "filename " + b64(file.name) + ",is_common " + b64("{int(to_common)}"),
+            }});
+            if (!created.ok) throw await fatal(created);
+            if (created.headers.get("Mementonos-File-Id")) return;
+            url = new URL(created.headers.get("Location"), endpoint).href;
+            localStorage.setItem(fingerprint, url);
+        }}
+
+        let failures = 0;
+        while (offset < file.size) {{
+            sent.set(file, offset);
+            progress(false);
+            const end = Math.min(offset + {UPLOAD_PATCH_SIZE}, file.size);
+            try {{
+                const response = await tus(url, "PATCH", {{
+                    "Upload-Offset": String(offset),
+                    "Content-Type": "application/offset+octet-stream",
+                }}, file.slice(offset, end));
+                if (response.ok || response.status === 409) {{
+                    offset = offsetOf(response);
+                    failures = 0;
+                    continue;
+                }}
+                if (response.status < 500) throw await fatal(response);
+            }} catch (error) {{
+                if (error.fatal || error.name === "AbortError") throw error;
+            }}
+            // Обрыв: спрашиваем, сколько сервер сохранил, и продолжаем с этого места
+            if (++failures > {UPLOAD_RETRIES}) throw new Error("Сервер недоступен");
+            await sleep(1000 * 2 ** failures);
+            const head = await tus(url, "HEAD").catch(() => null);
+            if (head && head.ok) offset = offsetOf(head);
+            // Загрузки больше нет: последний PATCH дошёл и файл сохранён
+            else if (head && head.status === 404 && end === file.size) break;
+            else if (head && head.status === 404) throw await fatal(head);
+        }}
+        localStorage.removeItem(fingerprint);
+        sent.set(file, file.size);
+    }};
+
+    const failed = [];
+    let uploaded = 0;
+    let next = 0;
+    const worker = async () => {{
+        while (next < files.length && !controller.signal.aborted) {{
+            const file = files[next++];
+            try {{
+                await uploadOne(file);
+                uploaded++;
+            }} catch (error) {{
+                if (error.name !== "AbortError") {{
+                    console.error("upload", file.name, error);
+                    failed.push(file.name);
+                }}
+            }}
+        }}
+    }};
+    await Promise.all(Array.from({{length: Math.min({UPLOAD_CONCURRENCY}, files.length)}}, worker));
+    progress(true);
+    delete refs["{UPLOAD_ABORT_REF}"];
+    return {{uploaded, failed, cancelled: controller.signal.aborted}};
+}})()
+"""
+
+
+def new_upload_path(pair_id, user_id: int, is_common: bool, uploaded_at: datetime) -> Path:
+    """Новый путь для зашифрованного оригинала: личный или общий каталог пары."""
+    base_dir = os.getenv("DATA_DIR") / Path("user_data") / str(pair_id)
+    upload_dir = base_dir / ("common" if is_common else str(user_id))
+    upload_dir.mkdir(parents=True, exist_ok=True)
+    return upload_dir / f"{uploaded_at.strftime('%Y%m%d_%H%M%S')}_{os.urandom(4).hex()}.enc"
+
+
+def add_uploaded(session, rows: list[FileEncrypted]) -> list[int]:
+    """Записи новых файлов, задачи воркера и счётчики — в транзакции session. Commit за вызывающим."""
+    session.add_all(rows)
+    session.flush()
+    for row in rows:
+        # Миниатюры и прочие производные строит worker_service
+        enqueue_ingest_jobs(row.id, row.extension, session=session, original_size=row.original_size)
+        bump_media_counter(session, row.uploaded_by_id, row.is_common, row.extension)
+    return [row.id for row in rows]
+
+
+def _load_user(user_id: int) -> User:
+    with rx.session() as session:
+        return session.get(User, user_id)
+
 
 class UploadState(rx.State):
     show_upload_modal: bool = False
-    files: List[rx.UploadFile] = []
-    file_info: List[FileItem] = []
     is_uploading: bool = False
     upload_progress: int = 0
+    upload_stage: str = ""
     to_common: bool = False
 
     upload_password: str = ""
@@ -33,41 +183,39 @@ class UploadState(rx.State):
 
     def open_upload_modal(self):
         self.show_upload_modal = True
-        self.files = []
         self.to_common = False
+        return rx.clear_selected_files(UPLOAD_ID)
 
     def close_upload_modal(self):
         self.show_upload_modal = False
-        self.files = []
         self.is_uploading = False
         self.upload_progress = 0
+        self.upload_stage = ""
+        # Прерванная загрузка докачается, если снова выбрать те же файлы
+        return [
+            rx.call_script(f"refs['{UPLOAD_ABORT_REF}']?.abort()"),
+            rx.clear_selected_files(UPLOAD_ID),
+        ]
 
     def set_to_common(self):
         self.to_common = not self.to_common
 
-    async def handle_upload(self, files: list[rx.UploadFile]):
-        async with self:
-            self.files = files
-            self.file_info = [
-                FileItem(
-                    name=f.filename or "Без имени",
-                    size=f.size or 0,
-                    extension=Path(f.name or f.filename or "").suffix.lower() or "",
-                    uploaded_at=datetime.utcnow()
-                )
-                for f in files
-            ]
-
-    @rx.event(background=True)
-    async def start_upload(self):
-        if not self.files:
-            yield rx.toast.error("Выберите хотя бы один файл")
+    @rx.event
+    def handle_upload_progress(self, progress: dict):
+        """Прогресс передачи файлов в браузере → сервер (байты)."""
+        if not self.is_uploading:
             return
-        
+        self.upload_progress = int(progress.get("progress", 0) * 100)
+
+    async def start_upload(self):
+        """
+        Проверяет пароль, кладёт мастер-ключ в кэш и запускает в браузере tus-клиент:
+        файлы уходят потоком в /api/uploads, которая шифрует их по мере поступления.
+        """
         if not self.upload_password:
             yield rx.toast.error("Введите пароль")
             return
-        
+
         token = self.token
 
         try:
@@ -77,72 +225,44 @@ class UploadState(rx.State):
             yield rx.toast.error("Недействительный токен")
             return
 
-        with rx.session() as session:
-            user = session.get(User, user_id)
-            pair_id = user.pair_id
-            if hash_password(self.upload_password) != user.hashed_pw:
-                yield rx.toast.error("Неверный пароль")
-                return
+        user = await run_io(_load_user, user_id)
+        if hash_password(self.upload_password) != user.hashed_pw:
+            yield rx.toast.error("Неверный пароль")
+            return
 
         try:
-            master_key = decrypt_master_key(user.encrypted_master_key, self.upload_password, user.kdf_salt)
+            master_key = await unlock_master_key(user, self.upload_password)
+            if master_key is None:
+                raise ValueError("мастер-ключ не расшифрован")
+            await rewrap_if_outdated(user, master_key, self.upload_password)
+        except KdfBusy as e:
+            yield rx.toast.warning(str(e))
+            return
         except Exception as e:
             logger.error(f"Ошибка доступа к ключу: {str(e)}")
+            yield rx.toast.error(f"Ошибка доступа к ключу: {str(e)}")
             return
-        async with self:
-            self.is_uploading = True
-            self.upload_progress = 0
 
-        try:
-            total = len(self.files)
-            processed = 0
-
-            base_dir = os.getenv("DATA_DIR") / Path("user_data") / str(pair_id)
-            if self.to_common:
-                upload_dir = base_dir / "common"
-            else:
-                upload_dir = base_dir / str(user_id)
-
-            upload_dir.mkdir(parents=True, exist_ok=True)
-
-            for file, file_info in zip(self.files, self.file_info):
-                content = await file.read()
-                encrypted_content = encrypt_data(content, master_key)
-                encrypted_name = encrypt_data(file_info.name.encode("utf-8"), master_key).decode('utf-8')
-                given_filename = f"{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}_{os.urandom(4).hex()}.enc"
-                file_path = upload_dir / given_filename
-
-                with open(file_path, "wb") as f:
-                    f.write(encrypted_content)
-
-                file_item = FileEncrypted(
-                    file_path=str(file_path),
-                    original_size=len(content),
-                    encrypted_name=encrypted_name,
-                    extension=file_info.extension,
-                    uploaded_by_id=user_id,
-                    is_common=self.to_common,
-                )
-
-                with rx.session() as session:
-                    session.add(file_item)
-                    session.commit()
-
-                logger.info(f"Wrote {file_info.name}")
-
-                processed += 1
-                async with self:
-                    self.upload_progress = int((processed / total) * 100)
-                yield
-
-            if self.upload_progress == 100:
-                yield rx.toast.success(f"Загружено {total} файлов")
-                async with self:
-                    self.close_upload_modal()
+        # /api/uploads шифрует ключом из кэша, воркеру он нужен для новых файлов
+        save_master_key(user_id, master_key)
 
-        except Exception as e:
-            yield rx.toast.error(f"Ошибка загрузки: {str(e)}")
+        self.is_uploading = True
+        self.upload_stage = "Передача"
+        self.upload_progress = 0
+        on_progress = format.format_queue_events(UploadState.handle_upload_progress, args_spec=lambda progress: [progress])
+        yield rx.call_script(
+            tus_upload_script(self.to_common, str(on_progress)),
+            callback=UploadState.finish_upload,
+        )
 
-        finally:
-            async with self:
-                self.is_uploading = False
\ No newline at end of file
+    @rx.event
+    def finish_upload(self, result: dict):
+        """Итог tus-клиента: {"uploaded", "failed", "cancelled"}."""
+        self.is_uploading = False
+        if not result or result.get("cancelled"):
+            return
+        uploaded, failed = result.get("uploaded", 0), result.get("failed", [])
+        if failed:
+            logger.error(f"Ошибка загрузки: {', '.join(failed)}")
+            return rx.toast.error(f"Загружено {uploaded} из {uploaded + len(failed)}. Ошибка: {', '.join(failed)}")
+        return [rx.toast.success(f"Загружено {uploaded} файлов"), *self.close_upload_modal()]
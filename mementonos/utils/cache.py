@@ -1,18 +1,198 @@
-import redis
+import os
 import base64
+import threading
+import time
+import redis
+import redis.asyncio
 from typing import Optional
+from dotenv import load_dotenv
+
+from mementonos.utils.ttl_cache import TTLCache
+from mementonos.utils.logger import get_logger
+
+load_dotenv()
+logger = get_logger(__name__)
+
+# "redis" — общий для всех процессов (веб, API, воркер); "memory" — только этот процесс,
+# для одного процесса и тестов: воркер в другом процессе ключей не увидит
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "redis")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 32))
+MASTER_KEY_TTL = int(os.getenv("MASTER_KEY_TTL", 3600))
+# Локальный уровень: ключ не перечитывается из Redis на каждую миниатюру
+MASTER_KEY_LOCAL_TTL = float(os.getenv("MASTER_KEY_LOCAL_TTL", 30))
+MASTER_KEY_LOCAL_SIZE = int(os.getenv("MASTER_KEY_LOCAL_SIZE", 1024))
+
+
+class MemoryBackend:
+    """Хранилище в памяти процесса с тем же интерфейсом, что RedisBackend."""
+    name = "memory"
+
+    def __init__(self):
+        self._data: TTLCache[bytes] = TTLCache(maxsize=100_000, ttl=MASTER_KEY_TTL)
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._data.get(key)
+
+    def set(self, key: str, value: bytes, ttl: int):
+        self._data.set(key, value, ttl=ttl)
+
+    async def aget(self, key: str) -> Optional[bytes]:
+        return self.get(key)
+
+
+class RedisBackend:
+    """
+    Redis через пул соединений. Клиенты создаются при первом обращении,
+    поэтому импорт модуля не требует работающего Redis.
+    Значения хранятся в base64, как и раньше — совместимо с уже сохранёнными ключами.
+    """
+    name = "redis"
+
+    def __init__(self, url: str = REDIS_URL, max_connections: int = REDIS_MAX_CONNECTIONS):
+        self.url = url
+        self.max_connections = max_connections
+        self._client: Optional[redis.Redis] = None
+        self._async_client: Optional[redis.asyncio.Redis] = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self) -> redis.Redis:
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    pool = redis.BlockingConnectionPool.from_url(self.url, max_connections=self.max_connections)
+                    self._client = redis.Redis(connection_pool=pool)
+        return self._client
+
+    @property
+    def async_client(self) -> redis.asyncio.Redis:
+        # Для обработчиков FastAPI: не блокирует event loop
+        if self._async_client is None:
+            with self._lock:
+                if self._async_client is None:
+                    self._async_client = redis.asyncio.Redis.from_url(
+                        self.url, max_connections=self.max_connections
+                    )
+        return self._async_client
+
+    def get(self, key: str) -> Optional[bytes]:
+        data = self.client.get(key)
+        return base64.b64decode(data) if data else None
+
+    def set(self, key: str, value: bytes, ttl: int):
+        self.client.setex(key, ttl, base64.b64encode(value).decode())
+
+    async def aget(self, key: str) -> Optional[bytes]:
+        data = await self.async_client.get(key)
+        return base64.b64decode(data) if data else None
+
+
+class MasterKeyCache:
+    """
+    Мастер-ключи пользователей: короткоживущий LRU процесса перед общим хранилищем.
+    Промахи локально не кэшируются — ключ, сохранённый другим процессом, виден сразу.
+    """
+
+    def __init__(self, backend, local_ttl: float = MASTER_KEY_LOCAL_TTL,
+                 local_size: int = MASTER_KEY_LOCAL_SIZE, ttl: int = MASTER_KEY_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self._local: TTLCache[bytes] = TTLCache(local_size, local_ttl)
+        self._lock = threading.Lock()
+        self.counters = {"backend_hits": 0, "backend_misses": 0, "backend_errors": 0}
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+
+    @staticmethod
+    def _key(user_id: int) -> str:
+        return f"user:{user_id}:master_key"
+
+    def _record(self, started: float, value: Optional[bytes] = None, error: bool = False):
+        elapsed = time.monotonic() - started
+        with self._lock:
+            if error:
+                self.counters["backend_errors"] += 1
+            else:
+                self.counters["backend_hits" if value else "backend_misses"] += 1
+            self._latency_total += elapsed
+            self._latency_max = max(self._latency_max, elapsed)
+
+    def get(self, user_id: int) -> Optional[bytes]:
+        master_key = self._local.get(user_id)
+        if master_key is not None:
+            return master_key
+        started = time.monotonic()
+        try:
+            master_key = self.backend.get(self._key(user_id))
+        except Exception:
+            self._record(started, error=True)
+            raise
+        self._record(started, master_key)
+        if master_key:
+            self._local.set(user_id, master_key)
+        return master_key
+
+    async def aget(self, user_id: int) -> Optional[bytes]:
+        master_key = self._local.get(user_id)
+        if master_key is not None:
+            return master_key
+        started = time.monotonic()
+        try:
+            master_key = await self.backend.aget(self._key(user_id))
+        except Exception:
+            self._record(started, error=True)
+            raise
+        self._record(started, master_key)
+        if master_key:
+            self._local.set(user_id, master_key)
+        return master_key
+
+    def save(self, user_id: int, master_key: bytes):
+        self.backend.set(self._key(user_id), master_key, self.ttl)
+        self._local.set(user_id, master_key)
+
+    def stats(self) -> dict:
+        with self._lock:
+            calls = sum(self.counters.values())
+            return {
+                "backend": self.backend.name,
+                "local": self._local.stats(),
+                **self.counters,
+                "backend_avg_ms": round(self._latency_total / calls * 1000, 3) if calls else 0.0,
+                "backend_max_ms": round(self._latency_max * 1000, 3),
+            }
+
+
+_master_keys: Optional[MasterKeyCache] = None
+_master_keys_lock = threading.Lock()
+
+
+def get_master_key_cache() -> MasterKeyCache:
+    """Кэш процесса; бэкенд выбирается CACHE_BACKEND при первом обращении."""
+    global _master_keys
+    with _master_keys_lock:
+        if _master_keys is None:
+            backend = MemoryBackend() if CACHE_BACKEND == "memory" else RedisBackend()
+            _master_keys = MasterKeyCache(backend)
+            logger.info(f"Кэш мастер-ключей: {backend.name}, локально {MASTER_KEY_LOCAL_TTL} с")
+        return _master_keys
 
-redis_client = redis.Redis(host='localhost', port=6379, db=0)
 
 def save_master_key(user_id: int, master_key: bytes):
-    """Сохраняет мастер-ключ в Redis."""
-    key = f"user:{user_id}:master_key"
-    redis_client.setex(key, 3600, base64.b64encode(master_key).decode())
+    """Сохраняет мастер-ключ в кэше."""
+    get_master_key_cache().save(user_id, master_key)
+
 
 def get_master_key(user_id: int) -> Optional[bytes]:
-    """Получает мастер-ключ из Redis."""
-    key = f"user:{user_id}:master_key"
-    data = redis_client.get(key)
-    if data:
-        return base64.b64decode(data)
-    return None
\ No newline at end of file
+    """Получает мастер-ключ из кэша."""
+    return get_master_key_cache().get(user_id)
+
+
+async def get_master_key_async(user_id: int) -> Optional[bytes]:
+    """Получает мастер-ключ без блокировки event loop."""
+    return await get_master_key_cache().aget(user_id)
+
+
+def master_key_cache_stats() -> dict:
+    return get_master_key_cache().stats()
@@ -0,0 +1,33 @@
+from sqlalchemy.dialects.sqlite import insert
+from sqlmodel import Session, select, func
+
+from mementonos.models import MediaCounter
+
+# Файлы, которые показываются в ленте и учитываются счётчиками
+FEED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.mp4', '.mov', '.avi', '.mkv', '.webm')
+
+
+def bump_media_counter(session: Session, user_id: int, is_common: bool, extension: str, delta: int = 1):
+    """
+    Меняет счётчик в той же транзакции, что и запись FileEncrypted.
+    Файлы, которых нет в ленте, не учитываются.
+    """
+    if extension not in FEED_EXTENSIONS:
+        return
+    stmt = insert(MediaCounter).values(user_id=user_id, is_common=is_common, count=max(delta, 0))
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[MediaCounter.user_id, MediaCounter.is_common],
+        set_={"count": func.max(MediaCounter.count + delta, 0)},
+    )
+    session.execute(stmt)
+
+
+def feed_count(session: Session, user_ids: list[int], is_common: bool) -> int:
+    """Сколько файлов в ленте: сумма счётчиков, без обхода fileencrypted."""
+    total = session.exec(
+        select(func.coalesce(func.sum(MediaCounter.count), 0)).where(
+            MediaCounter.user_id.in_(user_ids),
+            MediaCounter.is_common == is_common,
+        )
+    ).one()
+    return int(total)
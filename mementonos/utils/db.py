@@ -0,0 +1,55 @@
+import os
+import sqlite3
+from dotenv import load_dotenv
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from mementonos.utils.logger import get_logger
+
+load_dotenv()
+logger = get_logger(__name__)
+
+# Профиль SQLite. "tuned" — WAL и прагмы ниже, "default" — настройки SQLite как есть
+DB_PROFILE = os.getenv("DB_PROFILE", "tuned")
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL")
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", 256 * 1024 * 1024))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", 5000))
+# Отрицательное значение — в КиБ, т.е. 32 МБ страничного кэша на соединение
+DB_CACHE_SIZE = int(os.getenv("DB_CACHE_SIZE", -32 * 1024))
+
+# Пул Reflex (rx.session) настраивается переменными SQLALCHEMY_*. По умолчанию
+# 5 + 10 соединений — меньше, чем io-пул API (EXECUTOR_IO_THREADS) плюс обработчики
+# событий Reflex, и потоки ждали бы соединение дольше, чем сам запрос.
+if DB_PROFILE == "tuned":
+    os.environ.setdefault("SQLALCHEMY_POOL_SIZE", "20")
+    os.environ.setdefault("SQLALCHEMY_MAX_OVERFLOW", "10")
+    # Соединение с файлом SQLite не рвётся — ping перед каждым checkout не нужен
+    os.environ.setdefault("SQLALCHEMY_POOL_PRE_PING", "false")
+
+
+def sqlite_pragmas() -> list[str]:
+    if DB_PROFILE != "tuned":
+        return []
+    return [
+        # WAL: читатели не блокируют писателя и наоборот. Режим хранится в файле БД
+        "PRAGMA journal_mode=WAL",
+        # В WAL NORMAL не теряет целостность, только последние транзакции при сбое питания
+        f"PRAGMA synchronous={DB_SYNCHRONOUS}",
+        f"PRAGMA mmap_size={DB_MMAP_SIZE}",
+        f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}",
+        f"PRAGMA cache_size={DB_CACHE_SIZE}",
+        "PRAGMA temp_store=MEMORY",
+    ]
+
+
+@event.listens_for(Engine, "connect")
+def _apply_sqlite_profile(dbapi_connection, connection_record):
+    """Прагмы для каждого нового соединения с SQLite, в том числе из rx.session()."""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma in sqlite_pragmas():
+            cursor.execute(pragma)
+    finally:
+        cursor.close()
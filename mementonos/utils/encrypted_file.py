@@ -0,0 +1,367 @@
+import io
+import os
+import struct
+from typing import BinaryIO, Iterator, Optional
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cryptography.exceptions import InvalidTag
+
+from mementonos.utils.security import decrypt_data
+from mementonos.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Формат контейнера (версия 1):
+#   заголовок: MAGIC(7) | version(1) | chunk_size(4, BE) | nonce_prefix(8)
+#   далее чанки: AES-256-GCM(plaintext[i]) + tag(16)
+# Все чанки, кроме последнего, содержат ровно chunk_size байт открытого текста.
+# nonce чанка = nonce_prefix + номер чанка (4 байта, BE), в AAD входит заголовок
+# и флаг последнего чанка — так нельзя переставить, подменить или обрезать чанки.
+# Старые .enc файлы (один Fernet-токен) начинаются с "gAAAAA" и отличаются по MAGIC.
+# Недописанный контейнер (.part) может заканчиваться хвостом — записью неполного чанка:
+#   nonce(12) | AES-256-GCM(хвост) + tag(16), отдельный ключ, в AAD заголовок и номер чанка.
+# Хвост не чанк: читатель готового файла его не видит, resume() возвращает его в буфер.
+MAGIC = b"MNOSENC"
+VERSION = 1
+HEADER = struct.Struct(">7sBI8s")
+TAG_SIZE = 16
+TAIL_NONCE_SIZE = 12
+DEFAULT_CHUNK_SIZE = int(os.getenv("ENC_CHUNK_SIZE", 256 * 1024))
+MAX_CHUNK_SIZE = 16 * 1024 * 1024
+
+
+class EncryptedFileError(Exception):
+    """Файл повреждён, подменён или зашифрован другим ключом."""
+
+
+def _file_key(master_key: bytes) -> AESGCM:
+    """Отдельный ключ для файлов, чтобы не использовать master_key в двух алгоритмах."""
+    hkdf = HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=None,
+        info=b"mementonos-file-v1",
+    )
+    return AESGCM(hkdf.derive(master_key))
+
+
+def _tail_key(master_key: bytes) -> AESGCM:
+    """Ключ хвостов: у хвоста случайный nonce, с nonce чанков он не должен пересекаться."""
+    hkdf = HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=None,
+        info=b"mementonos-file-tail-v1",
+    )
+    return AESGCM(hkdf.derive(master_key))
+
+
+def _nonce(prefix: bytes, index: int) -> bytes:
+    return prefix + struct.pack(">I", index)
+
+
+def _aad(header: bytes, final: bool) -> bytes:
+    return header + (b"\x01" if final else b"\x00")
+
+
+def is_chunked(head: bytes) -> bool:
+    """Проверяет по первым байтам, что это новый чанковый формат."""
+    return head[:len(MAGIC)] == MAGIC
+
+
+class ChunkedWriter:
+    """
+    Потоковое шифрование в контейнер: в памяти держится не больше одного чанка.
+
+    Пример:
+        with open(path, "wb") as f, ChunkedWriter(f, master_key) as writer:
+            for part in parts:
+                writer.write(part)
+    """
+
+    def __init__(self, fileobj: BinaryIO, master_key: bytes, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        if not 0 < chunk_size <= MAX_CHUNK_SIZE:
+            raise ValueError(f"Недопустимый размер чанка: {chunk_size}")
+        self._setup(fileobj, master_key, HEADER.pack(MAGIC, VERSION, chunk_size, os.urandom(8)))
+        self._file.write(self._header)
+
+    def _setup(self, fileobj: BinaryIO, master_key: bytes, header: bytes, index: int = 0):
+        _, _, self.chunk_size, self._prefix = HEADER.unpack(header)
+        self._file = fileobj
+        self._aead = _file_key(master_key)
+        self._tail_aead = _tail_key(master_key)
+        self._header = header
+        self._buffer = bytearray()
+        self._index = index
+        self._closed = False
+        self.plaintext_size = index * self.chunk_size
+
+    @classmethod
+    def resume(cls, fileobj: BinaryIO, master_key: bytes, plaintext_size: int) -> "ChunkedWriter":
+        """
+        Продолжает незаконченный контейнер (файл открыт в r+b) после plaintext_size байт,
+        сохранённых через suspend(). Всё, что записано после них, отрезается.
+        """
+        header = fileobj.read(HEADER.size)
+        if len(header) < HEADER.size or not is_chunked(header):
+            raise EncryptedFileError("Неизвестный формат файла")
+        _, version, chunk_size, _ = HEADER.unpack(header)
+        if version != VERSION or not 0 < chunk_size <= MAX_CHUNK_SIZE:
+            raise EncryptedFileError("Контейнер нельзя продолжить с этого места")
+        index, tail_size = divmod(plaintext_size, chunk_size)
+        end = HEADER.size + index * (chunk_size + TAG_SIZE)
+        size = fileobj.seek(0, io.SEEK_END)
+        if size < end:
+            raise EncryptedFileError("Контейнер обрезан")
+
+        writer = cls.__new__(cls)
+        writer._setup(fileobj, master_key, header, index)
+        if tail_size:
+            fileobj.seek(end)
+            # Не больше одного чанка: хвост или начало следующего чанка, см. _read_tail
+            rest = fileobj.read(min(size - end, chunk_size + TAG_SIZE + TAIL_NONCE_SIZE))
+            writer._buffer = bytearray(writer._read_tail(rest, size - end, tail_size))
+            writer.plaintext_size += tail_size
+        fileobj.truncate(end)
+        fileobj.seek(end)
+        return writer
+
+    def _read_tail(self, rest: bytes, rest_size: int, tail_size: int) -> bytes:
+        """Открытый текст хвоста по началу того, что лежит в файле после последнего целого чанка."""
+        if rest_size == TAIL_NONCE_SIZE + tail_size + TAG_SIZE:
+            nonce, sealed = rest[:TAIL_NONCE_SIZE], rest[TAIL_NONCE_SIZE:rest_size]
+            try:
+                return self._tail_aead.decrypt(nonce, sealed, self._tail_aad())
+            except InvalidTag:
+                pass
+        # Процесс упал после записи следующих чанков, но до сохранения нового размера:
+        # хвост — начало следующего чанка
+        if len(rest) >= self.chunk_size + TAG_SIZE:
+            try:
+                chunk = self._aead.decrypt(
+                    _nonce(self._prefix, self._index),
+                    rest[:self.chunk_size + TAG_SIZE],
+                    _aad(self._header, False),
+                )
+                return chunk[:tail_size]
+            except InvalidTag:
+                pass
+        raise EncryptedFileError("Хвост контейнера повреждён")
+
+    def _tail_aad(self) -> bytes:
+        return self._header + struct.pack(">I", self._index)
+
+    def _emit(self, data: bytes, final: bool):
+        self._file.write(self._aead.encrypt(_nonce(self._prefix, self._index), data, _aad(self._header, final)))
+        self._index += 1
+
+    def write(self, data: bytes) -> int:
+        if self._closed:
+            raise ValueError("Запись в закрытый контейнер")
+        self._buffer += data
+        self.plaintext_size += len(data)
+        # Строго больше: последний чанк шифруется только в close() с флагом final
+        while len(self._buffer) > self.chunk_size:
+            self._emit(bytes(self._buffer[:self.chunk_size]), final=False)
+            del self._buffer[:self.chunk_size]
+        return len(data)
+
+    def suspend(self) -> int:
+        """
+        Сохраняет всё записанное так, чтобы продолжить через resume(), и возвращает размер
+        открытого текста. Целые чанки шифруются как не последние, остаток — хвостом.
+        После suspend() писать можно только в новый writer из resume().
+        """
+        while len(self._buffer) >= self.chunk_size:
+            self._emit(bytes(self._buffer[:self.chunk_size]), final=False)
+            del self._buffer[:self.chunk_size]
+        if self._buffer:
+            nonce = os.urandom(TAIL_NONCE_SIZE)
+            self._file.write(nonce + self._tail_aead.encrypt(nonce, bytes(self._buffer), self._tail_aad()))
+        self._file.flush()
+        self._closed = True
+        return self.plaintext_size
+
+    def close(self):
+        if self._closed:
+            return
+        self._emit(bytes(self._buffer), final=True)
+        self._buffer = bytearray()
+        self._closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+
+
+class ChunkedReader(io.RawIOBase):
+    """
+    Расшифровка контейнера с произвольным доступом.
+
+    Читает и проверяет только те чанки, которые покрывают запрошенный диапазон,
+    поэтому годится и для Range-запросов, и как файловый объект для PIL.
+    Если передан cache (PlaintextCache) и cache_key, расшифрованные чанки
+    берутся из него и кладутся в него под ключом cache_key + (номер,);
+    параллельные чтения одного чанка расшифровывают его один раз.
+    """
+
+    def __init__(self, fileobj: BinaryIO, master_key: bytes, cache=None, cache_key: tuple = ()):
+        super().__init__()
+        self._file = fileobj
+        self._cache = cache
+        self._cache_key = cache_key
+        self._header = fileobj.read(HEADER.size)
+        if len(self._header) < HEADER.size or not is_chunked(self._header):
+            raise EncryptedFileError("Неизвестный формат файла")
+        _, version, chunk_size, self._prefix = HEADER.unpack(self._header)
+        if version != VERSION or not 0 < chunk_size <= MAX_CHUNK_SIZE:
+            raise EncryptedFileError(f"Неподдерживаемая версия контейнера: {version}")
+        self.chunk_size = chunk_size
+        self._aead = _file_key(master_key)
+
+        fileobj.seek(0, io.SEEK_END)
+        body = fileobj.tell() - HEADER.size
+        stored = chunk_size + TAG_SIZE
+        self.chunk_count = max(1, -(-body // stored))
+        last = body - (self.chunk_count - 1) * stored
+        if last < TAG_SIZE:
+            raise EncryptedFileError("Контейнер обрезан")
+        self.size = (self.chunk_count - 1) * chunk_size + last - TAG_SIZE
+        self._pos = 0
+        self._cached_index: Optional[int] = None
+        self._cached_chunk = b""
+
+    def read_chunk(self, index: int) -> bytes:
+        """Расшифровывает один чанк по номеру."""
+        if not 0 <= index < self.chunk_count:
+            raise IndexError(index)
+        if index == self._cached_index:
+            return self._cached_chunk
+        if self._cache is not None:
+            chunk = self._cache.get_or_compute((*self._cache_key, index), lambda: self._decrypt_chunk(index))
+        else:
+            chunk = self._decrypt_chunk(index)
+        self._cached_index, self._cached_chunk = index, chunk
+        return chunk
+
+    def _decrypt_chunk(self, index: int) -> bytes:
+        stored = self.chunk_size + TAG_SIZE
+        self._file.seek(HEADER.size + index * stored)
+        data = self._file.read(stored)
+        final = index == self.chunk_count - 1
+        try:
+            chunk = self._aead.decrypt(_nonce(self._prefix, index), data, _aad(self._header, final))
+        except InvalidTag:
+            raise EncryptedFileError(f"Чанк {index} не прошёл проверку")
+        return chunk
+
+    def iter_range(self, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """Отдаёт открытый текст диапазона [start, end) по кускам не больше чанка."""
+        end = self.size if end is None else min(end, self.size)
+        pos = max(0, start)
+        while pos < end:
+            index, offset = divmod(pos, self.chunk_size)
+            chunk = self.read_chunk(index)
+            piece = chunk[offset:offset + (end - pos)]
+            if not piece:
+                break
+            pos += len(piece)
+            yield piece
+
+    # --- io.RawIOBase ---
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self.size + offset
+        else:
+            raise ValueError(f"Неверный whence: {whence}")
+        if pos < 0:
+            raise ValueError("Отрицательная позиция")
+        self._pos = pos
+        return pos
+
+    def readinto(self, buffer) -> int:
+        view = memoryview(buffer).cast("B")
+        written = 0
+        for piece in self.iter_range(self._pos, self._pos + len(view)):
+            view[written:written + len(piece)] = piece
+            written += len(piece)
+        self._pos += written
+        return written
+
+    def close(self):
+        if not self.closed:
+            self._file.close()
+        super().close()
+
+
+class LegacyReader(io.BytesIO):
+    """Старый .enc — один Fernet-токен. Расшифровывается целиком, как раньше."""
+
+    def __init__(self, fileobj: BinaryIO, master_key: bytes, cache=None, cache_key: tuple = ()):
+        with fileobj:
+            if cache is not None:
+                data = cache.get_or_compute(cache_key, lambda: decrypt_data(fileobj.read(), master_key))
+            else:
+                data = decrypt_data(fileobj.read(), master_key)
+            super().__init__(data)
+        self.size = len(self.getbuffer())
+        self.chunk_size = self.size or 1
+
+    def iter_range(self, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        end = self.size if end is None else min(end, self.size)
+        if start < end:
+            yield self.getbuffer()[start:end].tobytes()
+
+
+def open_encrypted(path, master_key: bytes, cache=None) -> ChunkedReader | LegacyReader:
+    """
+    Открывает .enc файл любого формата для чтения открытого текста.
+    cache — необязательный PlaintextCache; ключи привязаны к пути и версии файла.
+    """
+    f = open(path, "rb")
+    try:
+        cache_key = ()
+        if cache is not None:
+            # Версию берём у уже открытого файла: замена файла после open() не перепутает ключи
+            stat = os.fstat(f.fileno())
+            cache_key = (str(path), stat.st_mtime_ns, stat.st_size)
+        head = f.read(len(MAGIC))
+        f.seek(0)
+        if is_chunked(head):
+            return ChunkedReader(f, master_key, cache, cache_key)
+        return LegacyReader(f, master_key, cache, cache_key)
+    except Exception:
+        f.close()
+        raise
+
+
+def encrypt_to_file(path, data: bytes, master_key: bytes, chunk_size: int = DEFAULT_CHUNK_SIZE):
+    """Шифрует байты в новый формат и пишет в файл."""
+    with open(path, "wb") as f, ChunkedWriter(f, master_key, chunk_size) as writer:
+        view = memoryview(data)
+        for start in range(0, len(view), chunk_size):
+            writer.write(view[start:start + chunk_size])
+
+
+def read_decrypted(path, master_key: bytes, cache=None) -> bytes:
+    """Целиком расшифровывает файл любого формата. Только для небольших файлов."""
+    with open_encrypted(path, master_key, cache) as reader:
+        return b"".join(reader.iter_range())
@@ -0,0 +1,103 @@
+import asyncio
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, TypeVar
+from dotenv import load_dotenv
+
+from mementonos.utils.logger import get_logger
+
+load_dotenv()
+logger = get_logger(__name__)
+
+# Пулы для блокирующей работы в обработчиках FastAPI.
+# io — запросы к БД, stat/чтение файлов; crypto — расшифровка (AES-GCM и Fernet
+# отпускают GIL в OpenSSL, поэтому потоков достаточно). Тяжёлые PIL и ffmpeg
+# выполняются не здесь, а в пуле процессов воркера (worker_service).
+EXECUTOR_IO_THREADS = int(os.getenv("EXECUTOR_IO_THREADS", 16))
+EXECUTOR_CRYPTO_THREADS = int(os.getenv("EXECUTOR_CRYPTO_THREADS", max(2, os.cpu_count() or 2)))
+# kdf — PBKDF2 при разблокировке ключа: сотни миллисекунд CPU на вызов, поэтому отдельный
+# небольшой пул, чтобы он не занимал crypto-пул, нужный для отдачи медиа
+EXECUTOR_KDF_THREADS = int(os.getenv("EXECUTOR_KDF_THREADS", max(1, (os.cpu_count() or 2) // 2)))
+
+T = TypeVar("T")
+
+
+class MeteredExecutor:
+    """Пул потоков со счётчиками: сколько задач в работе, в очереди и сколько они ждали."""
+
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"mementonos-{name}")
+        self._lock = threading.Lock()
+        self._active = 0
+        self._queued = 0
+        self.counters = {"submitted": 0, "completed": 0, "failed": 0, "peak_active": 0, "peak_queued": 0}
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _call(self, submitted_at: float, fn: Callable[[], T]) -> T:
+        waited = time.monotonic() - submitted_at
+        with self._lock:
+            self._queued -= 1
+            self._active += 1
+            self.counters["peak_active"] = max(self.counters["peak_active"], self._active)
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        failed = False
+        try:
+            return fn()
+        except Exception:
+            failed = True
+            raise
+        finally:
+            with self._lock:
+                self._active -= 1
+                self.counters["failed" if failed else "completed"] += 1
+
+    def submit(self, fn: Callable[..., T], *args, **kwargs) -> asyncio.Future:
+        """Ставит fn в пул и возвращает asyncio.Future текущего event loop."""
+        with self._lock:
+            self._queued += 1
+            self.counters["submitted"] += 1
+            self.counters["peak_queued"] = max(self.counters["peak_queued"], self._queued)
+        call = functools.partial(self._call, time.monotonic(), functools.partial(fn, *args, **kwargs))
+        return asyncio.get_running_loop().run_in_executor(self._pool, call)
+
+    async def run(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        return await self.submit(fn, *args, **kwargs)
+
+    def stats(self) -> dict:
+        with self._lock:
+            started = self.counters["completed"] + self.counters["failed"] + self._active
+            return {
+                **self.counters,
+                "max_workers": self.max_workers,
+                "active": self._active,
+                "queued": self._queued,
+                "saturation": round(self._active / self.max_workers, 2),
+                "avg_wait_ms": round(self._wait_total / started * 1000, 2) if started else 0.0,
+                "max_wait_ms": round(self._wait_max * 1000, 2),
+            }
+
+
+io_pool = MeteredExecutor("io", EXECUTOR_IO_THREADS)
+crypto_pool = MeteredExecutor("crypto", EXECUTOR_CRYPTO_THREADS)
+kdf_pool = MeteredExecutor("kdf", EXECUTOR_KDF_THREADS)
+
+
+async def run_io(fn: Callable[..., T], *args, **kwargs) -> T:
+    """БД, файловая система и прочий блокирующий ввод-вывод."""
+    return await io_pool.run(fn, *args, **kwargs)
+
+
+async def run_crypto(fn: Callable[..., T], *args, **kwargs) -> T:
+    """Расшифровка и другие вычисления, отпускающие GIL."""
+    return await crypto_pool.run(fn, *args, **kwargs)
+
+
+def executor_stats() -> dict:
+    return {pool.name: pool.stats() for pool in (io_pool, crypto_pool, kdf_pool)}
@@ -0,0 +1,257 @@
+import os
+import secrets
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Iterator, Optional
+
+from mementonos.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Ограничение на одновременные процессы ffmpeg. Пул worker_service делит один семафор
+# на все свои процессы (use_shared_slots); в остальных процессах лимит свой у каждого
+FFMPEG_MAX_PROCS = int(os.getenv("FFMPEG_MAX_PROCS", 2))
+FFMPEG_TIMEOUT = float(os.getenv("FFMPEG_TIMEOUT", 30))
+SINK_READ_SIZE = 64 * 1024
+_slots = threading.BoundedSemaphore(FFMPEG_MAX_PROCS)
+
+
+def use_shared_slots(slots):
+    """
+    Инициализатор процесса пула: слоты ffmpeg берутся из общего семафора
+    multiprocessing, так что лимит FFMPEG_MAX_PROCS — на весь пул, а не на процесс.
+    """
+    global _slots
+    _slots = slots
+
+
+def _parse_range(range_header: str, size: int) -> Optional[tuple[int, int]]:
+    """Один диапазон bytes=... → [start, end); None — заголовок неверный или вне файла."""
+    unit, _, spec = range_header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = min(int(last) + 1, size) if last else size
+        else:
+            # bytes=-N — последние N байт
+            start, end = max(0, size - int(last)), size
+    except ValueError:
+        return None
+    if start < 0 or start >= end:
+        return None
+    return start, end
+
+
+class FFmpegError(Exception):
+    """ffmpeg завершился с ошибкой, по таймауту или не дождался свободного слота."""
+
+
+class FFmpegCancelled(FFmpegError):
+    """Запуск отменён через cancel-событие."""
+
+
+class _PlaintextHandler(BaseHTTPRequestHandler):
+    """Отдаёт открытый текст одного файла с поддержкой Range — ffmpeg может делать seek."""
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server: "_PlaintextServer" = self.server
+        if self.path != server.secret_path:
+            self.send_error(404)
+            return
+
+        size = server.reader.size
+        range_header = self.headers.get("Range", "")
+        span = _parse_range(range_header, size) if range_header else (0, size)
+        if span is None:
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{size}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        start, end = span
+        self.send_response(206 if range_header else 200)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(end - start))
+        if range_header:
+            self.send_header("Content-Range", f"bytes {start}-{end - 1}/{size}")
+        self.end_headers()
+
+        pos = start
+        try:
+            while pos < end:
+                # Ридер не потокобезопасен, а ffmpeg при seek открывает новое соединение
+                with server.lock:
+                    piece = next(server.reader.iter_range(pos, end), b"")
+                if not piece:
+                    break
+                self.wfile.write(piece)
+                pos += len(piece)
+        except (BrokenPipeError, ConnectionResetError):
+            # ffmpeg прочитал сколько нужно и закрыл соединение — это нормально
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _PlaintextServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, reader):
+        super().__init__(("127.0.0.1", 0), _PlaintextHandler)
+        self.reader = reader
+        self.lock = threading.Lock()
+        self.secret_path = "/" + secrets.token_urlsafe(32)
+
+
+@contextmanager
+def _serving(server: ThreadingHTTPServer) -> Iterator[str]:
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        host, port = server.server_address[:2]
+        yield f"http://{host}:{port}{server.secret_path}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@contextmanager
+def plaintext_url(reader) -> Iterator[str]:
+    """
+    Временный loopback-URL, по которому ffmpeg читает расшифрованный файл.
+    Открытый текст не пишется на диск, а seek по Range расшифровывает только нужные чанки.
+    Живёт только внутри блока with и доступен лишь по случайному пути.
+    """
+    with _serving(_PlaintextServer(reader)) as url:
+        yield url
+
+
+class _SinkHandler(BaseHTTPRequestHandler):
+    """Принимает файлы, которые ffmpeg пишет по HTTP (-method PUT), и отдаёт их телом в accept."""
+    protocol_version = "HTTP/1.1"
+
+    def do_PUT(self):
+        server: "_SinkServer" = self.server
+        prefix = server.secret_path + "/"
+        name = self.path[len(prefix):] if self.path.startswith(prefix) else ""
+        try:
+            accepted = bool(name) and server.accept(name, self._body())
+        except Exception as e:
+            logger.error(f"Не удалось принять {name} от ffmpeg: {e}")
+            server.errors.append(f"{name}: {e}")
+            self.close_connection = True
+            self.send_error(500)
+            return
+        if not accepted:
+            self.close_connection = True
+            self.send_error(404)
+            return
+        self.send_response(201)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    do_POST = do_PUT
+
+    def _body(self) -> Iterator[bytes]:
+        """Тело запроса по кускам: ffmpeg шлёт его chunked, но Content-Length тоже годится."""
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            while True:
+                size = int(self.rfile.readline().split(b";", 1)[0].strip(), 16)
+                if size == 0:
+                    # Трейлеры до пустой строки
+                    while self.rfile.readline() not in (b"\r\n", b"\n", b""):
+                        pass
+                    return
+                while size > 0:
+                    piece = self.rfile.read(min(size, SINK_READ_SIZE))
+                    if not piece:
+                        raise ConnectionError("Тело запроса оборвалось")
+                    size -= len(piece)
+                    yield piece
+                self.rfile.readline()
+        else:
+            left = int(self.headers.get("Content-Length", 0))
+            while left > 0:
+                piece = self.rfile.read(min(left, SINK_READ_SIZE))
+                if not piece:
+                    raise ConnectionError("Тело запроса оборвалось")
+                left -= len(piece)
+                yield piece
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _SinkServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, accept: Callable[[str, Iterator[bytes]], bool]):
+        super().__init__(("127.0.0.1", 0), _SinkHandler)
+        self.accept = accept
+        self.errors: list[str] = []
+        self.secret_path = "/" + secrets.token_urlsafe(32)
+
+
+@contextmanager
+def sink_url(accept: Callable[[str, Iterator[bytes]], bool]) -> Iterator[str]:
+    """
+    Временный loopback-URL, куда ffmpeg пишет выходные файлы: <url>/<имя> методом PUT.
+    accept(имя, куски тела) вызывается по мере прихода данных и возвращает False
+    для неожиданного имени — так выход ffmpeg можно шифровать, не сохраняя открытый текст.
+    Если accept хотя бы раз упал, при выходе из блока бросается FFmpegError.
+    """
+    server = _SinkServer(accept)
+    with _serving(server) as url:
+        yield url
+    if server.errors:
+        raise FFmpegError(f"Выход ffmpeg не сохранён: {'; '.join(server.errors)}")
+
+
+def run_ffmpeg(
+    args: list[str],
+    timeout: float = FFMPEG_TIMEOUT,
+    cancel: Optional[threading.Event] = None,
+    binary: str = "ffmpeg",
+) -> bytes:
+    """
+    Запускает ffmpeg/ffprobe с ограничением параллелизма, таймаутом и отменой.
+    Возвращает stdout. Время ожидания слота входит в timeout.
+    """
+    deadline = time.monotonic() + timeout
+    if not _slots.acquire(timeout=timeout):
+        raise FFmpegError(f"Нет свободного слота {binary} за {timeout} с")
+    try:
+        proc = subprocess.Popen(
+            [binary, "-hide_banner", "-loglevel", "error", *args],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        while True:
+            try:
+                stdout, stderr = proc.communicate(timeout=0.25)
+                break
+            except subprocess.TimeoutExpired:
+                if cancel is not None and cancel.is_set():
+                    proc.kill()
+                    proc.communicate()
+                    raise FFmpegCancelled(f"{binary} отменён")
+                if time.monotonic() > deadline:
+                    proc.kill()
+                    proc.communicate()
+                    raise FFmpegError(f"{binary} не уложился в {timeout} с")
+    finally:
+        _slots.release()
+
+    if proc.returncode != 0:
+        raise FFmpegError(f"{binary} вернул {proc.returncode}: {stderr.decode(errors='replace')[-500:]}")
+    return stdout
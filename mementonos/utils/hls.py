@@ -0,0 +1,106 @@
+import os
+import re
+import shutil
+from pathlib import Path
+from typing import Iterator
+from dotenv import load_dotenv
+
+from mementonos.utils.encrypted_file import open_encrypted, ChunkedWriter
+from mementonos.utils.ffmpeg import FFmpegError, plaintext_url, sink_url, run_ffmpeg
+from mementonos.utils.thumbnails import VIDEO_EXTENSIONS
+from mementonos.utils.logger import get_logger
+
+load_dotenv()
+logger = get_logger(__name__)
+
+HLS_ENABLED = os.getenv("HLS_ENABLED", "0") == "1"
+HLS_MIN_SIZE = int(os.getenv("HLS_MIN_SIZE", 50 * 1024 * 1024))
+HLS_SEGMENT_SECONDS = int(os.getenv("HLS_SEGMENT_SECONDS", 6))
+HLS_TIMEOUT = float(os.getenv("HLS_TIMEOUT", 60 * 60))
+
+PLAYLIST_NAME = "index.m3u8"
+SEGMENT_RE = re.compile(r"^seg_\d{5}\.ts$")
+
+# Кодеки, которые браузеры играют из HLS без перекодирования
+COPY_VIDEO_CODECS = ("h264",)
+COPY_AUDIO_CODECS = ("aac", "mp3")
+
+
+def hls_dir_for(file_path: str) -> Path:
+    """Сегменты хранятся рядом с оригиналом: <имя>.hls/"""
+    path = Path(file_path)
+    return path.with_name(f"{path.stem}.hls")
+
+
+def should_segment(extension: str, original_size: int) -> bool:
+    return HLS_ENABLED and extension.lower() in VIDEO_EXTENSIONS and original_size >= HLS_MIN_SIZE
+
+
+def _probe_codec(url: str, stream: str) -> str:
+    output = run_ffmpeg([
+        '-select_streams', f'{stream}:0',
+        '-show_entries', 'stream=codec_name',
+        '-of', 'csv=p=0',
+        url,
+    ], binary='ffprobe')
+    return output.decode().strip()
+
+
+def _encrypt_stream(path: Path, pieces: Iterator[bytes], master_key: bytes):
+    """Шифрует поток в path через временный файл: повторный PUT плейлиста заменяет его целиком."""
+    tmp_path = path.with_name(path.name + ".tmp")
+    try:
+        with open(tmp_path, "wb") as f, ChunkedWriter(f, master_key) as writer:
+            for piece in pieces:
+                writer.write(piece)
+        tmp_path.replace(path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def store_hls(file_path: str, master_key: bytes) -> str:
+    """
+    Ремуксит (или перекодирует, если кодек не подходит) видео в HLS. ffmpeg отправляет
+    сегменты и плейлист PUT-запросами на loopback, и каждый шифруется отдельным контейнером
+    по мере прихода — открытый текст на диск не попадает. Возвращает путь к каталогу.
+    """
+    target_dir = hls_dir_for(file_path)
+    staging_dir = target_dir.with_name(f"{target_dir.name}.writing.{os.urandom(4).hex()}")
+    staging_dir.mkdir()
+
+    def accept(name: str, pieces: Iterator[bytes]) -> bool:
+        if name != PLAYLIST_NAME and not SEGMENT_RE.match(name):
+            return False
+        _encrypt_stream(staging_dir / f"{name}.enc", pieces, master_key)
+        return True
+
+    try:
+        with open_encrypted(file_path, master_key) as reader, plaintext_url(reader) as url:
+            video_codec = _probe_codec(url, 'v')
+            audio_codec = _probe_codec(url, 'a')
+            video_args = ['-c:v', 'copy'] if video_codec in COPY_VIDEO_CODECS else \
+                ['-c:v', 'libx264', '-preset', 'veryfast', '-crf', '23', '-pix_fmt', 'yuv420p']
+            audio_args = ['-c:a', 'copy'] if audio_codec in COPY_AUDIO_CODECS else ['-c:a', 'aac', '-b:a', '160k']
+            logger.info(f"HLS {file_path}: video={video_codec or '-'} audio={audio_codec or '-'}")
+
+            with sink_url(accept) as out_url:
+                run_ffmpeg([
+                    '-i', url,
+                    '-map', '0:v:0', '-map', '0:a:0?',
+                    *video_args, *audio_args,
+                    '-f', 'hls',
+                    '-hls_time', str(HLS_SEGMENT_SECONDS),
+                    '-hls_playlist_type', 'vod',
+                    '-method', 'PUT',
+                    '-hls_segment_filename', f'{out_url}/seg_%05d.ts',
+                    f'{out_url}/{PLAYLIST_NAME}',
+                ], timeout=HLS_TIMEOUT)
+
+        if not (staging_dir / f"{PLAYLIST_NAME}.enc").exists():
+            raise FFmpegError("ffmpeg не прислал плейлист")
+        if target_dir.exists():
+            shutil.rmtree(target_dir)
+        staging_dir.replace(target_dir)
+        return str(target_dir)
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
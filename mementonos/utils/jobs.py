@@ -0,0 +1,238 @@
+import json
+import os
+import reflex as rx
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional
+from sqlalchemy import update, delete, func
+from sqlmodel import select, Session
+
+from mementonos.models import MediaJob
+from mementonos.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Приоритеты: чем больше, тем раньше
+PRIORITY_INTERACTIVE = 10   # пользователь прямо сейчас ждёт результат
+PRIORITY_INGEST = 0         # обработка после загрузки
+PRIORITY_BACKFILL = -10     # догоняющая обработка старых записей
+
+RETRY_BASE_SECONDS = 10
+# RetryLater (нет мастер-ключа) — обычное дело для офлайн-пользователей: попытки не тратятся,
+# задача просто откладывается
+RETRY_LATER_SECONDS = int(os.getenv("JOB_RETRY_LATER_SECONDS", 600))
+# Сколько хранятся failed-задачи. Пока такая есть, дубль не ставится — иначе backfill
+# при каждом запуске воркера плодил бы новые; после удаления файл снова попадёт в backfill
+FAILED_RETENTION_SECONDS = int(os.getenv("JOB_FAILED_RETENTION_SECONDS", 7 * 24 * 3600))
+ACTIVE_STATUSES = ("queued", "running")
+DEDUPE_STATUSES = ACTIVE_STATUSES + ("failed",)
+
+JOB_HANDLERS: Dict[str, Callable[[dict], None]] = {}
+
+
+class RetryLater(Exception):
+    """Задачу пока нельзя выполнить (например, мастер-ключа нет в кэше)."""
+
+
+@dataclass
+class ClaimedJob:
+    id: int
+    kind: str
+    payload: dict
+    attempts: int
+
+
+def job_handler(kind: str):
+    """Регистрирует функцию-обработчик задачи указанного типа."""
+    def decorator(fn: Callable[[dict], None]):
+        JOB_HANDLERS[kind] = fn
+        return fn
+    return decorator
+
+
+def run_job(kind: str, payload: dict):
+    """Выполняет задачу. Вызывается в процессе пула воркера."""
+    # Импорт регистрирует обработчики в дочернем процессе
+    import mementonos.utils.media_jobs  # noqa: F401
+
+    handler = JOB_HANDLERS.get(kind)
+    if handler is None:
+        raise ValueError(f"Неизвестный тип задачи: {kind}")
+    handler(payload)
+
+
+def enqueue(
+    kind: str,
+    payload: dict,
+    priority: int = PRIORITY_INGEST,
+    dedupe_key: Optional[str] = None,
+    max_attempts: int = 3,
+    session: Optional[Session] = None,
+) -> Optional[int]:
+    """
+    Ставит задачу в очередь. Если активная или failed задача с тем же dedupe_key уже есть,
+    новая не создаётся (приоритет активной повышается при необходимости).
+    Если передан session — задача попадает в ту же транзакцию, commit за вызывающим.
+    """
+    if session is None:
+        with rx.session() as own_session:
+            job_id = enqueue(kind, payload, priority, dedupe_key, max_attempts, own_session)
+            own_session.commit()
+            return job_id
+
+    if dedupe_key:
+        existing = session.exec(
+            select(MediaJob).where(
+                MediaJob.dedupe_key == dedupe_key,
+                MediaJob.status.in_(DEDUPE_STATUSES),
+            )
+        ).first()
+        if existing:
+            if existing.status != "failed" and existing.priority < priority:
+                existing.priority = priority
+                # Отложенная задача (например, ждала ключ) нужна сейчас — не ждём конца задержки
+                existing.run_after = min(existing.run_after, datetime.utcnow())
+                session.add(existing)
+            return existing.id
+
+    job = MediaJob(
+        kind=kind,
+        payload=json.dumps(payload),
+        priority=priority,
+        dedupe_key=dedupe_key,
+        max_attempts=max_attempts,
+    )
+    session.add(job)
+    session.flush()
+    return job.id
+
+
+def claim_job(lease_seconds: int) -> Optional[ClaimedJob]:
+    """Атомарно забирает самую приоритетную готовую задачу."""
+    now = datetime.utcnow()
+    with rx.session() as session:
+        while True:
+            job = session.exec(
+                select(MediaJob)
+                .where(MediaJob.status == "queued", MediaJob.run_after <= now)
+                .order_by(MediaJob.priority.desc(), MediaJob.run_after, MediaJob.id)
+                .limit(1)
+            ).first()
+            if not job:
+                return None
+
+            claimed = ClaimedJob(
+                id=job.id,
+                kind=job.kind,
+                payload=json.loads(job.payload),
+                attempts=job.attempts + 1,
+            )
+            # Условный UPDATE: если задачу уже забрал другой воркер, rowcount == 0
+            result = session.execute(
+                update(MediaJob)
+                .where(MediaJob.id == claimed.id, MediaJob.status == "queued")
+                .values(
+                    status="running",
+                    attempts=claimed.attempts,
+                    locked_until=now + timedelta(seconds=lease_seconds),
+                )
+            )
+            session.commit()
+            if result.rowcount == 1:
+                return claimed
+
+
+def complete_job(job_id: int):
+    """Успешные задачи удаляются, чтобы таблица не росла."""
+    with rx.session() as session:
+        job = session.get(MediaJob, job_id)
+        if job:
+            session.delete(job)
+            session.commit()
+
+
+def fail_job(job_id: int, error: str, retry: bool = True):
+    """Возвращает задачу в очередь с экспоненциальной задержкой или помечает failed."""
+    with rx.session() as session:
+        job = session.get(MediaJob, job_id)
+        if not job:
+            return
+        job.last_error = error[:1000]
+        job.locked_until = None
+        if retry and job.attempts < job.max_attempts:
+            job.status = "queued"
+            job.run_after = datetime.utcnow() + timedelta(seconds=RETRY_BASE_SECONDS * 2 ** (job.attempts - 1))
+        else:
+            job.status = "failed"
+            # Для failed run_after — время отказа, от него считается FAILED_RETENTION_SECONDS
+            job.run_after = datetime.utcnow()
+            logger.error(f"Задача {job.kind}#{job.id} не выполнена: {error}")
+        session.add(job)
+        session.commit()
+
+
+def defer_job(job_id: int, reason: str, delay: float = RETRY_LATER_SECONDS):
+    """Откладывает задачу (RetryLater), не засчитывая попытку."""
+    with rx.session() as session:
+        session.execute(
+            update(MediaJob)
+            .where(MediaJob.id == job_id)
+            .values(
+                status="queued",
+                # claim_job уже увеличил attempts
+                attempts=MediaJob.attempts - 1,
+                locked_until=None,
+                run_after=datetime.utcnow() + timedelta(seconds=delay),
+                last_error=reason[:1000],
+            )
+        )
+        session.commit()
+
+
+def prune_failed_jobs() -> int:
+    """Удаляет failed-задачи старше FAILED_RETENTION_SECONDS."""
+    cutoff = datetime.utcnow() - timedelta(seconds=FAILED_RETENTION_SECONDS)
+    with rx.session() as session:
+        result = session.execute(
+            delete(MediaJob).where(MediaJob.status == "failed", MediaJob.run_after < cutoff)
+        )
+        session.commit()
+        return result.rowcount
+
+
+def renew_leases(job_ids: list[int], lease_seconds: int):
+    """Продлевает аренду выполняемых задач, чтобы долгие задачи не считались зависшими."""
+    if not job_ids:
+        return
+    with rx.session() as session:
+        session.execute(
+            update(MediaJob)
+            .where(MediaJob.id.in_(job_ids), MediaJob.status == "running")
+            .values(locked_until=datetime.utcnow() + timedelta(seconds=lease_seconds))
+        )
+        session.commit()
+
+
+def recover_stale_jobs() -> int:
+    """Возвращает в очередь задачи, чья аренда истекла (воркер упал)."""
+    with rx.session() as session:
+        result = session.execute(
+            update(MediaJob)
+            .where(MediaJob.status == "running", MediaJob.locked_until < datetime.utcnow())
+            .values(status="queued", locked_until=None)
+        )
+        session.commit()
+        return result.rowcount
+
+
+def queue_stats() -> dict:
+    """Глубина очереди: {статус: {тип: количество}}."""
+    with rx.session() as session:
+        rows = session.exec(
+            select(MediaJob.status, MediaJob.kind, func.count())
+            .group_by(MediaJob.status, MediaJob.kind)
+        ).all()
+    stats: dict = {status: {} for status in ("queued", "running", "failed")}
+    for status, kind, count in rows:
+        stats.setdefault(status, {})[kind] = count
+    return stats
@@ -0,0 +1,108 @@
+import asyncio
+import os
+import reflex as rx
+from typing import Callable, Hashable, Optional, TypeVar
+from dotenv import load_dotenv
+
+from mementonos.models import User
+from mementonos.utils.executors import kdf_pool
+from mementonos.utils.security import encrypt_master_key, decrypt_master_key, KDF_ITERATIONS
+from mementonos.utils.logger import get_logger
+
+load_dotenv()
+logger = get_logger(__name__)
+
+# Допуск к kdf-пулу: сколько вычислений может ждать всего и от одного пользователя.
+# Сверх этого запрос сразу отклоняется (KdfBusy), а не копится в очереди
+KDF_MAX_PENDING = int(os.getenv("KDF_MAX_PENDING", 32))
+KDF_MAX_PENDING_PER_USER = int(os.getenv("KDF_MAX_PENDING_PER_USER", 2))
+
+T = TypeVar("T")
+
+
+class KdfBusy(Exception):
+    """Очередь вычисления ключей переполнена — стоит повторить позже."""
+
+
+class KdfLimiter:
+    """
+    Очередь к kdf-пулу с допуском и очередями по пользователям: вычисления одного
+    пользователя идут по одному, повторные нажатия ждут своей очереди и не занимают
+    потоки пула, а при переполнении новые запросы отклоняются.
+    Используется только из event loop, поэтому без блокировок.
+    """
+
+    def __init__(self, max_pending: int, max_pending_per_user: int):
+        self.max_pending = max_pending
+        self.max_pending_per_user = max_pending_per_user
+        self._pending = 0
+        self._per_user: dict[Hashable, int] = {}
+        self._locks: dict[Hashable, asyncio.Lock] = {}
+        self.counters = {"admitted": 0, "rejected": 0}
+
+    async def run(self, user_key: Hashable, fn: Callable[..., T], *args) -> T:
+        if self._pending >= self.max_pending or self._per_user.get(user_key, 0) >= self.max_pending_per_user:
+            self.counters["rejected"] += 1
+            raise KdfBusy("Слишком много запросов, попробуйте через несколько секунд")
+        self.counters["admitted"] += 1
+        self._pending += 1
+        self._per_user[user_key] = self._per_user.get(user_key, 0) + 1
+        lock = self._locks.setdefault(user_key, asyncio.Lock())
+        try:
+            async with lock:
+                return await kdf_pool.run(fn, *args)
+        finally:
+            self._pending -= 1
+            self._per_user[user_key] -= 1
+            if not self._per_user[user_key]:
+                # Никто больше не ждёт этот lock
+                del self._per_user[user_key]
+                del self._locks[user_key]
+
+    def stats(self) -> dict:
+        return {**self.counters, "pending": self._pending, "users": len(self._per_user)}
+
+
+_limiter = KdfLimiter(KDF_MAX_PENDING, KDF_MAX_PENDING_PER_USER)
+
+
+async def unlock_master_key(user: User, password: str) -> Optional[bytes]:
+    """Расшифровывает мастер-ключ пользователя паролем. None — пароль не подошёл."""
+    return await _limiter.run(
+        user.id, decrypt_master_key, user.encrypted_master_key, password, user.kdf_salt, user.kdf_iterations
+    )
+
+
+async def wrap_master_key(user_key: Hashable, master_key: bytes, password: str) -> tuple[bytes, bytes, int]:
+    """Шифрует мастер-ключ паролем с новой солью и текущим KDF_ITERATIONS: (ключ, соль, итерации)."""
+    salt = os.urandom(16)
+    encrypted = await _limiter.run(user_key, encrypt_master_key, master_key, password, salt, KDF_ITERATIONS)
+    return encrypted, salt, KDF_ITERATIONS
+
+
+async def rewrap_if_outdated(user: User, master_key: bytes, password: str):
+    """
+    После успешной разблокировки перешифровывает ключ, если он зашифрован
+    с меньшим числом итераций, чем KDF_ITERATIONS. Пароль есть только в этот момент.
+    """
+    if user.kdf_iterations >= KDF_ITERATIONS:
+        return
+    try:
+        encrypted, salt, iterations = await wrap_master_key(user.id, master_key, password)
+    except KdfBusy:
+        # Не страшно: получится при следующей разблокировке
+        return
+    with rx.session() as session:
+        current = session.get(User, user.id)
+        # Ключ могли уже перешифровать параллельно — тогда оставляем как есть
+        if current and current.kdf_iterations == user.kdf_iterations:
+            current.encrypted_master_key = encrypted
+            current.kdf_salt = salt
+            current.kdf_iterations = iterations
+            session.add(current)
+            session.commit()
+    logger.info(f"Мастер-ключ пользователя {user.id} перешифрован: {user.kdf_iterations} → {iterations} итераций")
+
+
+def kdf_stats() -> dict:
+    return _limiter.stats()
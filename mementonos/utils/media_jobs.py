@@ -0,0 +1,180 @@
+import json
+import reflex as rx
+from pathlib import Path
+
+from mementonos.models import FileEncrypted
+from mementonos.utils.cache import get_master_key
+from sqlmodel import select, or_
+
+from mementonos.utils.jobs import job_handler, enqueue, RetryLater, PRIORITY_INGEST, PRIORITY_BACKFILL
+from mementonos.utils.thumbnails import (
+    store_thumbnail, store_renditions, create_lqip, IMAGE_EXTENSIONS, VIDEO_EXTENSIONS, THUMBNAIL_VERSION,
+)
+from mementonos.utils.encrypted_file import read_decrypted
+from mementonos.utils.hls import store_hls, should_segment, HLS_ENABLED, HLS_MIN_SIZE
+from mementonos.utils.metadata import extract_metadata, MediaMetadata
+from mementonos.utils.security import encrypt_data
+from mementonos.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+def _load_for_processing(file_id: int) -> tuple[FileEncrypted | None, bytes | None]:
+    """Запись файла и мастер-ключ пары. Ключ берётся из кэша, пока пользователь онлайн."""
+    with rx.session() as session:
+        record = session.get(FileEncrypted, file_id)
+    if not record:
+        return None, None
+    master_key = get_master_key(record.uploaded_by_id)
+    if not master_key:
+        raise RetryLater(f"Нет мастер-ключа в кэше для пользователя {record.uploaded_by_id}")
+    return record, master_key
+
+
+def enqueue_ingest_jobs(file_id: int, extension: str = "", priority: int = PRIORITY_INGEST,
+                        session=None, original_size: int = 0):
+    """Все производные, которые нужно построить для нового файла."""
+    if extension.lower() in IMAGE_EXTENSIONS + VIDEO_EXTENSIONS:
+        # Читает только заголовки и меняет место файла в ленте по дате съёмки — первой
+        enqueue("metadata", {"file_id": file_id}, priority=priority + 1,
+                dedupe_key=f"metadata:{file_id}", session=session)
+    enqueue("thumbnail", {"file_id": file_id}, priority=priority,
+            dedupe_key=f"thumbnail:{file_id}", session=session)
+    if extension.lower() in IMAGE_EXTENSIONS:
+        enqueue("renditions", {"file_id": file_id}, priority=priority - 1,
+                dedupe_key=f"renditions:{file_id}", session=session)
+    if should_segment(extension, original_size):
+        # Самая долгая задача — после всего остального
+        enqueue("hls", {"file_id": file_id}, priority=priority - 5,
+                dedupe_key=f"hls:{file_id}", session=session)
+
+
+def backfill_jobs() -> int:
+    """Ставит в очередь производные для старых записей, у которых их ещё нет."""
+    count = 0
+    missing = [
+        FileEncrypted.thumbnail_path == None,
+        FileEncrypted.encrypted_lqip == None,
+        # Миниатюры изображений, построенные прежней версией (без поворота по EXIF)
+        FileEncrypted.extension.in_(IMAGE_EXTENSIONS) & (FileEncrypted.thumbnail_version < THUMBNAIL_VERSION),
+        FileEncrypted.extension.in_(IMAGE_EXTENSIONS + VIDEO_EXTENSIONS) & (FileEncrypted.encrypted_meta == None),
+        FileEncrypted.extension.in_(IMAGE_EXTENSIONS) & (FileEncrypted.renditions == None),
+    ]
+    if HLS_ENABLED:
+        missing.append(
+            FileEncrypted.extension.in_(VIDEO_EXTENSIONS)
+            & (FileEncrypted.hls_path == None)
+            & (FileEncrypted.original_size >= HLS_MIN_SIZE)
+        )
+    with rx.session() as session:
+        records = session.exec(
+            select(FileEncrypted.id, FileEncrypted.extension, FileEncrypted.original_size).where(or_(*missing))
+        ).all()
+        for file_id, extension, original_size in records:
+            enqueue_ingest_jobs(file_id, extension, priority=PRIORITY_BACKFILL,
+                                session=session, original_size=original_size)
+            count += 1
+        session.commit()
+    return count
+
+
+@job_handler("metadata")
+def metadata_job(payload: dict):
+    file_id = payload["file_id"]
+    record, master_key = _load_for_processing(file_id)
+    if not record:
+        return
+    if record.encrypted_meta:
+        return
+
+    try:
+        metadata = extract_metadata(record.file_path, record.extension, master_key)
+    except (OSError, ValueError) as e:
+        # Битый или нераспознанный файл: повтор не поможет, остаёмся с датой загрузки
+        logger.warning(f"Не удалось извлечь метаданные {file_id}: {e}")
+        metadata = MediaMetadata()
+
+    with rx.session() as session:
+        record = session.get(FileEncrypted, file_id)
+        if record:
+            record.width = metadata.width
+            record.height = metadata.height
+            record.duration = metadata.duration
+            record.codec = metadata.codec
+            if metadata.captured_at:
+                record.captured_at = metadata.captured_at
+            # Пустой JSON тоже шифруется: запись помечает, что метаданные извлечены
+            record.encrypted_meta = encrypt_data(metadata.sensitive_json(), master_key).decode('utf-8')
+            session.add(record)
+            session.commit()
+    logger.info(f"Метаданные для {file_id}: {metadata.width}x{metadata.height} {metadata.codec}")
+
+
+@job_handler("thumbnail")
+def thumbnail_job(payload: dict):
+    file_id = payload["file_id"]
+    record, master_key = _load_for_processing(file_id)
+    if not record:
+        logger.info(f"Файл {file_id} удалён, миниатюра не нужна")
+        return
+    outdated = record.extension.lower() in IMAGE_EXTENSIONS and record.thumbnail_version < THUMBNAIL_VERSION
+    if record.thumbnail_path and Path(record.thumbnail_path).exists() and not outdated:
+        if record.encrypted_lqip:
+            return
+        # Миниатюра построена до появления LQIP — хватит её, оригинал не нужен
+        thumbnail_path, thumbnail_version = record.thumbnail_path, record.thumbnail_version
+        thumbnail_data = read_decrypted(thumbnail_path, master_key)
+    else:
+        thumbnail_path, thumbnail_data = store_thumbnail(record.file_path, record.extension, master_key)
+        thumbnail_version = THUMBNAIL_VERSION
+    lqip = encrypt_data(create_lqip(thumbnail_data), master_key).decode('utf-8')
+
+    with rx.session() as session:
+        record = session.get(FileEncrypted, file_id)
+        if record:
+            record.thumbnail_path = thumbnail_path
+            record.thumbnail_version = thumbnail_version
+            record.encrypted_lqip = lqip
+            session.add(record)
+            session.commit()
+    logger.info(f"Миниатюра для {file_id} готова")
+
+
+@job_handler("renditions")
+def renditions_job(payload: dict):
+    file_id = payload["file_id"]
+    record, master_key = _load_for_processing(file_id)
+    if not record:
+        return
+    if record.renditions:
+        return
+
+    widths = store_renditions(record.file_path, record.extension, master_key)
+
+    with rx.session() as session:
+        record = session.get(FileEncrypted, file_id)
+        if record:
+            record.renditions = json.dumps(widths)
+            session.add(record)
+            session.commit()
+    logger.info(f"Превью для {file_id} готовы: {widths}")
+
+
+@job_handler("hls")
+def hls_job(payload: dict):
+    file_id = payload["file_id"]
+    record, master_key = _load_for_processing(file_id)
+    if not record:
+        return
+    if record.hls_path and Path(record.hls_path).exists():
+        return
+
+    hls_path = store_hls(record.file_path, master_key)
+
+    with rx.session() as session:
+        record = session.get(FileEncrypted, file_id)
+        if record:
+            record.hls_path = hls_path
+            session.add(record)
+            session.commit()
+    logger.info(f"HLS для {file_id} готов")
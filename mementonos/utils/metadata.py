@@ -0,0 +1,154 @@
+import io
+import json
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from PIL import Image
+
+from mementonos.utils.encrypted_file import open_encrypted
+from mementonos.utils.ffmpeg import plaintext_url, run_ffmpeg
+from mementonos.utils.thumbnails import IMAGE_EXTENSIONS, VIDEO_EXTENSIONS
+from mementonos.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Теги EXIF
+EXIF_IFD = 0x8769
+GPS_IFD = 0x8825
+TAG_MAKE = 0x010F
+TAG_MODEL = 0x0110
+TAG_ORIENTATION = 0x0112
+TAG_DATETIME = 0x0132
+TAG_DATETIME_ORIGINAL = 0x9003
+TAG_OFFSET_TIME_ORIGINAL = 0x9011
+
+# Ориентации EXIF, при которых кадр повёрнут на 90° — ширина и высота меняются местами
+ROTATED_ORIENTATIONS = (5, 6, 7, 8)
+
+
+@dataclass
+class MediaMetadata:
+    """
+    Метаданные, извлечённые из оригинала один раз при загрузке.
+    width/height/duration/codec/captured_at хранятся открыто (нужны для сортировки
+    и разметки), sensitive — камера и координаты — только зашифрованными.
+    """
+    width: Optional[int] = None
+    height: Optional[int] = None
+    duration: Optional[float] = None
+    codec: Optional[str] = None
+    captured_at: Optional[datetime] = None
+    sensitive: dict = field(default_factory=dict)
+
+    def sensitive_json(self) -> bytes:
+        return json.dumps(self.sensitive, ensure_ascii=False).encode("utf-8")
+
+
+def _to_utc(moment: datetime) -> datetime:
+    """Время в UTC без tzinfo, как uploaded_at. Время без смещения оставляется как есть."""
+    if moment.tzinfo is None:
+        return moment
+    return moment.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _parse_exif_datetime(value, offset=None) -> Optional[datetime]:
+    """'2024:07:01 18:30:00' и необязательное смещение '+03:00' из OffsetTimeOriginal."""
+    if not isinstance(value, str):
+        return None
+    try:
+        moment = datetime.strptime(value.strip("\x00 "), "%Y:%m:%d %H:%M:%S")
+    except ValueError:
+        return None
+    if isinstance(offset, str):
+        try:
+            sign = -1 if offset.startswith("-") else 1
+            hours, _, minutes = offset.lstrip("+-").partition(":")
+            moment = moment.replace(tzinfo=timezone(sign * timedelta(hours=int(hours), minutes=int(minutes or 0))))
+        except ValueError:
+            pass
+    return _to_utc(moment)
+
+
+def _gps_coordinate(value, ref) -> Optional[float]:
+    """Градусы/минуты/секунды EXIF в десятичные градусы."""
+    try:
+        degrees, minutes, seconds = (float(part) for part in value)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+    coordinate = degrees + minutes / 60 + seconds / 3600
+    return round(-coordinate if ref in ("S", "W") else coordinate, 6)
+
+
+def image_metadata(image_data) -> MediaMetadata:
+    """PIL читает только заголовок: расшифровываются первые чанки, а не весь файл."""
+    with Image.open(image_data) as img:
+        width, height = img.size
+        exif = img.getexif()
+        details = exif.get_ifd(EXIF_IFD)
+        gps = exif.get_ifd(GPS_IFD)
+        metadata = MediaMetadata(codec=(img.format or "").lower() or None)
+
+    if exif.get(TAG_ORIENTATION) in ROTATED_ORIENTATIONS:
+        width, height = height, width
+    metadata.width, metadata.height = width, height
+    metadata.captured_at = (
+        _parse_exif_datetime(details.get(TAG_DATETIME_ORIGINAL), details.get(TAG_OFFSET_TIME_ORIGINAL))
+        or _parse_exif_datetime(exif.get(TAG_DATETIME))
+    )
+
+    camera = " ".join(str(exif.get(tag, "")).strip("\x00 ") for tag in (TAG_MAKE, TAG_MODEL)).strip()
+    if camera:
+        metadata.sensitive["camera"] = camera
+    # GPSLatitudeRef=1, GPSLatitude=2, GPSLongitudeRef=3, GPSLongitude=4
+    latitude, longitude = _gps_coordinate(gps.get(2), gps.get(1)), _gps_coordinate(gps.get(4), gps.get(3))
+    if latitude is not None and longitude is not None:
+        metadata.sensitive["gps"] = [latitude, longitude]
+    return metadata
+
+
+def video_metadata(reader) -> MediaMetadata:
+    """ffprobe по loopback-URL: читает контейнер и заголовки потоков, без декодирования."""
+    with plaintext_url(reader) as url:
+        output = run_ffmpeg([
+            '-select_streams', 'v:0',
+            '-show_entries', 'format=duration:format_tags=creation_time'
+                             ':stream=codec_name,width,height:stream_tags=rotate:stream_side_data=rotation',
+            '-of', 'json',
+            url,
+        ], binary='ffprobe')
+    probe = json.loads(output or b"{}")
+    stream = (probe.get("streams") or [{}])[0]
+    container = probe.get("format") or {}
+
+    metadata = MediaMetadata(codec=stream.get("codec_name"))
+    width, height = stream.get("width"), stream.get("height")
+    rotation = stream.get("tags", {}).get("rotate") or next(
+        (side.get("rotation") for side in stream.get("side_data_list", []) if "rotation" in side), 0
+    )
+    if width and height and abs(int(rotation)) % 180 == 90:
+        width, height = height, width
+    metadata.width, metadata.height = width, height
+
+    try:
+        metadata.duration = round(float(container["duration"]), 3)
+    except (KeyError, TypeError, ValueError):
+        pass
+    creation_time = container.get("tags", {}).get("creation_time")
+    if creation_time:
+        try:
+            metadata.captured_at = _to_utc(datetime.fromisoformat(creation_time.replace("Z", "+00:00")))
+        except ValueError:
+            pass
+    return metadata
+
+
+def extract_metadata(file_path: str, extension: str, master_key: bytes) -> MediaMetadata:
+    """Метаданные оригинала; для неподдерживаемых типов — пустые."""
+    extension = extension.lower()
+    if extension not in IMAGE_EXTENSIONS and extension not in VIDEO_EXTENSIONS:
+        return MediaMetadata()
+    with open_encrypted(file_path, master_key) as reader:
+        if extension in IMAGE_EXTENSIONS:
+            return image_metadata(io.BufferedReader(reader))
+        return video_metadata(reader)
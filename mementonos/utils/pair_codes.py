@@ -0,0 +1,189 @@
+import asyncio
+import base64
+import json
+import os
+import threading
+from typing import Optional
+from dotenv import load_dotenv
+
+from mementonos.utils.cache import CACHE_BACKEND, RedisBackend
+from mementonos.utils.ttl_cache import TTLCache
+from mementonos.utils.logger import get_logger
+
+load_dotenv()
+logger = get_logger(__name__)
+
+PAIR_CODE_TTL = int(os.getenv("PAIR_CODE_TTL", 300))
+# "redis" — код, созданный в одном процессе, находится из любого; "memory" — только в этом
+PAIR_CODE_BACKEND = os.getenv("PAIR_CODE_BACKEND", CACHE_BACKEND)
+
+# Поля кода, которые хранятся как bytes
+BINARY_FIELDS = ("sealed_master_key", "encrypted_master_key", "kdf_salt")
+
+
+def _dump(data: dict) -> str:
+    return json.dumps({
+        key: base64.b64encode(value).decode() if key in BINARY_FIELDS else value
+        for key, value in data.items()
+    })
+
+
+def _load(raw) -> dict:
+    return {
+        key: base64.b64decode(value) if key in BINARY_FIELDS else value
+        for key, value in json.loads(raw).items()
+    }
+
+
+class PairCodeStore:
+    """
+    Коды пар со временем жизни и уведомление создателя о том, что пара создана.
+    Создатель ждёт wait(), присоединившийся вызывает finish() — без опроса БД.
+    Все методы асинхронные и вызываются из event loop процесса: ожидающие — его future.
+    """
+
+    def __init__(self):
+        self._waiters: dict[str, list[asyncio.Future]] = {}
+
+    def _resolve(self, code: str, result: dict):
+        for future in self._waiters.pop(code, []):
+            if not future.done():
+                future.set_result(result)
+
+    async def wait(self, code: str, timeout: float = PAIR_CODE_TTL) -> Optional[dict]:
+        """Результат finish() для кода: {"user_id", "pair_id"}; None — код отменён или истёк."""
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(code, []).append(future)
+        try:
+            await self._subscribe()
+            # finish() мог случиться до подписки
+            result = await self._result(code)
+            if result is None:
+                result = await asyncio.wait_for(future, timeout)
+            return result or None
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            waiters = self._waiters.get(code)
+            if waiters and future in waiters:
+                waiters.remove(future)
+                if not waiters:
+                    del self._waiters[code]
+
+    async def _subscribe(self):
+        pass
+
+
+class MemoryPairCodeStore(PairCodeStore):
+    name = "memory"
+
+    def __init__(self):
+        super().__init__()
+        self._codes: TTLCache[dict] = TTLCache(10_000, PAIR_CODE_TTL)
+        self._results: TTLCache[dict] = TTLCache(10_000, PAIR_CODE_TTL)
+        self._lock = threading.Lock()
+
+    async def create(self, code: str, data: dict) -> bool:
+        with self._lock:
+            if self._codes.get(code) is not None:
+                return False
+            self._codes.set(code, data)
+            return True
+
+    async def get(self, code: str) -> Optional[dict]:
+        return self._codes.get(code)
+
+    async def take(self, code: str) -> Optional[dict]:
+        """Забирает код: второй take того же кода получит None."""
+        with self._lock:
+            data = self._codes.get(code)
+            self._codes.pop(code)
+            return data
+
+    async def discard(self, code: str):
+        if await self.take(code) is not None:
+            await self.finish(code, {})
+
+    async def finish(self, code: str, result: dict):
+        self._results.set(code, result)
+        self._resolve(code, result)
+
+    async def _result(self, code: str) -> Optional[dict]:
+        return self._results.get(code)
+
+
+class RedisPairCodeStore(PairCodeStore):
+    """
+    Коды в Redis, результаты — в ключе и в канале pair:done:<код>. Процесс держит
+    одну подписку на все каналы сразу и будит своих ожидающих.
+    """
+    name = "redis"
+    PREFIX = "pair:"
+
+    def __init__(self, backend: Optional[RedisBackend] = None):
+        super().__init__()
+        self.backend = backend or RedisBackend()
+        self._listener: Optional[asyncio.Task] = None
+        self._ready: Optional[asyncio.Event] = None
+
+    async def create(self, code: str, data: dict) -> bool:
+        client = self.backend.async_client
+        return bool(await client.set(f"{self.PREFIX}code:{code}", _dump(data), ex=PAIR_CODE_TTL, nx=True))
+
+    async def get(self, code: str) -> Optional[dict]:
+        raw = await self.backend.async_client.get(f"{self.PREFIX}code:{code}")
+        return _load(raw) if raw else None
+
+    async def take(self, code: str) -> Optional[dict]:
+        raw = await self.backend.async_client.getdel(f"{self.PREFIX}code:{code}")
+        return _load(raw) if raw else None
+
+    async def discard(self, code: str):
+        if await self.backend.async_client.delete(f"{self.PREFIX}code:{code}"):
+            await self.finish(code, {})
+
+    async def finish(self, code: str, result: dict):
+        raw = json.dumps(result)
+        async with self.backend.async_client.pipeline() as pipe:
+            pipe.set(f"{self.PREFIX}done:{code}", raw, ex=PAIR_CODE_TTL)
+            pipe.publish(f"{self.PREFIX}done:{code}", raw)
+            await pipe.execute()
+
+    async def _result(self, code: str) -> Optional[dict]:
+        raw = await self.backend.async_client.get(f"{self.PREFIX}done:{code}")
+        return json.loads(raw) if raw else None
+
+    async def _subscribe(self):
+        if self._listener is None or self._listener.done():
+            self._ready = asyncio.Event()
+            self._listener = asyncio.create_task(self._listen(self._ready))
+        await self._ready.wait()
+
+    async def _listen(self, ready: asyncio.Event):
+        pubsub = self.backend.async_client.pubsub()
+        try:
+            await pubsub.psubscribe(f"{self.PREFIX}done:*")
+            ready.set()
+            async for message in pubsub.listen():
+                if message["type"] == "pmessage":
+                    code = message["channel"].decode().rsplit(":", 1)[1]
+                    self._resolve(code, json.loads(message["data"]))
+        except Exception as e:
+            # Следующий wait() подпишется заново
+            logger.error(f"Подписка на коды пар оборвалась: {e}")
+        finally:
+            ready.set()
+            await pubsub.aclose()
+
+
+_store: Optional[PairCodeStore] = None
+_store_lock = threading.Lock()
+
+
+def get_pair_codes() -> PairCodeStore:
+    """Хранилище процесса; выбирается PAIR_CODE_BACKEND при первом обращении."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = MemoryPairCodeStore() if PAIR_CODE_BACKEND == "memory" else RedisPairCodeStore()
+        return _store
@@ -0,0 +1,222 @@
+import hashlib
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Hashable, Optional
+from dotenv import load_dotenv
+
+from mementonos.utils.singleflight import SingleFlight
+from mementonos.utils.logger import get_logger
+
+load_dotenv()
+logger = get_logger(__name__)
+
+CACHE_RAM_BYTES = int(os.getenv("CACHE_RAM_BYTES", 128 * 1024 * 1024))
+# Дисковый уровень хранит открытый текст, поэтому по умолчанию выключен
+CACHE_DISK_BYTES = int(os.getenv("CACHE_DISK_BYTES", 0))
+# Одна запись не должна вытеснять весь кэш
+CACHE_MAX_ENTRY_FRACTION = 8
+# Доля RAM под записи, к которым обращались больше одного раза
+CACHE_PROTECTED_FRACTION = 0.8
+
+
+class PlaintextCache:
+    """
+    Кэш расшифрованных данных с бюджетом в байтах.
+
+    Уровень RAM — сегментированный LRU: новые записи попадают в «пробный»
+    сегмент, при повторном обращении переходят в «защищённый». Так один
+    последовательный просмотр видео не вымывает горячие миниатюры.
+    Необязательный дисковый уровень принимает вытесненные из RAM записи
+    и тоже ограничен бюджетом (обычный LRU).
+    Ключи — любые hashable, обычно (путь, mtime, размер, ...), см. open_encrypted().
+    """
+
+    def __init__(self, ram_bytes: int, disk_bytes: int = 0, disk_dir: Optional[Path] = None):
+        self.ram_bytes = ram_bytes
+        self.protected_bytes = int(ram_bytes * CACHE_PROTECTED_FRACTION)
+        self.disk_bytes = disk_bytes if disk_dir else 0
+        self.disk_dir = disk_dir
+        self._probation: OrderedDict[Hashable, bytes] = OrderedDict()
+        self._protected: OrderedDict[Hashable, bytes] = OrderedDict()
+        self._probation_used = 0
+        self._protected_used = 0
+        self._disk: OrderedDict[Hashable, int] = OrderedDict()
+        self._disk_used = 0
+        self._lock = threading.Lock()
+        self._flight = SingleFlight()
+        self.counters = {"ram_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+        if self.disk_bytes:
+            self.disk_dir.mkdir(parents=True, exist_ok=True, mode=0o700)
+            # Записи не переживают перезапуск: индекс только в памяти
+            for p in self.disk_dir.iterdir():
+                p.unlink(missing_ok=True)
+
+    def _disk_path(self, key: Hashable) -> Path:
+        return self.disk_dir / hashlib.sha256(repr(key).encode()).hexdigest()
+
+    def _evict_ram(self) -> list:
+        """Вытесняет из RAM сверх бюджета. Вызывается под блокировкой."""
+        # Защищённый сегмент сверх своей доли возвращается в пробный
+        while self._protected_used > self.protected_bytes and self._protected:
+            key, data = self._protected.popitem(last=False)
+            self._protected_used -= len(data)
+            self._probation[key] = data
+            self._probation_used += len(data)
+
+        demoted = []
+        while self._probation_used + self._protected_used > self.ram_bytes:
+            segment = self._probation if self._probation else self._protected
+            key, data = segment.popitem(last=False)
+            if segment is self._probation:
+                self._probation_used -= len(data)
+            else:
+                self._protected_used -= len(data)
+            self.counters["evictions"] += 1
+            demoted.append((key, data))
+        return demoted
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        demoted = []
+        with self._lock:
+            data = self._protected.get(key)
+            if data is not None:
+                self._protected.move_to_end(key)
+                self.counters["ram_hits"] += 1
+                return data
+            data = self._probation.pop(key, None)
+            if data is not None:
+                # Второе обращение — запись «горячая»
+                self._probation_used -= len(data)
+                self._protected[key] = data
+                self._protected_used += len(data)
+                demoted = self._evict_ram()
+                self.counters["ram_hits"] += 1
+            on_disk = data is None and key in self._disk
+            if on_disk:
+                self._disk.move_to_end(key)
+
+        if data is not None:
+            self._put_disk_many(demoted)
+            return data
+
+        if on_disk:
+            try:
+                data = self._disk_path(key).read_bytes()
+            except FileNotFoundError:
+                data = None
+            if data is not None:
+                with self._lock:
+                    self.counters["disk_hits"] += 1
+                self.put(key, data)
+                return data
+
+        with self._lock:
+            self.counters["misses"] += 1
+        return None
+
+    def put(self, key: Hashable, data: bytes):
+        if len(data) > self.ram_bytes // CACHE_MAX_ENTRY_FRACTION:
+            self._put_disk(key, data)
+            return
+        with self._lock:
+            if key in self._protected:
+                self._protected_used -= len(self._protected.pop(key))
+            if key in self._probation:
+                self._probation_used -= len(self._probation.pop(key))
+            self._probation[key] = data
+            self._probation_used += len(data)
+            demoted = self._evict_ram()
+        self._put_disk_many(demoted)
+
+    def get_or_compute(self, key: Hashable, fn) -> bytes:
+        """
+        get() с заполнением при промахе. Параллельные промахи по одному ключу
+        ждут одно вычисление fn вместо того, чтобы расшифровывать одно и то же.
+        """
+        data = self.get(key)
+        if data is not None:
+            return data
+
+        def load() -> bytes:
+            data = fn()
+            self.put(key, data)
+            return data
+
+        return self._flight.do(key, load)
+
+    def _put_disk_many(self, items: list):
+        for key, data in items:
+            self._put_disk(key, data)
+
+    def _put_disk(self, key: Hashable, data: bytes):
+        if not self.disk_bytes or len(data) > self.disk_bytes // CACHE_MAX_ENTRY_FRACTION:
+            return
+        path = self._disk_path(key)
+        tmp_path = path.with_name(f"{path.name}.writing.{os.urandom(4).hex()}")
+        tmp_path.write_bytes(data)
+        tmp_path.replace(path)
+
+        evicted = []
+        with self._lock:
+            self._disk_used -= self._disk.pop(key, 0)
+            self._disk[key] = len(data)
+            self._disk_used += len(data)
+            while self._disk_used > self.disk_bytes and self._disk:
+                old_key, old_size = self._disk.popitem(last=False)
+                self._disk_used -= old_size
+                evicted.append(old_key)
+        for old_key in evicted:
+            self._disk_path(old_key).unlink(missing_ok=True)
+
+    def invalidate(self, predicate):
+        """Удаляет все записи, для ключей которых predicate(key) истинно."""
+        with self._lock:
+            for key in [k for k in self._probation if predicate(k)]:
+                self._probation_used -= len(self._probation.pop(key))
+            for key in [k for k in self._protected if predicate(k)]:
+                self._protected_used -= len(self._protected.pop(key))
+            disk_keys = [k for k in self._disk if predicate(k)]
+            for key in disk_keys:
+                self._disk_used -= self._disk.pop(key)
+        for key in disk_keys:
+            self._disk_path(key).unlink(missing_ok=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self.counters,
+                "ram_entries": len(self._probation) + len(self._protected),
+                "ram_bytes": self._probation_used + self._protected_used,
+                "ram_budget": self.ram_bytes,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_used,
+                "disk_budget": self.disk_bytes,
+                "coalesced": self._flight.counters["shared"],
+            }
+
+
+_cache: Optional[PlaintextCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_plaintext_cache() -> PlaintextCache:
+    """Кэш процесса; создаётся при первом обращении."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            tmp_dir = Path(os.getenv("DATA_DIR")) / "tmp"
+            # Остатки старой схемы: dec_<id> файлы, которые раньше чистил отдельный cleanup_service
+            if tmp_dir.exists():
+                for p in tmp_dir.glob("dec_*"):
+                    p.unlink(missing_ok=True)
+                # и открытые HLS-сегменты, которые раньше ffmpeg писал во временный каталог
+                for p in tmp_dir.glob("hls_*"):
+                    shutil.rmtree(p, ignore_errors=True)
+            _cache = PlaintextCache(CACHE_RAM_BYTES, CACHE_DISK_BYTES, tmp_dir / "cache")
+            logger.info(f"Кэш открытого текста: RAM {CACHE_RAM_BYTES} Б, диск {CACHE_DISK_BYTES} Б")
+        return _cache
+
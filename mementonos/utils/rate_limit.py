@@ -0,0 +1,205 @@
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+from dotenv import load_dotenv
+
+from mementonos.utils.cache import CACHE_BACKEND, RedisBackend
+from mementonos.utils.ttl_cache import TTLCache
+from mementonos.utils.logger import get_logger
+
+load_dotenv()
+logger = get_logger(__name__)
+
+# "redis" — лимиты общие для всех процессов; "memory" — у каждого процесса свои
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", CACHE_BACKEND)
+# Сколько ключей помнит memory-бэкенд: при переборе адресов память не растёт,
+# вытесняются самые давние ключи
+RATE_LIMIT_MEMORY_KEYS = int(os.getenv("RATE_LIMIT_MEMORY_KEYS", 100_000))
+
+
+@dataclass(frozen=True)
+class RatePolicy:
+    """Не больше limit запросов за window секунд, равномерно восстанавливаясь."""
+    limit: int
+    window: float
+
+    @property
+    def interval(self) -> float:
+        return self.window / self.limit
+
+    @classmethod
+    def parse(cls, value: str) -> "RatePolicy":
+        """'10/300' → 10 запросов за 300 секунд"""
+        limit, _, window = value.partition("/")
+        return cls(int(limit), float(window))
+
+
+def _policy(name: str, default: str) -> RatePolicy:
+    # Переопределяется переменной RATE_LIMIT_<ИМЯ>, например RATE_LIMIT_LOGIN=20/300
+    return RatePolicy.parse(os.getenv(f"RATE_LIMIT_{name.upper()}", default))
+
+
+RATE_POLICIES: dict[str, RatePolicy] = {
+    # AuthState, по IP
+    "login": _policy("login", "10/300"),
+    "pairing": _policy("pairing", "3/300"),
+    # /api/media/..., по пользователю. Оригинал — самый дорогой: расшифровка всего файла
+    "media_file": _policy("media_file", "300/60"),
+    "media": _policy("media", "1200/60"),
+    "sprite": _policy("sprite", "120/60"),
+}
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__(f"Слишком много запросов, повторите через {retry_after:.0f} с")
+        self.retry_after = retry_after
+
+
+def gcra(tat: Optional[float], now: float, policy: RatePolicy) -> tuple[Optional[float], float]:
+    """
+    GCRA (token bucket с одним числом на ключ): tat — момент, когда ведро снова опустеет.
+    Возвращает (новый tat, 0) или (None, через сколько секунд можно повторить).
+    """
+    new_tat = max(tat or now, now) + policy.interval
+    if new_tat - now > policy.window:
+        return None, new_tat - now - policy.window
+    return new_tat, 0.0
+
+
+class MemoryRateStore:
+    """Состояние лимитов в памяти процесса: не больше RATE_LIMIT_MEMORY_KEYS ключей."""
+    name = "memory"
+
+    def __init__(self, maxsize: int = RATE_LIMIT_MEMORY_KEYS):
+        window = max(policy.window for policy in RATE_POLICIES.values())
+        self._tats: TTLCache[float] = TTLCache(maxsize, window)
+        self._lock = threading.Lock()
+
+    def hit(self, key: str, policy: RatePolicy) -> float:
+        with self._lock:
+            now = time.monotonic()
+            new_tat, retry_after = gcra(self._tats.get(key), now, policy)
+            if new_tat is not None:
+                # Запись не нужна после того, как ведро опустеет
+                self._tats.set(key, new_tat, ttl=new_tat - now)
+            return retry_after
+
+    async def ahit(self, key: str, policy: RatePolicy) -> float:
+        return self.hit(key, policy)
+
+    def stats(self) -> dict:
+        return self._tats.stats()
+
+
+# Тот же GCRA, атомарно на стороне Redis и по его часам — процессам не нужно сверять время.
+# Ответ строкой: числа Lua Redis обрезает до целых
+GCRA_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local interval = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local tat = math.max(tonumber(redis.call('GET', KEYS[1]) or now), now)
+local new_tat = tat + interval
+if new_tat - now > window then
+    return tostring(new_tat - now - window)
+end
+redis.call('SET', KEYS[1], tostring(new_tat), 'PX', math.ceil((new_tat - now) * 1000))
+return '0'
+"""
+
+
+class RedisRateStore:
+    """Лимиты в Redis: общие для всех процессов, ключи истекают сами."""
+    name = "redis"
+
+    def __init__(self, backend: Optional[RedisBackend] = None):
+        self.backend = backend or RedisBackend()
+        self._script = None
+        self._async_script = None
+
+    def hit(self, key: str, policy: RatePolicy) -> float:
+        if self._script is None:
+            self._script = self.backend.client.register_script(GCRA_SCRIPT)
+        return float(self._script(keys=[f"rate:{key}"], args=[policy.interval, policy.window]))
+
+    async def ahit(self, key: str, policy: RatePolicy) -> float:
+        if self._async_script is None:
+            self._async_script = self.backend.async_client.register_script(GCRA_SCRIPT)
+        return float(await self._async_script(keys=[f"rate:{key}"], args=[policy.interval, policy.window]))
+
+    def stats(self) -> dict:
+        return {}
+
+
+class RateLimiter:
+    """
+    Проверка лимитов по именованным политикам RATE_POLICIES.
+    Если хранилище недоступно, запрос пропускается: упавший Redis не должен закрывать вход.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._lock = threading.Lock()
+        self.counters = {"allowed": 0, "limited": 0, "errors": 0}
+
+    def _count(self, counter: str):
+        with self._lock:
+            self.counters[counter] += 1
+
+    def _result(self, retry_after: float):
+        if retry_after > 0:
+            self._count("limited")
+            raise RateLimited(retry_after)
+        self._count("allowed")
+
+    def check(self, policy: str, key: str):
+        """Засчитывает запрос; сверх лимита бросает RateLimited."""
+        try:
+            retry_after = self.store.hit(f"{policy}:{key}", RATE_POLICIES[policy])
+        except Exception as e:
+            self._count("errors")
+            logger.warning(f"Лимит {policy} не проверен: {e}")
+            return
+        self._result(retry_after)
+
+    async def acheck(self, policy: str, key: str):
+        try:
+            retry_after = await self.store.ahit(f"{policy}:{key}", RATE_POLICIES[policy])
+        except Exception as e:
+            self._count("errors")
+            logger.warning(f"Лимит {policy} не проверен: {e}")
+            return
+        self._result(retry_after)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"backend": self.store.name, **self.counters, **self.store.stats()}
+
+
+_limiter: Optional[RateLimiter] = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Лимитер процесса; хранилище выбирается RATE_LIMIT_BACKEND при первом обращении."""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            store = MemoryRateStore() if RATE_LIMIT_BACKEND == "memory" else RedisRateStore()
+            _limiter = RateLimiter(store)
+        return _limiter
+
+
+def check_rate_limit(policy: str, key: str):
+    get_rate_limiter().check(policy, key)
+
+
+async def check_rate_limit_async(policy: str, key: str):
+    await get_rate_limiter().acheck(policy, key)
+
+
+def rate_limit_stats() -> dict:
+    return get_rate_limiter().stats()
@@ -7,8 +7,7 @@ from datetime import datetime, timedelta, timezone
 from typing import Optional
 from cryptography.fernet import Fernet, InvalidToken
 from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
-from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 
 from mementonos.utils.logger import get_logger
 
@@ -18,6 +17,10 @@ load_dotenv()
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 14
+# Число итераций PBKDF2 для новых и перешифрованных мастер-ключей. У каждого пользователя
+# своё (User.kdf_iterations): старые ключи с LEGACY_KDF_ITERATIONS перешифровываются при разблокировке
+KDF_ITERATIONS = int(os.getenv("KDF_ITERATIONS", 210_000))
+LEGACY_KDF_ITERATIONS = 10_000
 
 def hash_password(password: str) -> str:
     return hashlib.sha256(password.encode()).hexdigest()
@@ -32,11 +35,12 @@ def create_jwt(user_id: int, pair_id: Optional[int] = None) -> str:
 
 def decode_jwt(token: str) -> dict:
     if not token:
-        logger.info("decode_jwt: token is empty")
+        logger.debug("decode_jwt: token is empty")
         return {}
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        logger.info("decode_jwt SUCCESS: payload = %s", payload)
+        # Содержимое токена в лог не пишем: decode_jwt вызывается на каждый запрос к API
+        logger.debug("decode_jwt: ok for sub=%s", payload.get("sub"))
         return payload
     except jwt.ExpiredSignatureError:
         logger.warning("decode_jwt: ExpiredSignatureError")
@@ -48,28 +52,27 @@ def decode_jwt(token: str) -> dict:
         logger.warning("decode_jwt: InvalidTokenError %s", str(e))
         return {}
     except Exception as e:
-        logger.warning("decode_jwt: UNEXPECTED ERROR %s", type(e).__name__, str(e))
+        logger.warning("decode_jwt: UNEXPECTED ERROR %s: %s", type(e).__name__, str(e))
         return {}
 
-def derive_fernet_key(password: str, salt: bytes, iterations: int = 10_000) -> bytes:
-    """PBKDF2 → 32 байта → base64 для Fernet"""
-    kdf = PBKDF2HMAC(
-        algorithm=hashes.SHA512(),
-        length=32,
-        salt=salt,
-        iterations=iterations,
-        backend=default_backend()
-    )
-    key = base64.urlsafe_b64encode(kdf.derive(password.encode("utf-8")))
-    return key
+def derive_fernet_key(password: str, salt: bytes, iterations: int = LEGACY_KDF_ITERATIONS) -> bytes:
+    """
+    PBKDF2-SHA512 → 32 байта → base64 для Fernet.
+    hashlib, а не cryptography: результат тот же, но hashlib отпускает GIL на время
+    вычисления, и пул потоков (utils/kdf.py) не останавливает event loop.
+    """
+    key = hashlib.pbkdf2_hmac("sha512", password.encode("utf-8"), salt, iterations, dklen=32)
+    return base64.urlsafe_b64encode(key)
 
-def encrypt_master_key(master_key: bytes, password: str, salt: bytes) -> bytes:
-    fernet_key = derive_fernet_key(password, salt)
+def encrypt_master_key(master_key: bytes, password: str, salt: bytes,
+                       iterations: int = LEGACY_KDF_ITERATIONS) -> bytes:
+    fernet_key = derive_fernet_key(password, salt, iterations)
     f = Fernet(fernet_key)
     return f.encrypt(master_key)
 
-def decrypt_master_key(encrypted: bytes, password: str, salt: bytes) -> bytes:
-    fernet_key = derive_fernet_key(password, salt)
+def decrypt_master_key(encrypted: bytes, password: str, salt: bytes,
+                       iterations: int = LEGACY_KDF_ITERATIONS) -> bytes:
+    fernet_key = derive_fernet_key(password, salt, iterations)
     f = Fernet(fernet_key)
     try:
         return f.decrypt(encrypted)
@@ -85,4 +88,24 @@ def encrypt_data(data: bytes, master_key: bytes) -> bytes:
 def decrypt_data(encrypted_data: bytes, master_key: bytes) -> bytes:
     master_key = base64.urlsafe_b64encode(master_key)
     f = Fernet(master_key)
-    return f.decrypt(encrypted_data)
\ No newline at end of file
+    return f.decrypt(encrypted_data)
+
+def _pair_code_fernet(code: str) -> Fernet:
+    key = HKDF(
+        algorithm=hashes.SHA256(), length=32, salt=code.encode("utf-8"), info=b"mementonos pair code",
+    ).derive(SECRET_KEY.encode("utf-8"))
+    return Fernet(base64.urlsafe_b64encode(key))
+
+def seal_for_pair_code(data: bytes, code: str) -> bytes:
+    """
+    Шифрует ключом из SECRET_KEY и кода пары — для общего хранилища кодов:
+    по содержимому Redis без SECRET_KEY мастер-ключ не восстановить.
+    """
+    return _pair_code_fernet(code).encrypt(data)
+
+def open_for_pair_code(sealed: bytes, code: str) -> Optional[bytes]:
+    try:
+        return _pair_code_fernet(code).decrypt(sealed)
+    except InvalidToken:
+        logger.warning("Pair code key does not match: SECRET_KEY differs between processes?")
+        return None
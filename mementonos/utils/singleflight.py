@@ -0,0 +1,134 @@
+import asyncio
+import os
+import threading
+import time
+from typing import Callable, Hashable, TypeVar
+from dotenv import load_dotenv
+
+from mementonos.utils.logger import get_logger
+
+load_dotenv()
+logger = get_logger(__name__)
+
+# Сколько секунд повторные запросы получают ту же ошибку, не пересчитывая
+SINGLEFLIGHT_ERROR_TTL = float(os.getenv("SINGLEFLIGHT_ERROR_TTL", 5))
+
+T = TypeVar("T")
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: BaseException | None = None
+
+
+class SingleFlight:
+    """
+    Объединение одинаковых параллельных вычислений.
+
+    Первый запрос по ключу выполняет fn, остальные ждут его результата.
+    Ошибка запоминается на error_ttl секунд, чтобы битый файл не расшифровывали
+    заново на каждый запрос. Успешный результат не хранится — для этого есть кэш.
+    """
+
+    def __init__(self, error_ttl: float = SINGLEFLIGHT_ERROR_TTL):
+        self.error_ttl = error_ttl
+        self._lock = threading.Lock()
+        self._calls: dict[Hashable, _Call] = {}
+        self._async_calls: dict[Hashable, asyncio.Future] = {}
+        self._errors: dict[Hashable, tuple[float, BaseException]] = {}
+        self.counters = {"leaders": 0, "shared": 0, "negative_hits": 0}
+
+    def _recent_error(self, key: Hashable) -> BaseException | None:
+        """Вызывается под блокировкой."""
+        entry = self._errors.get(key)
+        if entry is None:
+            return None
+        expires, error = entry
+        if expires < time.monotonic():
+            del self._errors[key]
+            return None
+        self.counters["negative_hits"] += 1
+        return error
+
+    def _remember_error(self, key: Hashable, error: BaseException):
+        with self._lock:
+            if self.error_ttl > 0:
+                self._errors[key] = (time.monotonic() + self.error_ttl, error)
+            # Заодно выбрасываем просроченные записи, чтобы словарь не рос
+            now = time.monotonic()
+            for stale in [k for k, (expires, _) in self._errors.items() if expires < now]:
+                del self._errors[stale]
+
+    def forget(self, key: Hashable):
+        """Сбрасывает запомненную ошибку, например после пересоздания файла."""
+        with self._lock:
+            self._errors.pop(key, None)
+
+    def do(self, key: Hashable, fn: Callable[[], T]) -> T:
+        """Синхронный вариант для потоков (потоковая отдача, воркеры)."""
+        with self._lock:
+            error = self._recent_error(key)
+            if error is not None:
+                raise error
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.counters["leaders"] += 1
+            else:
+                self.counters["shared"] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            self._remember_error(key, e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    async def do_async(self, key: Hashable, fn: Callable[[], T], executor=None) -> T:
+        """
+        Вариант для обработчиков FastAPI: блокирующая fn выполняется в пуле потоков
+        (executor — MeteredExecutor, по умолчанию пул loop), ожидающие запросы
+        не занимают ни поток, ни event loop.
+        """
+        with self._lock:
+            error = self._recent_error(key)
+            if error is not None:
+                raise error
+            future = self._async_calls.get(key)
+            if future is None:
+                if executor is not None:
+                    future = executor.submit(fn)
+                else:
+                    future = asyncio.get_running_loop().run_in_executor(None, fn)
+                self._async_calls[key] = future
+                future.add_done_callback(lambda f: self._finish_async(key, f))
+                self.counters["leaders"] += 1
+            else:
+                self.counters["shared"] += 1
+
+        # shield: отключение любого клиента, включая первого, не отменяет общее вычисление
+        return await asyncio.shield(future)
+
+    def _finish_async(self, key: Hashable, future: asyncio.Future):
+        with self._lock:
+            self._async_calls.pop(key, None)
+        if not future.cancelled() and future.exception() is not None:
+            self._remember_error(key, future.exception())
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self.counters, "in_flight": len(self._calls) + len(self._async_calls)}
@@ -1,16 +1,39 @@
-from PIL import Image
+from PIL import Image, ImageOps
 import io
-import tempfile
-import subprocess
 import os
+from pathlib import Path
+from functools import lru_cache
+from typing import BinaryIO, Optional
 
 from mementonos.utils.security import get_logger
+from mementonos.utils.encrypted_file import open_encrypted, encrypt_to_file
+from mementonos.utils.ffmpeg import plaintext_url, run_ffmpeg, FFmpegCancelled
 
 logger = get_logger(__name__)
 
-def create_image_thumbnail(image_data: bytes, size=(180, 180)) -> bytes:
-    """Создаёт миниатюру из изображения."""
-    with Image.open(io.BytesIO(image_data)) as img:
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp')
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi', '.mkv')
+# Уровни пирамиды превью: максимальная сторона в пикселях
+RENDITION_SIZES = (180, 480, 1080, 2048)
+# Спрайт миниатюр порции ленты: сетка ячеек SPRITE_CELL×SPRITE_CELL по SPRITE_COLUMNS в ряд
+SPRITE_CELL = 180
+SPRITE_COLUMNS = 6
+# Цвет полей вокруг неквадратных миниатюр — как фон плитки ленты
+SPRITE_BACKGROUND = (128, 128, 128)
+# Сторона LQIP — размытого превью, которое приходит вместе с состоянием ленты
+LQIP_SIZE = 16
+# Версия миниатюр изображений: 2 — с поворотом по EXIF. Более старые перестраивает backfill
+THUMBNAIL_VERSION = 2
+
+def create_image_thumbnail(image_data: bytes | BinaryIO, size=(180, 180)) -> bytes:
+    """Создаёт миниатюру из изображения (байты или файловый объект с seek)."""
+    if isinstance(image_data, (bytes, bytearray)):
+        image_data = io.BytesIO(image_data)
+    with Image.open(image_data) as img:
+        img.draft('RGB', size)
+        # Как в create_renditions: снимки с телефона иначе лягут набок. В JPEG миниатюры
+        # EXIF не пишется, так что LQIP и спрайт из неё уже получают повёрнутый кадр
+        img = ImageOps.exif_transpose(img)
         img.thumbnail(size, Image.Resampling.LANCZOS)
         # Конвертируем в RGB для JPEG
         if img.mode in ('RGBA', 'LA', 'P'):
@@ -22,50 +45,146 @@ def create_image_thumbnail(image_data: bytes, size=(180, 180)) -> bytes:
         img.save(output, format='JPEG', quality=85)
         return output.getvalue()
     
-def create_video_thumbnail(video_data: bytes, extension: str, size=(180, 180)) -> bytes:
-    """Извлекает первый кадр видео."""
-    with tempfile.NamedTemporaryFile(suffix=extension, delete=False) as tmp_video:
-        tmp_video.write(video_data)
-        tmp_video_path = tmp_video.name
-    
+def create_video_thumbnail(reader, size=(180, 180), cancel=None) -> bytes:
+    """
+    Извлекает кадр видео. ffmpeg читает расшифрованный поток по loopback-URL
+    и делает seek по ключевым кадрам на входе (-ss до -i), без временных файлов.
+    """
+    scale = f'scale={size[0]}:{size[1]}:force_original_aspect_ratio=decrease,pad={size[0]}:{size[1]}:(ow-iw)/2:(oh-ih)/2'
     try:
-        with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as tmp_thumb:
-            tmp_thumb_path = tmp_thumb.name
-        
-        cmd = [
-            'ffmpeg', '-i', tmp_video_path,
-            '-ss', '00:00:01',
-            '-vframes', '1',
-            '-vf', f'scale={size[0]}:{size[1]}:force_original_aspect_ratio=decrease,pad={size[0]}:{size[1]}:(ow-iw)/2:(oh-ih)/2',
-            '-y', tmp_thumb_path
-        ]
-        result = subprocess.run(cmd, capture_output=True)
-        
-        if result.returncode != 0:
-            logger.error(f"FFmpeg error: {result.stderr.decode()}")
-            return create_placeholder_thumbnail()
-        
-        with open(tmp_thumb_path, 'rb') as f:
-            thumbnail_data = f.read()
-        
-        return thumbnail_data
-    
+        with plaintext_url(reader) as url:
+            # Первая секунда обычно информативнее первого кадра; для коротких видео — кадр 0
+            for position in ('1', '0'):
+                thumbnail_data = run_ffmpeg([
+                    '-ss', position, '-i', url,
+                    '-frames:v', '1',
+                    '-vf', scale,
+                    '-f', 'image2', '-c:v', 'mjpeg', '-q:v', '3',
+                    'pipe:1',
+                ], cancel=cancel)
+                if thumbnail_data:
+                    return thumbnail_data
+    except FFmpegCancelled:
+        raise
     except Exception as e:
         logger.error(f"Ошибка создания миниатюры видео: {e}")
-        return create_placeholder_thumbnail()
-    
-    finally:
-        try:
-            if tmp_video_path:
-                os.unlink(tmp_video_path)
-            if tmp_thumb_path:
-                os.unlink(tmp_thumb_path)
-        except:
-            pass
+    return create_placeholder_thumbnail()
 
+@lru_cache(maxsize=1)
 def create_placeholder_thumbnail() -> bytes:
-    """Создаёт заглушку."""
+    """Создаёт заглушку. Она всегда одинаковая, поэтому рисуется один раз."""
     img = Image.new('RGB', (180, 180), color=(73, 109, 137))
     output = io.BytesIO()
     img.save(output, format='JPEG')
-    return output.getvalue()
\ No newline at end of file
+    return output.getvalue()
+
+def thumbnail_path_for(file_path: str) -> Path:
+    """Миниатюра хранится рядом с оригиналом: <имя>.thumb.enc"""
+    path = Path(file_path)
+    return path.with_name(f"{path.stem}.thumb.enc")
+
+def build_thumbnail(file_path: str, extension: str, master_key: bytes) -> bytes:
+    """Строит миниатюру, расшифровывая оригинал потоково."""
+    extension = extension.lower()
+    with open_encrypted(file_path, master_key) as reader:
+        if extension in IMAGE_EXTENSIONS:
+            # PIL читает через seek/read только нужные чанки
+            return create_image_thumbnail(io.BufferedReader(reader))
+        if extension in VIDEO_EXTENSIONS:
+            return create_video_thumbnail(reader)
+    return create_placeholder_thumbnail()
+
+def _store_encrypted(path: Path, data: bytes, master_key: bytes):
+    """Атомарно пишет зашифрованные производные рядом с оригиналом."""
+    tmp_path = path.with_name(f"{path.name}.writing.{os.urandom(4).hex()}")
+    try:
+        encrypt_to_file(tmp_path, data, master_key)
+        tmp_path.replace(path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+def store_thumbnail(file_path: str, extension: str, master_key: bytes) -> tuple[str, bytes]:
+    """Создаёт миниатюру и сохраняет её зашифрованной рядом с оригиналом. Возвращает путь и JPEG."""
+    thumbnail_data = build_thumbnail(file_path, extension, master_key)
+    thumb_path = thumbnail_path_for(file_path)
+    _store_encrypted(thumb_path, thumbnail_data, master_key)
+    return str(thumb_path), thumbnail_data
+
+def create_lqip(thumbnail_data: bytes, size: int = LQIP_SIZE) -> bytes:
+    """
+    Микро-превью из готовой миниатюры, около сотни байт.
+    WebP, а не JPEG: у JPEG такого размера почти всё занимают таблицы заголовка (~300 байт).
+    """
+    with Image.open(io.BytesIO(thumbnail_data)) as img:
+        img = ImageOps.exif_transpose(img).convert('RGB')
+        img.thumbnail((size, size), Image.Resampling.BILINEAR)
+        output = io.BytesIO()
+        img.save(output, format='WEBP', quality=40)
+        return output.getvalue()
+
+def sprite_position(index: int) -> tuple[int, int]:
+    """Левый верхний угол ячейки index в спрайте."""
+    return (index % SPRITE_COLUMNS) * SPRITE_CELL, (index // SPRITE_COLUMNS) * SPRITE_CELL
+
+def build_sprite(thumbnails: list[Optional[bytes]]) -> bytes:
+    """
+    Склеивает миниатюры в один JPEG. Каждая — по центру своей ячейки,
+    None — заглушка. Положение ячейки зависит только от индекса, см. sprite_position.
+    """
+    rows = (len(thumbnails) + SPRITE_COLUMNS - 1) // SPRITE_COLUMNS
+    columns = min(len(thumbnails), SPRITE_COLUMNS)
+    sprite = Image.new('RGB', (columns * SPRITE_CELL, rows * SPRITE_CELL), SPRITE_BACKGROUND)
+    for index, data in enumerate(thumbnails):
+        with Image.open(io.BytesIO(data or create_placeholder_thumbnail())) as img:
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((SPRITE_CELL, SPRITE_CELL))
+            x, y = sprite_position(index)
+            sprite.paste(img.convert('RGB'), (x + (SPRITE_CELL - img.width) // 2, y + (SPRITE_CELL - img.height) // 2))
+    output = io.BytesIO()
+    sprite.save(output, format='JPEG', quality=85)
+    return output.getvalue()
+
+def rendition_path_for(file_path: str, size: int) -> Path:
+    """Превью уровня size хранится рядом с оригиналом: <имя>.r<size>.enc"""
+    path = Path(file_path)
+    return path.with_name(f"{path.stem}.r{size}.enc")
+
+def create_renditions(image_data: BinaryIO, sizes=RENDITION_SIZES) -> dict[int, tuple[int, bytes]]:
+    """
+    Строит пирамиду превью: {уровень: (реальная ширина, JPEG)}.
+    Уровни крупнее оригинала не создаются — последний уровень равен оригиналу.
+    """
+    with Image.open(image_data) as img:
+        levels = []
+        for size in sorted(sizes):
+            levels.append(size)
+            if size >= max(img.size):
+                break
+
+        img.draft('RGB', (levels[-1], levels[-1]))
+        img = ImageOps.exif_transpose(img)
+        if img.mode != 'RGB':
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            background.paste(img, mask=img.getchannel('A') if 'A' in img.getbands() else None)
+            img = background
+
+        renditions = {}
+        # От большего к меньшему: каждый уровень уменьшается из предыдущего
+        for size in reversed(levels):
+            img.thumbnail((size, size), Image.Resampling.LANCZOS)
+            output = io.BytesIO()
+            img.save(output, format='JPEG', quality=82, optimize=True, progressive=size >= 1080)
+            renditions[size] = (img.width, output.getvalue())
+        return renditions
+
+def store_renditions(file_path: str, extension: str, master_key: bytes) -> dict[str, int]:
+    """Строит и сохраняет пирамиду превью изображения. Возвращает {уровень: ширина}."""
+    if extension.lower() not in IMAGE_EXTENSIONS:
+        return {}
+    with open_encrypted(file_path, master_key) as reader:
+        renditions = create_renditions(io.BufferedReader(reader))
+    widths = {}
+    for size, (width, data) in renditions.items():
+        _store_encrypted(rendition_path_for(file_path, size), data, master_key)
+        widths[str(size)] = width
+    return widths
\ No newline at end of file
@@ -0,0 +1,50 @@
+import os
+import time
+import reflex as rx
+from datetime import datetime, timedelta
+from pathlib import Path
+from dotenv import load_dotenv
+from sqlmodel import select
+
+from mementonos.models import UploadSession
+from mementonos.utils.logger import get_logger
+
+load_dotenv()
+logger = get_logger(__name__)
+
+# Загрузка без PATCH дольше этого считается брошенной и удаляется воркером
+UPLOAD_SESSION_TTL = float(os.getenv("UPLOAD_SESSION_TTL", 24 * 3600))
+
+
+def parts_dir() -> Path:
+    path = Path(os.getenv("DATA_DIR")) / "tmp" / "uploads"
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def part_path_for(upload_id: str) -> Path:
+    """Недописанный контейнер загрузки: DATA_DIR/tmp/uploads/<id>.part"""
+    return parts_dir() / f"{upload_id}.part"
+
+
+def collect_abandoned_uploads() -> int:
+    """
+    Удаляет брошенные загрузки: записи UploadSession без PATCH дольше UPLOAD_SESSION_TTL
+    и их .part файлы, а также .part без записи (процесс упал между созданием файла и записи).
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=UPLOAD_SESSION_TTL)
+    count = 0
+    with rx.session() as session:
+        for upload in session.exec(select(UploadSession).where(UploadSession.updated_at < cutoff)).all():
+            Path(upload.part_path).unlink(missing_ok=True)
+            session.delete(upload)
+            count += 1
+        session.commit()
+        known = set(session.exec(select(UploadSession.id)).all())
+
+    mtime_cutoff = time.time() - UPLOAD_SESSION_TTL
+    for part in parts_dir().glob("*.part"):
+        if part.stem not in known and part.stat().st_mtime < mtime_cutoff:
+            part.unlink(missing_ok=True)
+            count += 1
+    return count
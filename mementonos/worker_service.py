@@ -0,0 +1,120 @@
+import os
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from dotenv import load_dotenv
+
+from mementonos.utils.jobs import (
+    claim_job, complete_job, fail_job, defer_job, renew_leases, recover_stale_jobs, prune_failed_jobs,
+    queue_stats, run_job, RetryLater,
+)
+from mementonos.utils.media_jobs import backfill_jobs
+from mementonos.utils.upload_sessions import collect_abandoned_uploads
+from mementonos.utils.ffmpeg import FFMPEG_MAX_PROCS, use_shared_slots
+from mementonos.utils.logger import get_logger
+
+load_dotenv()
+logger = get_logger(__name__)
+
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", os.cpu_count() or 2))
+POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 1))
+LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", 60))
+STATS_INTERVAL = 60
+UPLOAD_GC_INTERVAL = float(os.getenv("UPLOAD_GC_INTERVAL", 3600))
+FAILED_PRUNE_INTERVAL = 3600
+
+
+def _new_pool(context) -> ProcessPoolExecutor:
+    # Свой семафор у каждого пула: слот, который держал упавший процесс, не пропадёт навсегда
+    ffmpeg_slots = context.BoundedSemaphore(FFMPEG_MAX_PROCS)
+    return ProcessPoolExecutor(
+        max_workers=WORKER_PROCESSES,
+        mp_context=context,
+        initializer=use_shared_slots,
+        initargs=(ffmpeg_slots,),
+    )
+
+
+def worker_loop():
+    """
+    Забирает задачи из очереди и выполняет их в пуле процессов.
+    Запуск: python -m mementonos.worker_service
+    """
+    logger.info(f"Воркер запущен, процессов: {WORKER_PROCESSES}")
+    logger.info(f"Поставлено догоняющих задач: {backfill_jobs()}")
+    # spawn: дочерним процессам не достаются соединения с БД родителя
+    context = multiprocessing.get_context("spawn")
+    running = {}
+    last_stats = 0.0
+    last_upload_gc = 0.0
+    last_failed_prune = 0.0
+    pool = _new_pool(context)
+    try:
+        while True:
+            recovered = recover_stale_jobs()
+            if recovered:
+                logger.warning(f"Возвращено в очередь зависших задач: {recovered}")
+
+            broken = False
+            while len(running) < WORKER_PROCESSES:
+                job = claim_job(LEASE_SECONDS)
+                if job is None:
+                    break
+                try:
+                    running[pool.submit(run_job, job.kind, job.payload)] = job
+                except BrokenProcessPool as e:
+                    fail_job(job.id, f"BrokenProcessPool: {e}")
+                    broken = True
+                    break
+
+            if not running:
+                time.sleep(POLL_INTERVAL)
+            else:
+                done, _ = wait(running, timeout=POLL_INTERVAL, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = running.pop(future)
+                    try:
+                        future.result()
+                        complete_job(job.id)
+                    except RetryLater as e:
+                        defer_job(job.id, str(e))
+                    except BrokenProcessPool as e:
+                        # Какой из процессов упал (OOM в PIL/ffmpeg), не узнать: попытку теряют
+                        # все выполнявшиеся задачи, так «ядовитая» задача в итоге станет failed
+                        logger.error(f"Пул процессов сломан, задача {job.kind}#{job.id} вернётся в очередь")
+                        fail_job(job.id, f"BrokenProcessPool: {e}")
+                        broken = True
+                    except Exception as e:
+                        logger.error(f"Ошибка задачи {job.kind}#{job.id} (попытка {job.attempts}): {e}")
+                        fail_job(job.id, f"{type(e).__name__}: {e}")
+
+            if broken:
+                for job in running.values():
+                    fail_job(job.id, "BrokenProcessPool")
+                running.clear()
+                pool.shutdown(wait=False, cancel_futures=True)
+                pool = _new_pool(context)
+                logger.warning("Пул процессов пересоздан")
+
+            renew_leases([job.id for job in running.values()], LEASE_SECONDS)
+
+            now = time.time()
+            if now - last_stats > STATS_INTERVAL:
+                logger.info(f"Очередь: {queue_stats()}, выполняется: {len(running)}")
+                last_stats = now
+            if now - last_upload_gc > UPLOAD_GC_INTERVAL:
+                collected = collect_abandoned_uploads()
+                if collected:
+                    logger.info(f"Удалено брошенных загрузок: {collected}")
+                last_upload_gc = now
+            if now - last_failed_prune > FAILED_PRUNE_INTERVAL:
+                pruned = prune_failed_jobs()
+                if pruned:
+                    logger.info(f"Удалено старых failed-задач: {pruned}")
+                last_failed_prune = now
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+if __name__ == "__main__":
+    worker_loop()